@@ -0,0 +1,7 @@
+#
+#
+#
+
+'''Измерение производительности составления расписания и методов чтения
+на синтетических университетах разного размера.
+Запуск: python -m benchmark (см. python -m benchmark --help)'''
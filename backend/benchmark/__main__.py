@@ -0,0 +1,115 @@
+#
+#
+#
+
+'''Запуск измерений производительности. Результаты записываются в JSON
+(ключи упорядочены, чтобы файлы разных коммитов удобно сравнивать),
+--compare выводит отношение медиан к результатам из другого файла'''
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+from typing import Optional
+
+import sqlalchemy
+
+from benchmark.dataset import SCALES
+from benchmark.runner import run_scale
+
+
+def _commit() -> Optional[str]:
+    '''Текущий коммит git (None - не удалось определить)'''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(old: dict, new: dict) -> None:
+    '''Выводит медианы времени операций и их отношение (new / old)
+    для размеров и операций, которые есть в обоих результатах'''
+    print(f'{"размер":<8} {"операция":<20} {"было, с":>10} {"стало, с":>10} {"отношение":>10}')
+    for scale, result in new['scales'].items():
+        old_result = old['scales'].get(scale)
+        if old_result is None:
+            continue
+        for name, stats in result['operations'].items():
+            old_stats = old_result['operations'].get(name)
+            if old_stats is None:
+                continue
+            ratio = stats['median'] / old_stats['median'] \
+                if old_stats['median'] else float('inf')
+            print(
+                f'{scale:<8} {name:<20} {old_stats["median"]:>10.4f} '
+                f'{stats["median"]:>10.4f} {ratio:>10.2f}'
+            )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmark',
+        description='Измерение производительности на синтетических университетах'
+    )
+    parser.add_argument(
+        '--scales', nargs='+', choices=list(SCALES), default=['tiny', 'small'],
+        help='размеры университетов'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='число повторов')
+    parser.add_argument('--warmup', type=int, default=1, help='число прогревов')
+    parser.add_argument('--seed', type=int, default=0, help='seed данных')
+    parser.add_argument(
+        '--output', default='benchmark.json', help='файл результатов (JSON)'
+    )
+    parser.add_argument(
+        '--compare', help='файл результатов для сравнения (например, другого коммита)'
+    )
+    args = parser.parse_args()
+    if args.repeat < 1 or args.warmup < 0:
+        parser.error('repeat должно быть не меньше 1, warmup - не меньше 0')
+
+    results = {
+        'environment': {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat()
+        },
+        'settings': {
+            'repeat': args.repeat, 'warmup': args.warmup, 'seed': args.seed
+        },
+        'scales': {}
+    }
+    for name in args.scales:
+        results['scales'][name] = run_scale(
+            name, SCALES[name]._replace(seed=args.seed), args.repeat, args.warmup,
+            log=lambda message: print(message, file=sys.stderr)
+        )
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2, sort_keys=True)
+
+    print(f'{"размер":<8} {"операция":<20} {"медиана, с":>10} {"запросов":>9} {"память, МБ":>11}')
+    for scale, result in results['scales'].items():
+        for name, stats in result['operations'].items():
+            print(
+                f'{scale:<8} {name:<20} {stats["median"]:>10.4f} '
+                f'{stats["queries"]:>9} {stats["peak_memory"] / 2**20:>11.1f}'
+            )
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            old = json.load(file)
+        print()
+        _compare(old, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
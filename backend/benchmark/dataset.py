@@ -0,0 +1,29 @@
+#
+#
+#
+
+'''Модуль определяет размеры синтетических университетов для измерения
+производительности (университеты строит db.generator)'''
+
+from db.generator import GeneratorParams
+
+
+# Размеры по возрастанию: large - примерно крупный университет
+SCALES = {
+    'tiny': GeneratorParams(
+        faculties=2, departments=2, groups=40, teachers=16,
+        classrooms=12, subjects=20, curricula=160
+    ),
+    'small': GeneratorParams(
+        faculties=5, departments=4, groups=500, teachers=200,
+        classrooms=60, subjects=150, curricula=2000
+    ),
+    'medium': GeneratorParams(
+        faculties=20, departments=5, groups=2000, teachers=800,
+        classrooms=220, subjects=500, curricula=8000
+    ),
+    'large': GeneratorParams(
+        faculties=50, departments=6, groups=5000, teachers=2000,
+        classrooms=540, subjects=1200, curricula=20000
+    )
+}
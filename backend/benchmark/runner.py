@@ -0,0 +1,128 @@
+#
+#
+#
+
+'''Модуль определяет измерение операций БД: время выполнения (после
+прогрева, по нескольким повторам), число SQL-запросов и пик выделенной
+памяти. Перед каждым запуском операции кэши БД сбрасываются, т.е.
+измеряется построение результата по БД'''
+
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from sqlalchemy import Engine, event
+
+from db.generator import GeneratorParams
+from db.sql_db import SQLDatabase, get_database
+
+
+class QueryCounter:
+    '''Счётчик SQL-запросов, выполненных через engine'''
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args) -> None:
+        self.count += 1
+
+    def __enter__(self) -> 'QueryCounter':
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def measure(
+    db: SQLDatabase,
+    operation: Callable[[], object],
+    repeat: int,
+    warmup: int
+) -> dict:
+    '''Измеряет операцию: warmup запусков без измерения, repeat запусков
+    с измерением времени и ещё один - под tracemalloc (он замедляет
+    выполнение, поэтому время в нём не измеряется).
+    queries - число SQL-запросов одного запуска'''
+    for _ in range(warmup):
+        db.drop_caches()
+        operation()
+
+    times = []
+    with QueryCounter(db.engine) as counter:
+        for _ in range(repeat):
+            db.drop_caches()
+            counter.count = 0
+            started = time.perf_counter()
+            operation()
+            times.append(time.perf_counter() - started)
+
+    db.drop_caches()
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'times': times,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'queries': counter.count,
+        'peak_memory': peak
+    }
+
+
+def run_scale(
+    name: str,
+    params: GeneratorParams,
+    repeat: int = 3,
+    warmup: int = 1,
+    log: Optional[Callable[[str], None]] = None
+) -> dict:
+    '''Генерирует университет с параметрами params во временном файле SQLite
+    и измеряет операции:
+    - auto_schedule - пробное составление всего расписания
+    - find_collisions, get_schedule, get_curriculum, get_university_data -
+    после того, как составленное расписание сохранено в БД'''
+    log = log or (lambda message: None)
+    with tempfile.TemporaryDirectory() as directory:
+        db = get_database(
+            'sqlite:///' + os.path.join(directory, 'benchmark.sqlite')
+        )
+        try:
+            started = time.perf_counter()
+            db.generate_university(params)
+            generation = time.perf_counter() - started
+            log(f'{name}: данные сгенерированы за {generation:.2f} с')
+
+            operations = {}
+            operations['auto_schedule'] = measure(
+                db, lambda: db.auto_schedule(dry_run=True), repeat, warmup
+            )
+            log(f'{name}: auto_schedule')
+            report = db.auto_schedule()
+
+            for operation_name, operation in (
+                ('find_collisions', db.find_collisions),
+                ('get_schedule', db.get_schedule),
+                ('get_curriculum', db.get_curriculum),
+                ('get_university_data', db.get_university_data)
+            ):
+                operations[operation_name] = measure(db, operation, repeat, warmup)
+                log(f'{name}: {operation_name}')
+        finally:
+            db.engine.dispose()
+
+    return {
+        'params': params._asdict(),
+        'generation_seconds': generation,
+        'lessons': len(report.lessons),
+        'unplaced': len(report.unplaced),
+        'operations': operations
+    }
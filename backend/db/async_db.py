@@ -0,0 +1,250 @@
+#
+#
+#
+
+'''Модуль определяет асинхронный интерфейс к БД для веб-API'''
+
+import functools
+from typing import Any, Callable, Optional
+
+import anyio
+
+from db.main_db import (
+    Database, CourseEnum, LessonType, ScheduleMode, UniversityData,
+    UniversityNodeData,
+    SubjectsData, FlowsData, CurriculumData, ClassroomData, ScheduleData,
+    BulkIngestData, BulkIngestResult, ScheduleJobData, ScheduleReport,
+    ScheduleChangesData, SlowQueryData
+)
+
+
+class AsyncDatabase:
+    '''Асинхронная обёртка над Database. Методы БД выполняются в потоках
+    вне цикла событий, причём для разных видов работы используются
+    отдельные ограничители потоков:
+    - чтение - до read_threads потоков одновременно
+    - запись - по одной (SQLite допускает одного писателя, поэтому очередь
+    ожидает здесь, а не занимает потоки, блокируясь на БД)
+    - составление расписания - по одному, чтобы тяжёлые вычисления
+    не занимали потоки, обслуживающие чтение
+    Операции с задачами составления расписания и поиск коллизий (отчёт
+    берётся из индекса занятости) короткие и не ждут завершения
+    составления, поэтому выполняются вместе с чтением'''
+    def __init__(self, db: Database, read_threads: int = 16) -> None:
+        self.db = db
+        self._reads = anyio.CapacityLimiter(read_threads)
+        self._writes = anyio.CapacityLimiter(1)
+        self._scheduling = anyio.CapacityLimiter(1)
+
+    @staticmethod
+    async def _run(
+        limiter: anyio.CapacityLimiter,
+        func: Callable,
+        *args: Any
+    ) -> Any:
+        '''Выполняет func(*args) в отдельном потоке'''
+        return await anyio.to_thread.run_sync(
+            functools.partial(func, *args), limiter=limiter
+        )
+
+    async def add_structural_divizion(
+        self,
+        parent_id: Optional[int],
+        name: str,
+        short_name: Optional[str]
+    ) -> int:
+        return await self._run(
+            self._writes, self.db.add_structural_divizion,
+            parent_id, name, short_name
+        )
+
+    async def add_speciality(self, department_id: int, name: str) -> int:
+        return await self._run(
+            self._writes, self.db.add_speciality, department_id, name
+        )
+
+    async def add_group(
+        self,
+        speciality_id: int,
+        name: str,
+        course: CourseEnum,
+        student_count: int
+    ) -> int:
+        return await self._run(
+            self._writes, self.db.add_group,
+            speciality_id, name, course, student_count
+        )
+
+    async def add_teacher(self, department_id: int, name: str) -> int:
+        return await self._run(
+            self._writes, self.db.add_teacher, department_id, name
+        )
+
+    async def add_classroom(
+        self,
+        faculty_id: int,
+        department_id: Optional[int],
+        name: str,
+        capacity: int
+    ) -> int:
+        return await self._run(
+            self._writes, self.db.add_classroom,
+            faculty_id, department_id, name, capacity
+        )
+
+    async def add_subject(self, name: str, short_name: str) -> int:
+        return await self._run(
+            self._writes, self.db.add_subject, name, short_name
+        )
+
+    async def add_flow(self, groups: list[str]) -> int:
+        return await self._run(self._writes, self.db.add_flow, groups)
+
+    async def add_lesson_to_plan(
+        self,
+        subject_id: int,
+        hours: int,
+        primary_teacher_id: int,
+        secondary_teacher_id: Optional[int],
+        group_id: Optional[int],
+        flow_id: Optional[int]
+    ) -> int:
+        return await self._run(
+            self._writes, self.db.add_lesson_to_plan,
+            subject_id, hours, primary_teacher_id,
+            secondary_teacher_id, group_id, flow_id
+        )
+
+    async def add_lesson_to_schedule(
+        self,
+        week: int,
+        day: int,
+        pair: int,
+        classroom_id: int,
+        curriculum_id: int,
+        lesson_type: LessonType,
+        strict: bool = False
+    ) -> int:
+        return await self._run(
+            self._writes, self.db.add_lesson_to_schedule,
+            week, day, pair, classroom_id, curriculum_id, lesson_type, strict
+        )
+
+    async def bulk_ingest(self, data: BulkIngestData) -> BulkIngestResult:
+        return await self._run(self._writes, self.db.bulk_ingest, data)
+
+    async def get_university_data(self) -> list[UniversityData]:
+        return await self._run(self._reads, self.db.get_university_data)
+
+    async def get_university_subtree(
+        self,
+        department_id: int,
+        depth: int = 1
+    ) -> UniversityNodeData:
+        return await self._run(
+            self._reads, self.db.get_university_subtree, department_id, depth
+        )
+
+    async def get_subjects(self) -> list[SubjectsData]:
+        return await self._run(self._reads, self.db.get_subjects)
+
+    async def get_flows(self) -> list[FlowsData]:
+        return await self._run(self._reads, self.db.get_flows)
+
+    async def get_curriculum(
+        self,
+        department_id: Optional[int] = None
+    ) -> list[CurriculumData]:
+        return await self._run(
+            self._reads, self.db.get_curriculum, department_id
+        )
+
+    async def get_classrooms(
+        self,
+        department_id: Optional[int] = None
+    ) -> list[ClassroomData]:
+        return await self._run(
+            self._reads, self.db.get_classrooms, department_id
+        )
+
+    async def get_schedule(self, *filters: Any) -> ScheduleData:
+        '''filters - фильтры Database.get_schedule'''
+        return await self._run(self._reads, self.db.get_schedule, *filters)
+
+    async def get_schedule_json(self, *filters: Any) -> bytes:
+        '''filters - фильтры Database.get_schedule'''
+        return await self._run(self._reads, self.db.get_schedule_json, *filters)
+
+    async def get_schedule_msgpack(self, *filters: Any) -> bytes:
+        '''filters - фильтры Database.get_schedule'''
+        return await self._run(
+            self._reads, self.db.get_schedule_msgpack, *filters
+        )
+
+    async def edit_schedule_cell(
+        self,
+        id: int,
+        classroom_id: int,
+        curriculum_id: int,
+        lesson_type: LessonType,
+        strict: bool = False
+    ) -> None:
+        return await self._run(
+            self._writes, self.db.edit_schedule_cell,
+            id, classroom_id, curriculum_id, lesson_type, strict
+        )
+
+    async def remove_schedule_cell(self, id: int) -> None:
+        return await self._run(self._writes, self.db.remove_schedule_cell, id)
+
+    async def get_schedule_changes(
+        self,
+        since: int = 0,
+        group_id: Optional[int] = None,
+        teacher_id: Optional[int] = None
+    ) -> ScheduleChangesData:
+        return await self._run(
+            self._reads, self.db.get_schedule_changes,
+            since, group_id, teacher_id
+        )
+
+    async def auto_schedule(
+        self,
+        mode: ScheduleMode = ScheduleMode.GREEDY,
+        time_budget: float = 10.0,
+        seed: Optional[int] = None,
+        starts: Optional[int] = None,
+        dry_run: bool = False
+    ) -> ScheduleReport:
+        return await self._run(
+            self._scheduling, self.db.auto_schedule,
+            mode, time_budget, seed, starts, None, dry_run
+        )
+
+    async def create_schedule_job(
+        self,
+        mode: ScheduleMode = ScheduleMode.GREEDY,
+        time_budget: float = 10.0,
+        seed: Optional[int] = None,
+        starts: Optional[int] = None,
+        dry_run: bool = False
+    ) -> int:
+        return await self._run(
+            self._reads, self.db.create_schedule_job,
+            mode, time_budget, seed, starts, dry_run
+        )
+
+    async def run_schedule_job(self, id: int) -> None:
+        return await self._run(self._scheduling, self.db.run_schedule_job, id)
+
+    async def get_schedule_job(self, id: int) -> ScheduleJobData:
+        return await self._run(self._reads, self.db.get_schedule_job, id)
+
+    async def cancel_schedule_job(self, id: int) -> None:
+        return await self._run(self._reads, self.db.cancel_schedule_job, id)
+
+    async def find_collisions(self) -> dict:
+        return await self._run(self._reads, self.db.find_collisions)
+
+    async def get_slow_queries(self) -> list[SlowQueryData]:
+        return await self._run(self._reads, self.db.get_slow_queries)
@@ -0,0 +1,267 @@
+#
+#
+#
+
+'''Модуль определяет генератор синтетического университета для нагрузочных
+тестов и настройки составления расписания. Университет строится
+детерминированно (по seed) в виде строк таблиц с заранее назначенными id
+и записывается пакетными INSERT (SQLAlchemy Core) в одной транзакции,
+см. SQLDatabase.generate_university.
+Запуск из командной строки: python -m db.generator <адрес БД> [параметры]'''
+
+import argparse
+import random
+import time
+from typing import NamedTuple
+
+from db.main_db import CourseEnum
+from db.models import (
+    Department, Specialty, FlowGroupLink, Group, Flow, Classroom, Subject,
+    Teacher, Curriculum
+)
+
+
+# Допустимые часы занятий учебного плана (см. Curriculum)
+HOURS = (72, 108, 144)
+# Специальностей на кафедре
+SPECIALITIES_PER_DEPARTMENT = 2
+# Каждая какая аудитория - поточная (аудитория факультета большой вместимости)
+LECTURE_HALL_EVERY = 5
+
+# Таблицы в порядке записи (ссылки - только на предыдущие таблицы)
+TABLES = (
+    Department, Specialty, Group, Teacher, Classroom, Subject, Flow,
+    FlowGroupLink, Curriculum
+)
+
+
+class GeneratorParams(NamedTuple):
+    '''Параметры синтетического университета:
+    - name, short_name - название университета; short_name входит
+    в названия всех записей, поэтому университеты с разными short_name
+    можно сгенерировать в одной БД
+    - faculties - число факультетов, departments - кафедр на факультете
+    - groups, teachers, classrooms, subjects, curricula - число записей
+    - flow_ratio - доля занятий учебного плана, проводимых у потоков
+    - flow_size - число групп в потоке (потоки - из групп одной специальности)
+    - hours_weights - относительные частоты часов 72, 108 и 144
+    - secondary_teacher_ratio - доля занятий со вторым преподавателем
+    - seed - начальное значение генератора случайных чисел'''
+    name: str = 'Синтетический университет'
+    short_name: str = 'СУ'
+    faculties: int = 5
+    departments: int = 4
+    groups: int = 500
+    teachers: int = 200
+    classrooms: int = 60
+    subjects: int = 150
+    curricula: int = 2000
+    flow_ratio: float = 0.2
+    flow_size: int = 3
+    hours_weights: tuple[float, float, float] = (1.0, 1.0, 1.0)
+    secondary_teacher_ratio: float = 0.1
+    seed: int = 0
+
+
+def check_params(params: GeneratorParams) -> None:
+    '''Проверяет параметры, при ошибке - ValueError'''
+    for field in (
+        'faculties', 'departments', 'groups', 'teachers', 'classrooms',
+        'subjects', 'flow_size'
+    ):
+        if getattr(params, field) < 1:
+            raise ValueError(f"Параметр {field} должен быть не меньше 1")
+    if params.curricula < 0:
+        raise ValueError("Параметр curricula должен быть не меньше 0")
+    for field in ('flow_ratio', 'secondary_teacher_ratio'):
+        if not 0 <= getattr(params, field) <= 1:
+            raise ValueError(f"Параметр {field} должен быть от 0 до 1")
+    if len(params.hours_weights) != len(HOURS) \
+            or any(weight < 0 for weight in params.hours_weights) \
+            or not sum(params.hours_weights):
+        raise ValueError(
+            "Частоты часов - три неотрицательных числа (для 72, 108 и 144), "
+            "хотя бы одно больше нуля"
+        )
+
+
+def build_university(
+    params: GeneratorParams,
+    first_ids: dict[type, int]
+) -> dict[type, list[dict]]:
+    '''Строит строки таблиц университета: {таблица: [строка]}.
+    first_ids - первый свободный id для каждой таблицы с автоматическим id.
+    Если предметов не хватает, чтобы у группы или потока они
+    не повторялись, - ValueError'''
+    check_params(params)
+    rng = random.Random(params.seed)
+    ids = dict(first_ids)
+
+    def next_id(table: type) -> int:
+        ids[table] += 1
+        return ids[table] - 1
+
+    prefix = params.short_name
+    university_id = next_id(Department)
+    departments = [{
+        'id': university_id, 'name': params.name,
+        'short_name': prefix, 'parent_id': None
+    }]
+    # (id факультета, id кафедры)
+    chairs = []
+    for f in range(1, params.faculties + 1):
+        faculty_id = next_id(Department)
+        departments.append({
+            'id': faculty_id, 'name': f'{prefix}: Факультет {f}',
+            'short_name': f'{prefix}-Ф{f}', 'parent_id': university_id
+        })
+        for d in range(1, params.departments + 1):
+            chair_id = next_id(Department)
+            chairs.append((faculty_id, chair_id))
+            departments.append({
+                'id': chair_id, 'name': f'{prefix}: Кафедра {f}.{d}',
+                'short_name': f'{prefix}-К{f}.{d}', 'parent_id': faculty_id
+            })
+
+    specialities = []
+    for _, chair_id in chairs:
+        for _ in range(SPECIALITIES_PER_DEPARTMENT):
+            specialities.append({
+                'id': next_id(Specialty),
+                'name': f'{prefix}: Специальность {len(specialities) + 1}',
+                'department_id': chair_id
+            })
+    courses = list(CourseEnum)
+    groups = [
+        {
+            'id': next_id(Group), 'name': f'{prefix}-{g}',
+            'course': rng.choice(courses),
+            'specialty_id': specialities[(g - 1) % len(specialities)]['id'],
+            'student_count': rng.randint(15, 30)
+        }
+        for g in range(1, params.groups + 1)
+    ]
+    teachers = [
+        {
+            'id': next_id(Teacher), 'full_name': f'Преподаватель {prefix}-{t}',
+            'department_id': chairs[(t - 1) % len(chairs)][1]
+        }
+        for t in range(1, params.teachers + 1)
+    ]
+    classrooms = []
+    for c in range(1, params.classrooms + 1):
+        faculty_id, chair_id = chairs[(c - 1) % len(chairs)]
+        lecture_hall = c % LECTURE_HALL_EVERY == 1
+        classrooms.append({
+            'id': next_id(Classroom), 'name': f'{prefix}-А{c}',
+            'capacity': rng.randint(80, 120) if lecture_hall else rng.randint(30, 40),
+            'faculty_id': faculty_id,
+            'department_id': None if lecture_hall else chair_id
+        })
+    subjects = [
+        {
+            'id': next_id(Subject), 'name': f'{prefix}: Предмет {s}',
+            'short_name': f'{prefix}-П{s}'
+        }
+        for s in range(1, params.subjects + 1)
+    ]
+
+    # Потоки - соседние группы одной специальности
+    flows = []
+    flow_groups = []
+    by_speciality = {}
+    for group in groups:
+        by_speciality.setdefault(group['specialty_id'], []).append(group['id'])
+    for group_ids in by_speciality.values():
+        for start in range(0, len(group_ids) - params.flow_size + 1, params.flow_size):
+            flow_id = next_id(Flow)
+            flows.append({'id': flow_id})
+            flow_groups.extend(
+                {'flow_id': flow_id, 'group_id': group_id}
+                for group_id in group_ids[start:start + params.flow_size]
+            )
+
+    # Предметы группы или потока не повторяются: k-е занятие получает
+    # предмет со случайным для группы (потока) сдвигом + k
+    subject_offsets = {}
+    subject_counts = {}
+    curricula = []
+    hours = rng.choices(HOURS, weights=params.hours_weights, k=params.curricula)
+    for number in range(params.curricula):
+        if flows and rng.random() < params.flow_ratio:
+            target = ('flow_id', rng.choice(flows)['id'])
+        else:
+            # Каждой группе достаётся примерно поровну занятий
+            target = ('group_id', groups[number % len(groups)]['id'])
+        count = subject_counts.get(target, 0)
+        if count >= len(subjects):
+            raise ValueError(
+                "Предметов меньше, чем занятий учебного плана у группы или потока"
+            )
+        subject_counts[target] = count + 1
+        if target not in subject_offsets:
+            subject_offsets[target] = rng.randrange(len(subjects))
+        subject = subjects[(subject_offsets[target] + count) % len(subjects)]
+
+        primary = rng.randrange(len(teachers))
+        secondary = None
+        if len(teachers) > 1 and rng.random() < params.secondary_teacher_ratio:
+            secondary = (primary + rng.randrange(1, len(teachers))) % len(teachers)
+        row = {
+            'id': next_id(Curriculum), 'subject_id': subject['id'],
+            'hours': hours[number],
+            'primary_teacher_id': teachers[primary]['id'],
+            'secondary_teacher_id':
+                teachers[secondary]['id'] if secondary is not None else None,
+            'group_id': None, 'flow_id': None
+        }
+        row[target[0]] = target[1]
+        curricula.append(row)
+
+    return {
+        Department: departments, Specialty: specialities, Group: groups,
+        Teacher: teachers, Classroom: classrooms, Subject: subjects,
+        Flow: flows, FlowGroupLink: flow_groups, Curriculum: curricula
+    }
+
+
+def main() -> int:
+    '''Генерация университета в БД из командной строки'''
+    from db.sql_db import get_database
+
+    defaults = GeneratorParams()
+    parser = argparse.ArgumentParser(
+        prog='python -m db.generator',
+        description='Генерация синтетического университета'
+    )
+    parser.add_argument('db_url', help='адрес БД, например sqlite:///load.sqlite')
+    for field, value in defaults._asdict().items():
+        if field == 'hours_weights':
+            parser.add_argument(
+                '--hours-weights', type=float, nargs=3, default=list(value),
+                metavar=('W72', 'W108', 'W144'),
+                help='относительные частоты часов 72, 108 и 144'
+            )
+        else:
+            parser.add_argument(
+                '--' + field.replace('_', '-'), type=type(value), default=value
+            )
+    args = vars(parser.parse_args())
+    db_url = args.pop('db_url')
+    args['hours_weights'] = tuple(args['hours_weights'])
+    params = GeneratorParams(**args)
+
+    db = get_database(db_url)
+    started = time.perf_counter()
+    try:
+        counts = db.generate_university(params)
+    except ValueError as e:
+        parser.exit(1, f'Ошибка: {e}\n')
+    print(f'Сгенерировано за {time.perf_counter() - started:.2f} с:')
+    for table, count in counts.items():
+        print(f'  {table}: {count}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -6,10 +6,12 @@
 
 import abc
 from enum import Enum
-from typing import Optional
+from typing import Callable, NamedTuple, Optional
 
 from pydantic import BaseModel
 
+from utils.encoding import to_json, to_msgpack
+
 
 class CourseEnum(str, Enum):
     """Возможные значения курса"""
@@ -32,6 +34,38 @@ class LessonType(str, Enum):
     LAB = "лабораторное"
 
 
+class ScheduleMode(str, Enum):
+    """Режимы автоматического составления расписания"""
+    GREEDY = "greedy"           # Первая свободная ячейка
+    ANNEALING = "annealing"     # Жадное решение, улучшенное отжигом
+    MULTISTART = "multistart"   # Лучшее из нескольких жадных решений
+
+
+class UnplacedReason(str, Enum):
+    """Причины, по которым занятие не размещено в расписании"""
+    INVALID_HOURS = "invalid_hours"     # Часы не соответствуют шаблонам
+    NO_GROUPS = "no_groups"             # У занятия нет групп
+    NO_CLASSROOM = "no_classroom"       # Нет аудитории нужной вместимости
+    NO_FREE_SLOT = "no_free_slot"       # Нет свободной ячейки
+    SLOT_TAKEN = "slot_taken"           # Ячейку заняли во время составления
+
+
+class ChangeAction(str, Enum):
+    """Виды изменений занятий в журнале изменений расписания"""
+    INSERTED = "inserted"
+    UPDATED = "updated"
+    DELETED = "deleted"
+
+
+class JobStatus(str, Enum):
+    """Состояния задачи составления расписания"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
 class GroupData(BaseModel):
     '''Вспомогательный тип данных для структуры университета
     для get_university_data. Содержит данные о группах'''
@@ -58,7 +92,8 @@ class LecturerData(BaseModel):
 
 class ClassroomData(BaseModel):
     '''Вспомогательный тип данных для структуры университета
-    для get_university_data. Содержит данные об аудиториях'''
+    для get_university_data (также используется в get_classrooms).
+    Содержит данные об аудиториях'''
     id: int
     number: str
     capacity: int
@@ -93,6 +128,28 @@ class UniversityData(BaseModel):
     faculties: list[FacultyData]
 
 
+class UniversityNodeData(BaseModel):
+    '''Подразделение в структуре университета для get_university_subtree.
+    Для развёрнутого подразделения заполнены списки children (дочерние
+    подразделения), specialities, lecturers и classrooms (аудитории
+    подразделения, а для факультета - не относящиеся ни к одной кафедре),
+    для свёрнутого - None. Поля *_count заполнены всегда'''
+    id: int
+    name: str
+    short_name: Optional[str] = None
+    children_count: int
+    specialities_count: int
+    lecturers_count: int
+    classrooms_count: int
+    children: Optional[list['UniversityNodeData']] = None
+    specialities: Optional[list[SpecialityData]] = None
+    lecturers: Optional[list[LecturerData]] = None
+    classrooms: Optional[list[ClassroomData]] = None
+
+
+UniversityNodeData.update_forward_refs()
+
+
 class SubjectsData(BaseModel):
     '''Данные о предметах для метода get_subjects'''
     id: int
@@ -148,6 +205,213 @@ class ScheduleData(BaseModel):
     ]
 
 
+class ScheduleChangeData(BaseModel):
+    '''Изменение занятия расписания для get_schedule_changes.
+    Занятия не переносятся в другие пары, поэтому клиент удаляет ячейки
+    занятия lesson_id в паре week/day/pair, а для добавленного
+    и изменённого занятия ставит ячейку cell в строки групп groups.
+    group_ids, teacher_ids - id групп и преподавателей занятия.
+    Для удалённого занятия groups, cell, group_ids и teacher_ids - None'''
+    lesson_id: int
+    action: ChangeAction
+    week: int
+    day: int
+    pair: int
+    groups: Optional[list[str]] = None
+    cell: Optional[ScheduleCellData] = None
+    group_ids: Optional[list[int]] = None
+    teacher_ids: Optional[list[int]] = None
+
+
+class ScheduleChangesData(BaseModel):
+    '''Изменения расписания для get_schedule_changes.
+    version - текущая версия расписания (since следующего запроса).
+    Если изменения после запрошенной версии не сохранились в журнале,
+    full = True, а schedule содержит всё расписание'''
+    version: int
+    full: bool = False
+    changes: list[ScheduleChangeData] = []
+    schedule: Optional[ScheduleData] = None
+
+
+class BulkDepartmentData(BaseModel):
+    '''Подразделение для пакетной загрузки. Родитель указывается либо
+    по id (уже есть в БД), либо по названию (в БД или в том же пакете)'''
+    name: str
+    short_name: Optional[str] = None
+    parent_id: Optional[int] = None
+    parent_name: Optional[str] = None
+
+
+class BulkSpecialityData(BaseModel):
+    '''Специальность для пакетной загрузки'''
+    name: str
+    department_id: Optional[int] = None
+    department_name: Optional[str] = None
+
+
+class BulkGroupData(BaseModel):
+    '''Группа для пакетной загрузки'''
+    name: str
+    course: CourseEnum
+    student_count: int
+    speciality_id: Optional[int] = None
+    speciality_name: Optional[str] = None
+
+
+class BulkTeacherData(BaseModel):
+    '''Преподаватель для пакетной загрузки'''
+    full_name: str
+    department_id: Optional[int] = None
+    department_name: Optional[str] = None
+
+
+class BulkClassroomData(BaseModel):
+    '''Аудитория для пакетной загрузки. Факультет обязателен,
+    кафедра - нет'''
+    name: str
+    capacity: int
+    faculty_id: Optional[int] = None
+    faculty_name: Optional[str] = None
+    department_id: Optional[int] = None
+    department_name: Optional[str] = None
+
+
+class BulkSubjectData(BaseModel):
+    '''Предмет для пакетной загрузки'''
+    name: str
+    short_name: str
+
+
+class BulkFlowData(BaseModel):
+    '''Поток для пакетной загрузки.
+    key - ключ, по которому на поток ссылается учебный план из того же пакета
+    groups - названия групп (из БД или из того же пакета)'''
+    key: str
+    groups: list[str]
+
+
+class BulkCurriculumData(BaseModel):
+    '''Занятие учебного плана для пакетной загрузки. Предмет, преподаватели
+    и группа указываются по id либо по названию, поток - по id либо по ключу
+    из того же пакета'''
+    hours: int
+    subject_id: Optional[int] = None
+    subject_name: Optional[str] = None
+    primary_teacher_id: Optional[int] = None
+    primary_teacher_name: Optional[str] = None
+    secondary_teacher_id: Optional[int] = None
+    secondary_teacher_name: Optional[str] = None
+    group_id: Optional[int] = None
+    group_name: Optional[str] = None
+    flow_id: Optional[int] = None
+    flow_key: Optional[str] = None
+
+
+class BulkIngestData(BaseModel):
+    '''Пакет данных для метода bulk_ingest'''
+    departments: list[BulkDepartmentData] = []
+    specialities: list[BulkSpecialityData] = []
+    groups: list[BulkGroupData] = []
+    teachers: list[BulkTeacherData] = []
+    classrooms: list[BulkClassroomData] = []
+    subjects: list[BulkSubjectData] = []
+    flows: list[BulkFlowData] = []
+    curriculum: list[BulkCurriculumData] = []
+
+
+class BulkIngestError(BaseModel):
+    '''Ошибка в строке пакета: section - раздел пакета (например, groups),
+    index - номер строки в разделе'''
+    section: str
+    index: int
+    message: str
+
+
+class BulkIngestResult(BaseModel):
+    '''Результат пакетной загрузки.
+    ids - id добавленных записей по разделам в порядке строк пакета
+    (None, если строка не добавлена)
+    errors - ошибки в строках пакета'''
+    ids: dict[str, list[Optional[int]]]
+    errors: list[BulkIngestError]
+
+
+class PlacedLessonData(BaseModel):
+    '''Занятие, добавленное автоматическим составлением расписания
+    (id - None при пробном составлении)'''
+    id: Optional[int] = None
+    week: int
+    day: int
+    pair: int
+    classroom_id: int
+    curriculum_id: int
+    lesson_type: LessonType
+
+
+class UnplacedLessonData(BaseModel):
+    '''Не размещённое занятие учебного плана. lesson_type - None, если
+    не размещено ни одно занятие (неверные часы, нет групп)'''
+    curriculum_id: int
+    lesson_type: Optional[LessonType] = None
+    reason: UnplacedReason
+
+
+class ScheduleReport(BaseModel):
+    '''Результат автоматического составления расписания.
+    dry_run - пробное составление, расписание не изменено'''
+    dry_run: bool
+    lessons: list[PlacedLessonData]
+    unplaced: list[UnplacedLessonData]
+
+
+class ScheduleJobData(BaseModel):
+    '''Состояние задачи составления расписания для get_schedule_job.
+    curricula_total - число занятий учебного плана, требующих размещения,
+    curricula_processed - из них обработано,
+    lessons_placed, lessons_unplaced - размещено и не размещено занятий,
+    elapsed - время выполнения в секундах,
+    report - результат составления (после успешного завершения)'''
+    id: int
+    status: JobStatus
+    mode: ScheduleMode
+    dry_run: bool
+    curricula_total: int
+    curricula_processed: int
+    lessons_placed: int
+    lessons_unplaced: int
+    elapsed: float
+    error: Optional[str] = None
+    report: Optional[ScheduleReport] = None
+
+
+class SlowQueryData(BaseModel):
+    '''Медленный SQL-запрос.
+    started - время начала (UTC, ISO 8601), duration - время выполнения
+    в секундах, method - вызвавший запрос метод Database,
+    plan - план выполнения (EXPLAIN QUERY PLAN, для SQLite),
+    full_scans - таблицы, просматриваемые полностью (без индекса)'''
+    started: str
+    duration: float
+    statement: str
+    parameters: Optional[list] = None
+    method: Optional[str] = None
+    plan: Optional[list[str]] = None
+    full_scans: list[str] = []
+
+
+class ScheduleProgress(NamedTuple):
+    '''Ход составления расписания (см. ScheduleJobData)'''
+    curricula_total: int
+    curricula_processed: int
+    lessons_placed: int
+    lessons_unplaced: int
+
+
+class ScheduleCancelled(Exception):
+    '''Составление расписания отменено'''
+
+
 class Database(abc.ABC):
     '''Абстрактный класс для взаимодействия с любыми БД'''
     @abc.abstractmethod
@@ -227,9 +491,18 @@ class Database(abc.ABC):
         pair: int,
         classroom_id: int,
         curriculum_id: int,
-        lesson_type: LessonType
+        lesson_type: LessonType,
+        strict: bool = False
     ) -> int:
-        '''Добавляет занятие в расписание, возвращает id добавленной записи'''
+        '''Добавляет занятие в расписание, возвращает id добавленной записи.
+        В строгом режиме (strict) отклоняет занятие, если группа,
+        преподаватель или аудитория в эту пару уже заняты'''
+
+    @abc.abstractmethod
+    def bulk_ingest(self, data: BulkIngestData) -> BulkIngestResult:
+        '''Пакетно добавляет подразделения, специальности, группы,
+        преподавателей, аудитории, предметы, потоки и учебный план в одной
+        транзакции. Строки с ошибками пропускаются и попадают в errors'''
 
     @abc.abstractmethod
     def get_university_data(self) -> list[UniversityData]:
@@ -243,6 +516,18 @@ class Database(abc.ABC):
         - Аудитории факультетов (те, у которых не указан параметр кафедры)
         - Преподаватели'''
 
+    @abc.abstractmethod
+    def get_university_subtree(
+        self,
+        department_id: int,
+        depth: int = 1
+    ) -> UniversityNodeData:
+        '''Возвращает поддерево структуры университета с корнем
+        в подразделении department_id. depth - число развёрнутых уровней:
+        0 - только подразделение с числом дочерних записей, 1 - также его
+        специальности, преподаватели, аудитории и свёрнутые дочерние
+        подразделения и т.д.'''
+
     @abc.abstractmethod
     def get_subjects(self) -> list[SubjectsData]:
         '''Возвращает данные о предметах'''
@@ -252,12 +537,80 @@ class Database(abc.ABC):
         '''Возвращает данные о потоках (списках групп)'''
 
     @abc.abstractmethod
-    def get_curriculum(self) -> list[CurriculumData]:
-        '''Возвращает учебный план'''
+    def get_curriculum(
+        self,
+        department_id: Optional[int] = None
+    ) -> list[CurriculumData]:
+        '''Возвращает учебный план. department_id - только занятия групп
+        подразделения и всех его дочерних подразделений'''
 
     @abc.abstractmethod
-    def get_schedule(self) -> ScheduleData:
-        '''Возвращает расписание занятий'''
+    def get_classrooms(
+        self,
+        department_id: Optional[int] = None
+    ) -> list[ClassroomData]:
+        '''Возвращает аудитории. department_id - только аудитории, которые
+        могут использовать занятия подразделения: аудитории подразделения
+        и его дочерних подразделений, а также аудитории факультета,
+        не относящиеся ни к одной кафедре'''
+
+    @abc.abstractmethod
+    def get_schedule(
+        self,
+        group_id: Optional[int] = None,
+        group_name: Optional[str] = None,
+        teacher_id: Optional[int] = None,
+        classroom_id: Optional[int] = None,
+        flow_id: Optional[int] = None,
+        week: Optional[int] = None,
+        day: Optional[int] = None,
+        department_id: Optional[int] = None
+    ) -> ScheduleData:
+        '''Возвращает расписание занятий. Необязательные фильтры:
+        - group_id, group_name - занятия группы (в т.ч. занятия её потоков),
+        в ячейках остаётся только эта группа
+        - teacher_id - занятия преподавателя (основного или второго)
+        - classroom_id - занятия в аудитории
+        - flow_id - занятия потока
+        - week, day - неделя и день (в ответе остаются только они)
+        - department_id - занятия групп подразделения и всех его дочерних
+        подразделений, в ячейках остаются только эти группы'''
+
+    def get_schedule_json(
+        self,
+        group_id: Optional[int] = None,
+        group_name: Optional[str] = None,
+        teacher_id: Optional[int] = None,
+        classroom_id: Optional[int] = None,
+        flow_id: Optional[int] = None,
+        week: Optional[int] = None,
+        day: Optional[int] = None,
+        department_id: Optional[int] = None
+    ) -> bytes:
+        '''Возвращает расписание занятий (см. get_schedule),
+        сериализованное в JSON'''
+        return to_json(self.get_schedule(
+            group_id, group_name, teacher_id, classroom_id, flow_id, week, day,
+            department_id
+        ))
+
+    def get_schedule_msgpack(
+        self,
+        group_id: Optional[int] = None,
+        group_name: Optional[str] = None,
+        teacher_id: Optional[int] = None,
+        classroom_id: Optional[int] = None,
+        flow_id: Optional[int] = None,
+        week: Optional[int] = None,
+        day: Optional[int] = None,
+        department_id: Optional[int] = None
+    ) -> bytes:
+        '''Возвращает расписание занятий (см. get_schedule),
+        сериализованное в MessagePack'''
+        return to_msgpack(self.get_schedule(
+            group_id, group_name, teacher_id, classroom_id, flow_id, week, day,
+            department_id
+        ))
 
     @abc.abstractmethod
     def edit_schedule_cell(
@@ -265,18 +618,82 @@ class Database(abc.ABC):
         id: int,
         classroom_id: int,
         curriculum_id: int,
-        lesson_type: LessonType
+        lesson_type: LessonType,
+        strict: bool = False
     ) -> None:
-        '''Изменяет ячейку расписания занятий'''
+        '''Изменяет ячейку расписания занятий. В строгом режиме (strict)
+        отклоняет изменение, создающее наложение занятий'''
 
     @abc.abstractmethod
     def remove_schedule_cell(self, id: int) -> None:
         '''Удаляет ячейку расписания занятий'''
 
     @abc.abstractmethod
-    def auto_schedule(self) -> None:
-        '''Автоматическое составление расписания с учётом семестровой нагрузки'''
+    def get_schedule_changes(
+        self,
+        since: int = 0,
+        group_id: Optional[int] = None,
+        teacher_id: Optional[int] = None
+    ) -> ScheduleChangesData:
+        '''Возвращает изменения занятий расписания после версии since
+        (по одному на занятие; версия 0 - пустое расписание). Если
+        изменения после since уже удалены из журнала - всё расписание.
+        group_id, teacher_id - изменения расписания группы или
+        преподавателя (см. get_schedule); изменённое занятие, которое
+        больше не проходит фильтр, возвращается как удалённое'''
+
+    @abc.abstractmethod
+    def auto_schedule(
+        self,
+        mode: ScheduleMode = ScheduleMode.GREEDY,
+        time_budget: float = 10.0,
+        seed: Optional[int] = None,
+        starts: Optional[int] = None,
+        progress: Optional[Callable[[ScheduleProgress], None]] = None,
+        dry_run: bool = False
+    ) -> ScheduleReport:
+        '''Автоматическое составление расписания с учётом семестровой нагрузки.
+        mode - режим составления, для режима ANNEALING: time_budget - время
+        улучшения в секундах; для режима MULTISTART: starts - число
+        запусков (по умолчанию - число ядер процессора); seed -
+        начальное значение генератора случайных чисел.
+        progress - вызывается по ходу составления; может прервать его,
+        выбросив ScheduleCancelled (расписание при этом не изменяется).
+        dry_run - только вычислить размещение, не изменяя расписание.
+        Возвращает добавленные и не размещённые занятия'''
+
+    @abc.abstractmethod
+    def create_schedule_job(
+        self,
+        mode: ScheduleMode = ScheduleMode.GREEDY,
+        time_budget: float = 10.0,
+        seed: Optional[int] = None,
+        starts: Optional[int] = None,
+        dry_run: bool = False
+    ) -> int:
+        '''Создаёт задачу составления расписания (параметры - как
+        у auto_schedule) и возвращает её id. Для БД одновременно может
+        существовать только одна незавершённая задача'''
+
+    @abc.abstractmethod
+    def run_schedule_job(self, id: int) -> None:
+        '''Выполняет задачу составления расписания, сохраняя её ход
+        и результат'''
+
+    @abc.abstractmethod
+    def get_schedule_job(self, id: int) -> ScheduleJobData:
+        '''Возвращает состояние задачи составления расписания'''
+
+    @abc.abstractmethod
+    def cancel_schedule_job(self, id: int) -> None:
+        '''Отменяет задачу составления расписания. Выполняемая задача
+        прерывается при следующей проверке хода составления'''
 
     @abc.abstractmethod
     def find_collisions(self) -> dict:
         '''Поиск коллизий и окон в расписании'''
+
+    @abc.abstractmethod
+    def get_slow_queries(self) -> list[SlowQueryData]:
+        '''Возвращает последние медленные SQL-запросы (от новых к старым).
+        Если журнал медленных запросов не включён - ValueError'''
@@ -0,0 +1,246 @@
+#
+#
+#
+
+'''Модуль определяет таблицы реляционной БД'''
+
+from typing import List, Optional
+
+from sqlalchemy import Index
+from sqlmodel import Field, SQLModel, Relationship, CheckConstraint
+
+from db.main_db import (
+    LessonType, CourseEnum, ScheduleMode, JobStatus, ChangeAction
+)
+
+
+class Department(SQLModel, table=True):
+    """Структурное подразделение
+    Подразлеления без родителя - университет
+    Дочерние университету подразделения - факультеты
+    Дочерние факультетам - кафедры"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(index=True, unique=True)
+    short_name: Optional[str]
+    parent_id: Optional[int] = Field(default=None, foreign_key="department.id")
+
+    # Связь на самого себя для иерархии
+    parent: Optional["Department"] = Relationship(
+        back_populates="children", 
+        sa_relationship_kwargs={
+            "remote_side": "Department.id",
+            "foreign_keys": "Department.parent_id"
+        }
+    )
+    children: List["Department"] = Relationship(back_populates="parent")
+
+
+class Specialty(SQLModel, table=True):
+    """Специальность"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(index=True, unique=True)
+    department_id: int = Field(foreign_key="department.id")
+
+    department: Department = Relationship()
+
+
+class FlowGroupLink(SQLModel, table=True):
+    """Связь многие-ко-многим между Потоком и Группами"""
+    __table_args__ = (
+        # Потоки группы (фильтр расписания по группе)
+        Index("ix_flowgrouplink_group_flow", "group_id", "flow_id"),
+    )
+
+    flow_id: Optional[int] = Field(default=None, foreign_key="flow.id", primary_key=True)
+    group_id: Optional[int] = Field(default=None, foreign_key="group.id", primary_key=True)
+
+
+class Group(SQLModel, table=True):
+    """Группа"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(index=True, unique=True)
+    course: CourseEnum
+    specialty_id: int = Field(foreign_key="specialty.id")
+    student_count: int
+
+    specialty: Specialty = Relationship()
+    # Обратная связь для связи многие-ко-многим с Flow
+    flows: List["Flow"] = Relationship(back_populates="groups", link_model=FlowGroupLink)
+
+
+class Flow(SQLModel, table=True):
+    """Поток"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+    groups: List[Group] = Relationship(back_populates="flows", link_model=FlowGroupLink)
+
+
+class Classroom(SQLModel, table=True):
+    """Аудитория"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(index=True, unique=True)
+    capacity: int
+    faculty_id: int = Field(foreign_key="department.id")
+    department_id: Optional[int] = Field(foreign_key="department.id")
+
+    faculty: Department = Relationship(
+        sa_relationship_kwargs={"foreign_keys": "Classroom.faculty_id"}
+    )
+    department: Optional[Department] = Relationship(
+        sa_relationship_kwargs={"foreign_keys": "Classroom.department_id"}
+    )
+
+
+class Subject(SQLModel, table=True):
+    """Предмет"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(index=True, unique=True)
+    short_name: str
+
+
+class Teacher(SQLModel, table=True):
+    """Преподаватель"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    full_name: str = Field(index=True, unique=True)
+    department_id: int = Field(foreign_key="department.id")
+
+    department: Department = Relationship()
+
+
+class Curriculum(SQLModel, table=True):
+    """Учебный план"""
+    __table_args__ = (
+        CheckConstraint("hours IN (72, 108, 144)", name="hours_check"),
+        # Фильтры расписания по группе, потоку и преподавателю
+        Index("ix_curriculum_group", "group_id"),
+        Index("ix_curriculum_flow", "flow_id"),
+        Index("ix_curriculum_primary_teacher", "primary_teacher_id"),
+        Index("ix_curriculum_secondary_teacher", "secondary_teacher_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    subject_id: int = Field(foreign_key="subject.id")
+    hours: int
+    primary_teacher_id: int = Field(foreign_key="teacher.id")
+    secondary_teacher_id: Optional[int] = Field(foreign_key="teacher.id")
+    group_id: Optional[int] = Field(default=None, foreign_key="group.id")
+    flow_id: Optional[int] = Field(default=None, foreign_key="flow.id")
+
+    subject: Subject = Relationship()
+    primary_teacher: Teacher = Relationship(
+        sa_relationship_kwargs={"foreign_keys": "Curriculum.primary_teacher_id"}
+    )
+    secondary_teacher: Optional[Teacher] = Relationship(
+        sa_relationship_kwargs={
+            "foreign_keys": "Curriculum.secondary_teacher_id"
+        }
+    )
+    group: Optional[Group] = Relationship()
+    flow: Optional[Flow] = Relationship()
+
+
+class Lesson(SQLModel, table=True):
+    """Занятие в расписании"""
+    __table_args__ = (
+        CheckConstraint("week IN (1, 2)", name="week_check"),
+        CheckConstraint("day BETWEEN 1 AND 6", name="day_check"),
+        CheckConstraint("pair BETWEEN 1 AND 8", name="pair_check"),
+        # Занятия по учебному плану / аудитории с фильтром по неделе и дню
+        Index("ix_lesson_curriculum_slot", "curriculum_id", "week", "day", "pair"),
+        Index("ix_lesson_classroom_slot", "classroom_id", "week", "day", "pair"),
+        Index("ix_lesson_slot", "week", "day", "pair"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    week: int
+    day: int
+    pair: int
+    classroom_id: int = Field(foreign_key="classroom.id")
+    curriculum_id: int = Field(foreign_key="curriculum.id")
+    lesson_type: LessonType
+
+    classroom: Classroom = Relationship()
+    curriculum: Curriculum = Relationship()
+
+
+class LessonOccupancy(SQLModel, table=True):
+    """Занятость, создаваемая занятием расписания: по строке на каждую
+    группу (для потока - на каждую группу потока), преподавателя и аудиторию
+    занятия. Таблица денормализована и поддерживается в тех же транзакциях,
+    что изменяют занятия, учебный план и потоки
+    (см. SQLDatabase._refresh_occupancy).
+    kind - вид сущности (GROUP, TEACHER, CLASSROOM из utils.collisions)"""
+    __table_args__ = (
+        # Занятия сущности и занятость сущности в заданную пару
+        Index(
+            "ix_lessonoccupancy_entity_slot",
+            "kind", "entity_id", "week", "day", "pair"
+        ),
+    )
+
+    lesson_id: int = Field(foreign_key="lesson.id", primary_key=True)
+    kind: int = Field(primary_key=True)
+    entity_id: int = Field(primary_key=True)
+    week: int
+    day: int
+    pair: int
+
+
+class ScheduleRevision(SQLModel, table=True):
+    """Версии данных расписания (единственная строка с id = 1). Общие для
+    всех процессов, работающих с БД, по ним процессы узнают об изменениях,
+    сделанных другими процессами.
+    version - увеличивается при изменении любых данных, из которых строится
+    расписание (занятия, учебный план, аудитории, преподаватели, группы, потоки)
+    lesson_version - увеличивается только при изменении занятий расписания"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    version: int = 0
+    lesson_version: int = 0
+
+
+class ScheduleChange(SQLModel, table=True):
+    """Журнал изменений занятий расписания (только добавление записей).
+    version - версия занятий (ScheduleRevision.lesson_version), в которой
+    сделано изменение. Пара занятия не меняется, поэтому сохраняется и для
+    удалённых занятий. Старые записи удаляются (см. CHANGE_LOG_VERSIONS)"""
+    __table_args__ = (
+        Index("ix_schedulechange_version", "version"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    version: int
+    lesson_id: int
+    action: ChangeAction
+    week: int
+    day: int
+    pair: int
+
+
+class ScheduleJob(SQLModel, table=True):
+    """Задача автоматического составления расписания.
+    active - True, пока задача не завершена, затем NULL: уникальность
+    столбца не позволяет создать вторую незавершённую задачу.
+    cancel_requested - запрошена отмена выполняемой задачи.
+    Время - в секундах Unix time, updated_at - время последнего сохранения
+    хода выполнения (по нему находятся задачи, прерванные вместе
+    с процессом)"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    status: JobStatus = JobStatus.QUEUED
+    active: Optional[bool] = Field(default=True, unique=True)
+    mode: ScheduleMode
+    time_budget: float
+    seed: Optional[int] = None
+    starts: Optional[int] = None
+    dry_run: bool = False
+    curricula_total: int = 0
+    curricula_processed: int = 0
+    lessons_placed: int = 0
+    lessons_unplaced: int = 0
+    cancel_requested: bool = False
+    error: Optional[str] = None
+    # Результат составления (ScheduleReport в JSON)
+    report: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    updated_at: float
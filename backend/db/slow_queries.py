@@ -0,0 +1,157 @@
+#
+#
+#
+
+'''Модуль определяет журнал медленных SQL-запросов: запросы, выполнявшиеся
+дольше порога, сохраняются в кольцевом буфере вместе с параметрами,
+вызвавшим их методом Database и планом выполнения (для SQLite -
+EXPLAIN QUERY PLAN). Дополнительная работа (поиск метода, получение
+плана) выполняется только для медленных запросов'''
+
+import collections
+import datetime
+import sys
+import threading
+import time
+from typing import Any, Optional
+
+from sqlalchemy import Engine, event
+
+from db.main_db import Database, SlowQueryData
+
+
+# Сколько запросов хранится по умолчанию
+DEFAULT_CAPACITY = 200
+# Сколько параметров запроса сохраняется (остальные отбрасываются)
+MAX_PARAMETERS = 50
+# Длинные значения параметров обрезаются до стольких символов
+MAX_PARAMETER_LENGTH = 200
+# Запросы, для которых строится план
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def _calling_method(frame) -> Optional[str]:
+    '''Внешний из методов Database в стеке вызовов (например,
+    SQLDatabase.get_schedule для запроса из _schedule_cells)'''
+    method = None
+    while frame is not None:
+        instance = frame.f_locals.get('self')
+        if isinstance(instance, Database):
+            method = f'{type(instance).__name__}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return method
+
+
+def _parameter(value: Any) -> Any:
+    '''Значение параметра для JSON (длинные строки обрезаются)'''
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        value = repr(value)
+    if len(value) > MAX_PARAMETER_LENGTH:
+        return value[:MAX_PARAMETER_LENGTH] + '...'
+    return value
+
+
+def _parameters(parameters: Any) -> Optional[list]:
+    '''Параметры запроса в виде списка (для JSON)'''
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        values = [
+            _parameter(f'{name}={value!r}') for name, value in parameters.items()
+        ]
+    else:
+        values = [_parameter(value) for value in parameters]
+    if len(values) > MAX_PARAMETERS:
+        values = values[:MAX_PARAMETERS] + [f'... ещё {len(values) - MAX_PARAMETERS}']
+    return values
+
+
+def _sqlite_plan(dbapi_connection, statement: str, parameters: Any) -> list[str]:
+    '''План выполнения запроса SQLite: строки EXPLAIN QUERY PLAN
+    с отступами по вложенности'''
+    cursor = dbapi_connection.cursor()
+    try:
+        rows = cursor.execute(
+            'EXPLAIN QUERY PLAN ' + statement, parameters or ()
+        ).fetchall()
+    finally:
+        cursor.close()
+    depths = {0: -1}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        lines.append('  ' * depths[node_id] + detail)
+    return lines
+
+
+def _full_scans(plan: list[str]) -> list[str]:
+    '''Таблицы, которые план просматривает полностью (SCAN без индекса)'''
+    tables = []
+    for line in plan:
+        detail = line.strip()
+        if detail.startswith('SCAN ') and ' USING ' not in detail:
+            # "SCAN lesson" (в старых версиях SQLite - "SCAN TABLE lesson")
+            words = detail.split()
+            tables.append(words[2] if words[1] == 'TABLE' and len(words) > 2 else words[1])
+    return tables
+
+
+class SlowQueryLog:
+    '''Журнал медленных запросов engine: запросы дольше threshold секунд,
+    не более capacity последних. Время запроса - от отправки до готовности
+    курсора (для SQLite - до получения первой строки результата)'''
+    def __init__(
+        self,
+        engine: Engine,
+        threshold: float,
+        capacity: int = DEFAULT_CAPACITY
+    ) -> None:
+        self.threshold = threshold
+        self._sqlite = engine.dialect.name == 'sqlite'
+        self._lock = threading.Lock()
+        self._entries: collections.deque[SlowQueryData] = \
+            collections.deque(maxlen=capacity)
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['slow_query_started'].pop()
+        if duration < self.threshold:
+            return
+        plan = None
+        if self._sqlite and not executemany \
+                and statement.lstrip().upper().startswith(EXPLAINABLE):
+            try:
+                plan = _sqlite_plan(cursor.connection, statement, parameters)
+            except Exception as e:
+                plan = [f'План не получен: {e}']
+        entry = SlowQueryData(
+            started=(
+                datetime.datetime.now(datetime.timezone.utc)
+                - datetime.timedelta(seconds=duration)
+            ).isoformat(),
+            duration=duration,
+            statement=statement,
+            parameters=None if executemany else _parameters(parameters),
+            method=_calling_method(sys._getframe(1)),
+            plan=plan,
+            full_scans=_full_scans(plan or [])
+        )
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> list[SlowQueryData]:
+        '''Сохранённые запросы от новых к старым'''
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self) -> None:
+        '''Удаляет сохранённые запросы'''
+        with self._lock:
+            self._entries.clear()
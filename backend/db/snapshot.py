@@ -0,0 +1,205 @@
+#
+#
+#
+
+'''Модуль определяет снимок данных, необходимых алгоритмам составления
+расписания и поиска коллизий. Снимок загружается фиксированным числом
+запросов независимо от размера расписания'''
+
+from collections import Counter, defaultdict
+from typing import NamedTuple, Optional
+
+from sqlmodel import Session, select
+
+from db.main_db import LessonType
+from db.models import (
+    Department, FlowGroupLink, Group, Classroom, Teacher, Curriculum, Lesson,
+    LessonOccupancy
+)
+from utils.collisions import GROUP, TEACHER, OccupancyRow
+from utils.multistart import FixedLesson
+
+
+class LessonRow(NamedTuple):
+    '''Занятие в расписании'''
+    id: int
+    week: int
+    day: int
+    pair: int
+    classroom_id: int
+    curriculum_id: int
+    lesson_type: LessonType
+
+
+class CurriculumRow(NamedTuple):
+    '''Занятие учебного плана'''
+    id: int
+    subject_id: int
+    hours: int
+    primary_teacher_id: int
+    secondary_teacher_id: Optional[int]
+    group_id: Optional[int]
+    flow_id: Optional[int]
+
+
+class ClassroomRow(NamedTuple):
+    '''Аудитория'''
+    id: int
+    capacity: int
+    faculty_id: int
+    department_id: Optional[int]
+
+
+def load_occupancy(session: Session, *where) -> list[OccupancyRow]:
+    '''Загружает строки занятости из таблицы LessonOccupancy (по возрастанию
+    id занятия). where - условия на столбцы LessonOccupancy'''
+    return [
+        tuple(row) for row in session.exec(
+            select(
+                LessonOccupancy.kind, LessonOccupancy.entity_id,
+                LessonOccupancy.week, LessonOccupancy.day, LessonOccupancy.pair,
+                LessonOccupancy.lesson_id
+            )
+            .where(*where)
+            .order_by(
+                LessonOccupancy.lesson_id, LessonOccupancy.kind,
+                LessonOccupancy.entity_id
+            )
+        ).all()
+    ]
+
+
+class SchedulingSnapshot:
+    '''Снимок расписания и учебного плана с индексами в памяти:
+    - lessons - занятия расписания (по возрастанию id)
+    - curricula - {id: занятие учебного плана} (по возрастанию id)
+    - flow_groups - {id потока: [id групп]}
+    - group_sizes - {id группы: число студентов}
+    - teacher_ids - id всех преподавателей
+    - teacher_departments - {id преподавателя: id кафедры}
+    - department_parents - {id подразделения: id родительского подразделения}
+    - classrooms - аудитории (по возрастанию id)
+    - occupancy - строки занятости занятий (см. LessonOccupancy)'''
+    def __init__(
+        self,
+        lessons: list[LessonRow],
+        curricula: dict[int, CurriculumRow],
+        flow_groups: dict[int, list[int]],
+        group_sizes: dict[int, int],
+        teacher_departments: dict[int, int],
+        department_parents: dict[int, Optional[int]],
+        classrooms: list[ClassroomRow],
+        occupancy: list[OccupancyRow]
+    ) -> None:
+        self.lessons = lessons
+        self.curricula = curricula
+        self.flow_groups = flow_groups
+        self.group_sizes = group_sizes
+        self.teacher_ids = list(teacher_departments)
+        self.teacher_departments = teacher_departments
+        self.department_parents = department_parents
+        self.classrooms = classrooms
+        self.occupancy = occupancy
+
+    @classmethod
+    def load(cls, session: Session) -> 'SchedulingSnapshot':
+        '''Загружает снимок из БД (по одному запросу на таблицу)'''
+        lessons = [
+            LessonRow(*row) for row in session.exec(
+                select(
+                    Lesson.id, Lesson.week, Lesson.day, Lesson.pair,
+                    Lesson.classroom_id, Lesson.curriculum_id, Lesson.lesson_type
+                ).order_by(Lesson.id)
+            ).all()
+        ]
+        curricula = {
+            row[0]: CurriculumRow(*row) for row in session.exec(
+                select(
+                    Curriculum.id, Curriculum.subject_id, Curriculum.hours,
+                    Curriculum.primary_teacher_id, Curriculum.secondary_teacher_id,
+                    Curriculum.group_id, Curriculum.flow_id
+                ).order_by(Curriculum.id)
+            ).all()
+        }
+        flow_groups = defaultdict(list)
+        for flow_id, group_id in session.exec(
+            select(FlowGroupLink.flow_id, FlowGroupLink.group_id)
+            .order_by(FlowGroupLink.flow_id, FlowGroupLink.group_id)
+        ).all():
+            flow_groups[flow_id].append(group_id)
+        group_sizes = dict(session.exec(
+            select(Group.id, Group.student_count).order_by(Group.id)
+        ).all())
+        teacher_departments = dict(session.exec(
+            select(Teacher.id, Teacher.department_id).order_by(Teacher.id)
+        ).all())
+        department_parents = dict(session.exec(
+            select(Department.id, Department.parent_id)
+        ).all())
+        classrooms = [
+            ClassroomRow(*row) for row in session.exec(
+                select(
+                    Classroom.id, Classroom.capacity,
+                    Classroom.faculty_id, Classroom.department_id
+                ).order_by(Classroom.id)
+            ).all()
+        ]
+        return cls(
+            lessons, curricula, dict(flow_groups), group_sizes,
+            teacher_departments, department_parents, classrooms,
+            load_occupancy(session)
+        )
+
+    def groups_of(self, curriculum: CurriculumRow) -> list[int]:
+        '''Возвращает id групп, у которых проводится занятие'''
+        if curriculum.group_id:
+            if curriculum.group_id in self.group_sizes:
+                return [curriculum.group_id]
+            return []
+        if curriculum.flow_id:
+            return self.flow_groups.get(curriculum.flow_id, [])
+        return []
+
+    @staticmethod
+    def teachers_of(curriculum: CurriculumRow) -> list[int]:
+        '''Возвращает id преподавателей занятия (без повторов)'''
+        if curriculum.secondary_teacher_id \
+                and curriculum.secondary_teacher_id != curriculum.primary_teacher_id:
+            return [curriculum.primary_teacher_id, curriculum.secondary_teacher_id]
+        return [curriculum.primary_teacher_id]
+
+    def owner_of(self, curriculum: CurriculumRow) -> tuple[int, Optional[int]]:
+        '''Возвращает кафедру и факультет занятия - кафедру основного
+        преподавателя и её родительское подразделение'''
+        department_id = self.teacher_departments.get(curriculum.primary_teacher_id)
+        return department_id, self.department_parents.get(department_id)
+
+    def students_of(self, curriculum: CurriculumRow) -> int:
+        '''Возвращает число студентов на занятии'''
+        return sum(self.group_sizes[gid] for gid in self.groups_of(curriculum))
+
+    def lesson_counts(self) -> Counter:
+        '''Возвращает число занятий в расписании по (id занятия учебного
+        плана, тип занятия)'''
+        return Counter(
+            (lesson.curriculum_id, lesson.lesson_type) for lesson in self.lessons
+        )
+
+    def fixed_lessons(self) -> list[FixedLesson]:
+        '''Возвращает занятия расписания в виде (неделя, день, пара,
+        id групп, id преподавателей, id аудитории)'''
+        groups = defaultdict(list)
+        teachers = defaultdict(list)
+        # id занятия -> (неделя, день, пара, id аудитории)
+        slots = {}
+        for kind, entity_id, week, day, pair, lesson_id in self.occupancy:
+            if kind == GROUP:
+                groups[lesson_id].append(entity_id)
+            elif kind == TEACHER:
+                teachers[lesson_id].append(entity_id)
+            else:
+                slots[lesson_id] = (week, day, pair, entity_id)
+        return [
+            (week, day, pair, groups[lesson_id], teachers[lesson_id], classroom_id)
+            for lesson_id, (week, day, pair, classroom_id) in slots.items()
+        ]
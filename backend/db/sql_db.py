@@ -4,162 +4,389 @@
 
 '''Модуль определяет взаимодействие с реляционными БД'''
 
-from typing import List, Optional
-from collections import defaultdict
-
-from sqlmodel import (
-  Field, SQLModel, create_engine, Session, select, Relationship, CheckConstraint
+import logging
+import threading
+import time
+from itertools import accumulate
+from typing import Callable, Optional
+from collections import Counter, defaultdict
+
+from sqlmodel import SQLModel, create_engine, Session, select
+from sqlalchemy import (
+    CTE, Engine, Select, delete, event, func, insert, literal, or_, union_all, update
 )
-from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import aliased
 
 from db.main_db import (
-    Database, LessonType, CourseEnum, UniversityData, DepartmentData, GroupData,
-    FacultyData, LecturerData, ClassroomData, SpecialityData, SubjectsData,
-    FlowsData, CurriculumData, ScheduleData, ScheduleCellData
+    Database, LessonType, CourseEnum, ScheduleMode, UniversityData,
+    UniversityNodeData,
+    DepartmentData, GroupData, FacultyData, LecturerData, ClassroomData,
+    SpecialityData, SubjectsData, FlowsData, CurriculumData, ScheduleData,
+    ScheduleCellData, BulkIngestData, BulkIngestResult, BulkIngestError,
+    JobStatus, ScheduleJobData, ScheduleProgress, ScheduleCancelled,
+    ChangeAction, ScheduleChangeData, ScheduleChangesData, SlowQueryData,
+    ScheduleReport, PlacedLessonData, UnplacedLessonData, UnplacedReason
 )
+from db.models import (
+    Department, Specialty, FlowGroupLink, Group, Flow, Classroom, Subject,
+    Teacher, Curriculum, Lesson, LessonOccupancy, ScheduleRevision,
+    ScheduleChange, ScheduleJob
+)
+from db.generator import GeneratorParams, TABLES as GENERATED_TABLES, build_university
+from db.slow_queries import SlowQueryLog
+from db.snapshot import SchedulingSnapshot, load_occupancy
+from utils.cache import VersionedCache
+from utils.classrooms import ClassroomIndex
+from utils.collisions import CollisionIndex, GROUP, TEACHER, CLASSROOM
+from utils.encoding import JSON, MSGPACK, encode
+from utils.multistart import SchedulingProblem, place_greedy, multistart
+from utils.optimizer import ScheduleOptimizer, ScheduleItem
+
+
+# Как часто (в секундах) задача составления расписания сохраняет свой ход
+# и проверяет, не запрошена ли отмена
+JOB_PROGRESS_INTERVAL = 0.5
+# Незавершённая задача, ход которой не сохранялся столько секунд, считается
+# прерванной (например, вместе с процессом сервера)
+STALE_JOB_TIMEOUT = 600
+# Журнал изменений расписания хранит изменения последних стольких версий
+# занятий; клиентам с более старой версией возвращается всё расписание
+CHANGE_LOG_VERSIONS = 1000
+
+# Уровни иерархии подразделений (число предков подразделения)
+UNIVERSITY = 0
+FACULTY = 1
+DEPARTMENT = 2
 
 
-class Department(SQLModel, table=True):
-    """Структурное подразделение
-    Подразлеления без родителя - университет
-    Дочерние университету подразделения - факультеты
-    Дочерние факультетам - кафедры"""
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str = Field(index=True, unique=True)
-    short_name: Optional[str]
-    parent_id: Optional[int] = Field(default=None, foreign_key="department.id")
-
-    # Связь на самого себя для иерархии
-    parent: Optional["Department"] = Relationship(
-        back_populates="children", 
-        sa_relationship_kwargs={
-            "remote_side": "Department.id",
-            "foreign_keys": "Department.parent_id"
-        }
-    )
-    children: List["Department"] = Relationship(back_populates="parent")
-
-
-class Specialty(SQLModel, table=True):
-    """Специальность"""
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str = Field(index=True, unique=True)
-    department_id: int = Field(foreign_key="department.id")
-
-    department: Department = Relationship()
-
-
-class FlowGroupLink(SQLModel, table=True):
-    """Связь многие-ко-многим между Потоком и Группами"""
-    flow_id: Optional[int] = Field(default=None, foreign_key="flow.id", primary_key=True)
-    group_id: Optional[int] = Field(default=None, foreign_key="group.id", primary_key=True)
-
-
-class Group(SQLModel, table=True):
-    """Группа"""
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str = Field(index=True, unique=True)
-    course: CourseEnum
-    specialty_id: int = Field(foreign_key="specialty.id")
-    student_count: int
-
-    specialty: Specialty = Relationship()
-    # Обратная связь для связи многие-ко-многим с Flow
-    flows: List["Flow"] = Relationship(back_populates="groups", link_model=FlowGroupLink)
-
-
-class Flow(SQLModel, table=True):
-    """Поток"""
-    id: Optional[int] = Field(default=None, primary_key=True)
-
-    groups: List[Group] = Relationship(back_populates="flows", link_model=FlowGroupLink)
-
-
-class Classroom(SQLModel, table=True):
-    """Аудитория"""
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str = Field(index=True, unique=True)
-    capacity: int
-    faculty_id: int = Field(foreign_key="department.id")
-    department_id: Optional[int] = Field(foreign_key="department.id")
-
-    faculty: Department = Relationship(
-        sa_relationship_kwargs={"foreign_keys": "Classroom.faculty_id"}
-    )
-    department: Optional[Department] = Relationship(
-        sa_relationship_kwargs={"foreign_keys": "Classroom.department_id"}
-    )
-
-
-class Subject(SQLModel, table=True):
-    """Предмет"""
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str = Field(index=True, unique=True)
-    short_name: str
-
-
-class Teacher(SQLModel, table=True):
-    """Преподаватель"""
-    id: Optional[int] = Field(default=None, primary_key=True)
-    full_name: str = Field(index=True, unique=True)
-    department_id: int = Field(foreign_key="department.id")
-
-    department: Department = Relationship()
-
-
-class Curriculum(SQLModel, table=True):
-    """Учебный план"""
-    __table_args__ = (
-        CheckConstraint("hours IN (72, 108, 144)", name="hours_check"),
-    )
-
-    id: Optional[int] = Field(default=None, primary_key=True)
-    subject_id: int = Field(foreign_key="subject.id")
-    hours: int
-    primary_teacher_id: int = Field(foreign_key="teacher.id")
-    secondary_teacher_id: Optional[int] = Field(foreign_key="teacher.id")
-    group_id: Optional[int] = Field(default=None, foreign_key="group.id")
-    flow_id: Optional[int] = Field(default=None, foreign_key="flow.id")
+class SQLDatabase(Database):
+    '''Класс для работы с реляционными БД через ORM'''
+    def __init__(
+        self,
+        db_url: str,
+        pool_options: Optional[dict] = None,
+        sqlite_pragmas: Optional[dict] = None,
+        slow_query_threshold: Optional[float] = None
+    ) -> None:
+        self.engine = create_engine(db_url, **(pool_options or {}))
+        if self.engine.dialect.name == 'sqlite' and sqlite_pragmas:
+            _set_sqlite_pragmas(self.engine, sqlite_pragmas)
+        # Журнал запросов дольше slow_query_threshold секунд (None - выключен)
+        self.slow_queries: Optional[SlowQueryLog] = None
+        if slow_query_threshold is not None:
+            self.slow_queries = SlowQueryLog(self.engine, slow_query_threshold)
+        SQLModel.metadata.create_all(self.engine)
+        # create_all не добавляет новые индексы в уже существующие таблицы
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+        with Session(self.engine) as session:
+            if session.get(ScheduleRevision, 1) is None:
+                # Версия 0 - пустое расписание (см. get_schedule_changes):
+                # занятия БД, созданной до появления версий, - версия 1
+                existing = int(
+                    session.exec(select(Lesson.id).limit(1)).first() is not None
+                )
+                session.add(ScheduleRevision(
+                    id=1, version=existing, lesson_version=existing
+                ))
+                try:
+                    session.commit()
+                except IntegrityError:
+                    # Строку одновременно создал другой процесс
+                    session.rollback()
+        # Заполнение таблицы занятости для БД, созданной до её появления
+        with Session(self.engine) as session:
+            if session.exec(select(Lesson.id).limit(1)).first() is not None \
+                    and session.exec(select(LessonOccupancy.lesson_id).limit(1)).first() is None:
+                self._refresh_occupancy(session)
+                try:
+                    session.commit()
+                except IntegrityError:
+                    # Таблицу одновременно заполнил другой процесс
+                    session.rollback()
+        # Индекс занятости ячеек расписания, строится при первом обращении
+        # и перестраивается, если занятия изменил другой процесс.
+        # _index_version - версия занятий (lesson_version), которой
+        # соответствует индекс. Изменения расписания выполняются под
+        # _schedule_lock и в транзакции, начинающейся с увеличения версии
+        # (т.е. с блокировки записи в БД), поэтому проверка занятости
+        # и запись ячейки атомарны
+        self._collision_index: Optional[CollisionIndex] = None
+        self._index_version: Optional[int] = None
+        self._schedule_lock = threading.RLock()
+        # Кэш результатов по версии данных расписания (version)
+        self._cache = VersionedCache()
+
+    @staticmethod
+    def _bump_schedule_version(session: Session, lessons: bool = False) -> int:
+        '''Увеличивает версию расписания в транзакции session (вызывается
+        до commit). lessons - изменились занятия расписания.
+        Возвращает новую версию занятий'''
+        values = {"version": ScheduleRevision.version + 1}
+        if lessons:
+            values["lesson_version"] = ScheduleRevision.lesson_version + 1
+        session.exec(
+            update(ScheduleRevision)
+            .where(ScheduleRevision.id == 1)
+            .values(**values)
+        )
+        return session.exec(
+            select(ScheduleRevision.lesson_version)
+            .where(ScheduleRevision.id == 1)
+        ).one()
+
+    @property
+    def schedule_version(self) -> int:
+        '''Текущая версия данных расписания'''
+        with Session(self.engine) as session:
+            return session.exec(
+                select(ScheduleRevision.version).where(ScheduleRevision.id == 1)
+            ).one()
+
+    def drop_caches(self) -> None:
+        '''Сбрасывает кэш результатов и индекс занятости: следующие
+        обращения строят их по БД заново (для измерения производительности)'''
+        with self._schedule_lock:
+            self._cache.clear()
+            self._collision_index = None
+            self._index_version = None
+
+    def _sync_collision_index(
+        self,
+        session: Session,
+        lesson_version: int
+    ) -> CollisionIndex:
+        '''Возвращает индекс занятости для версии занятий lesson_version,
+        при необходимости перестраивает его по БД в транзакции session'''
+        if self._collision_index is None or self._index_version != lesson_version:
+            self._collision_index = CollisionIndex(load_occupancy(session))
+            self._index_version = lesson_version
+        return self._collision_index
+
+    def _begin_schedule_write(self, session: Session) -> tuple[CollisionIndex, int]:
+        '''Начинает изменение расписания (вызывается под _schedule_lock):
+        увеличивает версии и возвращает индекс занятости, соответствующий
+        состоянию до изменения, и новую версию занятий. После commit индекс
+        нужно обновить и вызвать _end_schedule_write'''
+        lesson_version = self._bump_schedule_version(session, lessons=True)
+        session.exec(delete(ScheduleChange).where(
+            ScheduleChange.version <= lesson_version - CHANGE_LOG_VERSIONS
+        ))
+        return self._sync_collision_index(session, lesson_version - 1), lesson_version
+
+    def _end_schedule_write(self, lesson_version: int) -> None:
+        '''Отмечает, что индекс занятости обновлён до версии lesson_version'''
+        self._index_version = lesson_version
+
+    @staticmethod
+    def _log_changes(
+        session: Session,
+        lesson_version: int,
+        action: ChangeAction,
+        *where
+    ) -> None:
+        '''Записывает в журнал изменений расписания изменение action
+        занятий, удовлетворяющих условиям where на столбцы Lesson
+        (для удаления вызывается до удаления занятий)'''
+        session.execute(
+            insert(ScheduleChange).from_select(
+                ["version", "lesson_id", "action", "week", "day", "pair"],
+                select(
+                    literal(lesson_version), Lesson.id,
+                    literal(action, ScheduleChange.__table__.c.action.type),
+                    Lesson.week, Lesson.day, Lesson.pair
+                ).where(*where)
+            )
+        )
 
-    subject: Subject = Relationship()
-    primary_teacher: Teacher = Relationship(
-        sa_relationship_kwargs={"foreign_keys": "Curriculum.primary_teacher_id"}
-    )
-    secondary_teacher: Optional[Teacher] = Relationship(
-        sa_relationship_kwargs={
-            "foreign_keys": "Curriculum.secondary_teacher_id"
-        }
-    )
-    group: Optional[Group] = Relationship()
-    flow: Optional[Flow] = Relationship()
+    @staticmethod
+    def _refresh_occupancy(session: Session, *where) -> None:
+        '''Перестраивает в транзакции session строки LessonOccupancy занятий,
+        удовлетворяющих условиям where на столбцы Lesson и Curriculum
+        (без условий - всех занятий). Вызывается при любом изменении
+        занятий, их учебного плана или состава потоков, например
+        _refresh_occupancy(session, Curriculum.flow_id == flow_id)'''
+        if where:
+            session.exec(delete(LessonOccupancy).where(
+                LessonOccupancy.lesson_id.in_(
+                    select(Lesson.id)
+                    .join(Curriculum, Lesson.curriculum_id == Curriculum.id)
+                    .where(*where)
+                )
+            ))
+        else:
+            session.exec(delete(LessonOccupancy))
 
+        slot = (Lesson.week, Lesson.day, Lesson.pair, Lesson.id)
 
-class Lesson(SQLModel, table=True):
-    """Занятие в расписании"""
-    __table_args__ = (
-        CheckConstraint("week IN (1, 2)", name="week_check"),
-        CheckConstraint("day BETWEEN 1 AND 6", name="day_check"),
-        CheckConstraint("pair BETWEEN 1 AND 8", name="pair_check"),
-    )
+        def rows(kind: int, entity_id, *clauses):
+            '''Строки занятости сущностей вида kind'''
+            return (
+                select(literal(kind), entity_id, *slot)
+                .select_from(Lesson)
+                .join(Curriculum, Lesson.curriculum_id == Curriculum.id)
+                .where(*where, *clauses)
+            )
 
-    id: Optional[int] = Field(default=None, primary_key=True)
-    week: int
-    day: int
-    pair: int
-    classroom_id: int = Field(foreign_key="classroom.id")
-    curriculum_id: int = Field(foreign_key="curriculum.id")
-    lesson_type: LessonType
+        session.execute(
+            insert(LessonOccupancy).from_select(
+                ["kind", "entity_id", "week", "day", "pair", "lesson_id"],
+                union_all(
+                    rows(GROUP, Curriculum.group_id, Curriculum.group_id.is_not(None)),
+                    # Группы потока
+                    rows(GROUP, FlowGroupLink.group_id).join(
+                        FlowGroupLink, Curriculum.flow_id == FlowGroupLink.flow_id
+                    ),
+                    rows(TEACHER, Curriculum.primary_teacher_id),
+                    # Второй преподаватель, если он не совпадает с основным
+                    rows(
+                        TEACHER, Curriculum.secondary_teacher_id,
+                        Curriculum.secondary_teacher_id.is_not(None),
+                        Curriculum.secondary_teacher_id != Curriculum.primary_teacher_id
+                    ),
+                    rows(CLASSROOM, Lesson.classroom_id)
+                )
+            )
+        )
 
-    classroom: Classroom = Relationship()
-    curriculum: Curriculum = Relationship()
+    @staticmethod
+    def _participants(
+        session: Session,
+        curriculum: Curriculum
+    ) -> tuple[list[int], list[int]]:
+        '''Возвращает id групп и преподавателей занятия учебного плана'''
+        group_ids = []
+        if curriculum.group_id:
+            group_ids = [curriculum.group_id]
+        elif curriculum.flow_id:
+            group_ids = list(session.exec(
+                select(FlowGroupLink.group_id)
+                .where(FlowGroupLink.flow_id == curriculum.flow_id)
+            ).all())
+        teacher_ids = [curriculum.primary_teacher_id]
+        if curriculum.secondary_teacher_id \
+                and curriculum.secondary_teacher_id != curriculum.primary_teacher_id:
+            teacher_ids.append(curriculum.secondary_teacher_id)
+        return group_ids, teacher_ids
+
+    @staticmethod
+    def _conflicts_message(conflicts: list[dict]) -> str:
+        '''Формирует текст ошибки о занятой ячейке расписания'''
+        names = {"group": "группа", "teacher": "преподаватель", "classroom": "аудитория"}
+        busy = "; ".join(
+            f"{names[c['type']]} с ID {c['id']} "
+            f"(занятия {', '.join(map(str, c['lesson_ids']))})"
+            for c in conflicts
+        )
+        return f"Ячейка расписания занята: {busy}"
+
+    @staticmethod
+    def _subtree(department_id, max_level: Optional[int] = None) -> CTE:
+        '''Рекурсивный CTE подразделений поддерева с корнем department_id
+        (столбцы id, parent_id, level; корень - уровень 0). max_level -
+        наибольший включаемый уровень (None - всё поддерево)'''
+        tree = (
+            select(Department.id, Department.parent_id, literal(0).label("level"))
+            .where(Department.id == department_id)
+            .cte("tree", recursive=True)
+        )
+        children = (
+            select(Department.id, Department.parent_id, tree.c.level + 1)
+            .join(tree, Department.parent_id == tree.c.id)
+        )
+        if max_level is not None:
+            children = children.where(tree.c.level < max_level)
+        return tree.union_all(children)
+
+    @staticmethod
+    def _ancestors(department_id) -> CTE:
+        '''Рекурсивный CTE подразделения department_id и его предков
+        (столбцы id, parent_id, level; подразделение - уровень 0,
+        его родитель - 1 и т.д.)'''
+        chain = (
+            select(Department.id, Department.parent_id, literal(0).label("level"))
+            .where(Department.id == department_id)
+            .cte("chain", recursive=True)
+        )
+        return chain.union_all(
+            select(Department.id, Department.parent_id, chain.c.level + 1)
+            .join(chain, Department.id == chain.c.parent_id)
+        )
 
+    @classmethod
+    def _subtree_groups(cls, department_id: int) -> Select:
+        '''Запрос id групп, специальности которых относятся к подразделению
+        department_id или его дочерним подразделениям'''
+        tree = cls._subtree(department_id)
+        return (
+            select(Group.id)
+            .join(Specialty, Group.specialty_id == Specialty.id)
+            .where(Specialty.department_id.in_(select(tree.c.id)))
+        )
 
-class SQLDatabase(Database):
-    '''Класс для работы с реляционными БД через ORM'''
-    def __init__(self, db_url: str) -> None:
-        self.engine = create_engine(db_url)
-        SQLModel.metadata.create_all(self.engine)
+    @staticmethod
+    def _department_levels(
+        session: Session,
+        ids: set[int]
+    ) -> dict[int, tuple[int, Optional[int]]]:
+        '''Возвращает {id подразделения: (уровень иерархии, id родителя)}
+        для подразделений ids (одним запросом). Отсутствующих в БД
+        подразделений в словаре нет'''
+        if not ids:
+            return {}
+        chain = (
+            select(
+                Department.id.label("start_id"), Department.parent_id,
+                literal(0).label("level")
+            )
+            .where(Department.id.in_(ids))
+            .cte("chain", recursive=True)
+        )
+        chain = chain.union_all(
+            select(chain.c.start_id, Department.parent_id, chain.c.level + 1)
+            .join(chain, Department.id == chain.c.parent_id)
+        )
+        levels = defaultdict(int)
+        parents = {}
+        for start_id, parent_id, level in session.exec(
+            select(chain.c.start_id, chain.c.parent_id, chain.c.level)
+        ).all():
+            levels[start_id] = max(levels[start_id], level)
+            if level == 0:
+                parents[start_id] = parent_id
+        return {id: (levels[id], parent_id) for id, parent_id in parents.items()}
+
+    @staticmethod
+    def _check_owner(
+        levels: dict[int, tuple[int, Optional[int]]],
+        department_id: int,
+        level: int
+    ) -> None:
+        '''Проверяет, что подразделение department_id (присутствующее
+        в levels, см. _department_levels) находится на уровне level'''
+        titles = {FACULTY: "факультетом", DEPARTMENT: "кафедрой"}
+        if levels[department_id][0] != level:
+            raise ValueError(f"Подразделение с ID {department_id} не является {titles[level]}")
+
+    @classmethod
+    def _check_classroom_owner(
+        cls,
+        levels: dict[int, tuple[int, Optional[int]]],
+        faculty_id: int,
+        department_id: Optional[int]
+    ) -> None:
+        '''Проверяет факультет и кафедру аудитории: кафедра должна
+        относиться к факультету'''
+        cls._check_owner(levels, faculty_id, FACULTY)
+        if department_id:
+            cls._check_owner(levels, department_id, DEPARTMENT)
+            if levels[department_id][1] != faculty_id:
+                raise ValueError(
+                    f"Кафедра с ID {department_id} не относится "
+                    f"к факультету с ID {faculty_id}"
+                )
 
     def add_structural_divizion(
         self,
@@ -173,11 +400,17 @@ class SQLDatabase(Database):
         with Session(self.engine) as session:
             # Проверка существования родительского подразделения
             if parent_id is not None:
-                parent = session.get(Department, parent_id)
-                if not parent:
+                levels = self._department_levels(session, {parent_id})
+                if parent_id not in levels:
                     raise ValueError(
                         f"Родительское подразделение с ID {parent_id} не найдено"
                     )
+                # Уровни иерархии: университет - факультет - кафедра
+                if levels[parent_id][0] >= DEPARTMENT:
+                    raise ValueError(
+                        f"Подразделение с ID {parent_id} является кафедрой, "
+                        f"дочерние подразделения не допускаются"
+                    )
             # Проверка уникальности названия
             existing = session.exec(
                 select(Department).where(Department.name == name)
@@ -200,9 +433,10 @@ class SQLDatabase(Database):
         new_speciality = Specialty(name=name, department_id=department_id)
         with Session(self.engine) as session:
             # Проверка существования "родительской" кафедры
-            parent = session.get(Department, department_id)
-            if not parent:
+            levels = self._department_levels(session, {department_id})
+            if department_id not in levels:
                 raise ValueError(f"Кафедра с ID {department_id} не найдена")
+            self._check_owner(levels, department_id, DEPARTMENT)
             # Проверка уникальности названия
             existing = session.exec(
                 select(Specialty).where(Specialty.name == name)
@@ -241,6 +475,7 @@ class SQLDatabase(Database):
                 raise ValueError(f"Группа '{name}' уже существует")
             # Сюда можно добавить проверку наличия в группе минимально необходимого числа студентов
             session.add(new_group)
+            self._bump_schedule_version(session)
             session.commit()
             session.refresh(new_group)
         return new_group.id
@@ -253,9 +488,10 @@ class SQLDatabase(Database):
         new_teacher = Teacher(full_name=name, department_id=department_id)
         with Session(self.engine) as session:
             # Проверка существования "родительской" кафедры
-            parent = session.get(Department, department_id)
-            if not parent:
+            levels = self._department_levels(session, {department_id})
+            if department_id not in levels:
                 raise ValueError(f"Кафедра с ID {department_id} не найдена")
+            self._check_owner(levels, department_id, DEPARTMENT)
             # Проверка уникальности ФИО
             existing = session.exec(
                 select(Teacher).where(Teacher.full_name == name)
@@ -264,6 +500,7 @@ class SQLDatabase(Database):
                 raise ValueError(f"Преподаватель '{name}' уже существует")
 
             session.add(new_teacher)
+            self._bump_schedule_version(session)
             session.commit()
             session.refresh(new_teacher)
         return new_teacher.id
@@ -283,14 +520,15 @@ class SQLDatabase(Database):
         )
         with Session(self.engine) as session:
             # Проверка существования "родительского" факультета
-            parent_faculty = session.get(Department, faculty_id)
-            if not parent_faculty:
+            levels = self._department_levels(
+                session, {faculty_id, department_id} - {None}
+            )
+            if faculty_id not in levels:
                 raise ValueError(f"Факультет с ID {faculty_id} не найден")
             # Проверка существования "родительской" кафедры
-            if department_id:
-                parent_department = session.get(Department, department_id)
-                if not parent_department:
-                    raise ValueError(f"Кафедра с ID {department_id} не найдена")
+            if department_id and department_id not in levels:
+                raise ValueError(f"Кафедра с ID {department_id} не найдена")
+            self._check_classroom_owner(levels, faculty_id, department_id)
             # Проверка уникальности номера аудитории
             existing = session.exec(
                 select(Classroom).where(Classroom.name == name)
@@ -299,6 +537,7 @@ class SQLDatabase(Database):
                 raise ValueError(f"Аудитория '{name}' уже существует")
 
             session.add(new_classroom)
+            self._bump_schedule_version(session)
             session.commit()
             session.refresh(new_classroom)
         return new_classroom.id
@@ -339,6 +578,7 @@ class SQLDatabase(Database):
             # Создание связи между потоком и группами
             for group in found_groups:
                 session.add(FlowGroupLink(flow_id=new_flow.id, group_id=group.id))
+            self._bump_schedule_version(session)
             session.commit()
             return new_flow.id
 
@@ -398,6 +638,7 @@ class SQLDatabase(Database):
                 raise ValueError(f"Этот предмет у группы/потока уже есть в учебном плане")
 
             session.add(new_lesson)
+            self._bump_schedule_version(session)
             session.commit()
             session.refresh(new_lesson)
         return new_lesson.id
@@ -409,7 +650,8 @@ class SQLDatabase(Database):
         pair: int,
         classroom_id: int,
         curriculum_id: int,
-        lesson_type: LessonType
+        lesson_type: LessonType,
+        strict: bool = False
     ) -> int:
         new_lesson = Lesson(
             week=week,
@@ -419,7 +661,7 @@ class SQLDatabase(Database):
             curriculum_id=curriculum_id,
             lesson_type=lesson_type
         )
-        with Session(self.engine) as session:
+        with self._schedule_lock, Session(self.engine) as session:
             # Проверка существования аудитории
             classroom = session.get(Classroom, classroom_id)
             if not classroom:
@@ -435,12 +677,421 @@ class SQLDatabase(Database):
                 raise ValueError(f"Параметр day должен быть числом от 1 до 6")
             if not 1 <= pair <= 8:
                 raise ValueError(f"Параметр pair должен быть числом от 1 до 8")
+            # Проверка занятости групп, преподавателей и аудитории
+            index, lesson_version = self._begin_schedule_write(session)
+            group_ids, teacher_ids = self._participants(session, lesson_in_curriculum)
+            if strict:
+                conflicts = index.conflicts(
+                    week, day, pair, group_ids, teacher_ids, classroom_id
+                )
+                if conflicts:
+                    raise ValueError(self._conflicts_message(conflicts))
 
             session.add(new_lesson)
+            session.flush()  # Для получения ID занятия
+            self._refresh_occupancy(session, Lesson.id == new_lesson.id)
+            self._log_changes(
+                session, lesson_version, ChangeAction.INSERTED,
+                Lesson.id == new_lesson.id
+            )
             session.commit()
             session.refresh(new_lesson)
+            index.add(
+                new_lesson.id, week, day, pair, group_ids, teacher_ids, classroom_id
+            )
+            self._end_schedule_write(lesson_version)
         return new_lesson.id
 
+    @staticmethod
+    def _ids_by_name(session: Session, column, names: set[str]) -> dict:
+        '''Возвращает словарь {название: id} для существующих в БД записей'''
+        if not names:
+            return {}
+        model = column.class_
+        return dict(session.exec(
+            select(column, model.id).where(column.in_(names))
+        ).all())
+
+    @staticmethod
+    def _existing_ids(session: Session, model, ids: set[int]) -> set[int]:
+        '''Возвращает подмножество ids, существующее в таблице model'''
+        if not ids:
+            return set()
+        return set(session.exec(
+            select(model.id).where(model.id.in_(ids))
+        ).all())
+
+    @staticmethod
+    def _resolve_reference(
+        ref_id: Optional[int],
+        ref_name: Optional[str],
+        known_ids: set[int],
+        ids_by_name: dict,
+        title: str
+    ) -> Optional[int]:
+        '''Возвращает id записи, указанной по id либо по названию.
+        Если запись не найдена - ValueError'''
+        if ref_id is not None and ref_name is not None:
+            raise ValueError(f"{title}: укажите ЛИБО id, ЛИБО название")
+        if ref_id is not None:
+            if ref_id not in known_ids:
+                raise ValueError(f"{title} с ID {ref_id} отсутствует в БД")
+            return ref_id
+        if ref_name is not None:
+            if ref_name not in ids_by_name:
+                raise ValueError(f"{title} '{ref_name}' отсутствует в БД и в пакете")
+            return ids_by_name[ref_name]
+        return None
+
+    @staticmethod
+    def _flush_rows(
+        session: Session,
+        rows: list,
+        indexes: list[int],
+        section_ids: list[Optional[int]]
+    ) -> None:
+        '''Добавляет записи в сессию пакетом и проставляет их id
+        в позиции indexes списка section_ids'''
+        if not rows:
+            return
+        session.add_all(rows)
+        session.flush()
+        for index, row in zip(indexes, rows):
+            section_ids[index] = row.id
+
+    def bulk_ingest(self, data: BulkIngestData) -> BulkIngestResult:
+        ids = {
+            section: [None] * len(getattr(data, section))
+            for section in data.__fields__
+        }
+        errors = []
+
+        def fail(section: str, index: int, message: str) -> None:
+            errors.append(
+                BulkIngestError(section=section, index=index, message=message)
+            )
+
+        with Session(self.engine) as session:
+            # Загрузка всех упомянутых в пакете записей, по одному запросу на таблицу
+            dept_by_name = self._ids_by_name(session, Department.name, {
+                *(d.name for d in data.departments),
+                *(d.parent_name for d in data.departments if d.parent_name),
+                *(s.department_name for s in data.specialities if s.department_name),
+                *(t.department_name for t in data.teachers if t.department_name),
+                *(c.faculty_name for c in data.classrooms if c.faculty_name),
+                *(c.department_name for c in data.classrooms if c.department_name)
+            })
+            dept_ids = self._existing_ids(session, Department, {
+                *(d.parent_id for d in data.departments if d.parent_id is not None),
+                *(s.department_id for s in data.specialities if s.department_id is not None),
+                *(t.department_id for t in data.teachers if t.department_id is not None),
+                *(c.faculty_id for c in data.classrooms if c.faculty_id is not None),
+                *(c.department_id for c in data.classrooms if c.department_id is not None)
+            })
+            speciality_by_name = self._ids_by_name(session, Specialty.name, {
+                *(s.name for s in data.specialities),
+                *(g.speciality_name for g in data.groups if g.speciality_name)
+            })
+            speciality_ids = self._existing_ids(session, Specialty, {
+                g.speciality_id for g in data.groups if g.speciality_id is not None
+            })
+            group_by_name = self._ids_by_name(session, Group.name, {
+                *(g.name for g in data.groups),
+                *(name for f in data.flows for name in f.groups),
+                *(c.group_name for c in data.curriculum if c.group_name)
+            })
+            group_ids = self._existing_ids(session, Group, {
+                c.group_id for c in data.curriculum if c.group_id is not None
+            })
+            teacher_by_name = self._ids_by_name(session, Teacher.full_name, {
+                *(t.full_name for t in data.teachers),
+                *(c.primary_teacher_name for c in data.curriculum if c.primary_teacher_name),
+                *(c.secondary_teacher_name for c in data.curriculum if c.secondary_teacher_name)
+            })
+            teacher_ids = self._existing_ids(session, Teacher, {
+                *(c.primary_teacher_id for c in data.curriculum if c.primary_teacher_id is not None),
+                *(c.secondary_teacher_id for c in data.curriculum if c.secondary_teacher_id is not None)
+            })
+            classroom_by_name = self._ids_by_name(
+                session, Classroom.name, {c.name for c in data.classrooms}
+            )
+            subject_by_name = self._ids_by_name(session, Subject.name, {
+                *(s.name for s in data.subjects),
+                *(c.subject_name for c in data.curriculum if c.subject_name)
+            })
+            subject_ids = self._existing_ids(session, Subject, {
+                c.subject_id for c in data.curriculum if c.subject_id is not None
+            })
+            flow_ids = self._existing_ids(session, Flow, {
+                c.flow_id for c in data.curriculum if c.flow_id is not None
+            })
+            dept_levels = self._department_levels(
+                session, {*dept_ids, *dept_by_name.values()}
+            )
+
+            # Подразделения. Добавляются по уровням иерархии, т.к. родитель
+            # может находиться в том же пакете
+            pending = []
+            batch_names = set()
+            for index, item in enumerate(data.departments):
+                if item.name in dept_by_name or item.name in batch_names:
+                    fail("departments", index, f"Подразделение с именем '{item.name}' уже существует")
+                    continue
+                if item.parent_id is not None and item.parent_name is not None:
+                    fail("departments", index, "Укажите ЛИБО parent_id, ЛИБО parent_name")
+                    continue
+                if item.parent_id is not None and item.parent_id not in dept_ids:
+                    fail("departments", index, f"Родительское подразделение с ID {item.parent_id} не найдено")
+                    continue
+                batch_names.add(item.name)
+                pending.append(index)
+            while pending:
+                ready = [
+                    index for index in pending
+                    if data.departments[index].parent_name is None
+                    or data.departments[index].parent_name in dept_by_name
+                ]
+                if not ready:
+                    break
+                rows, indexes = [], []
+                for index in ready:
+                    item = data.departments[index]
+                    parent_id = item.parent_id
+                    if item.parent_name is not None:
+                        parent_id = dept_by_name[item.parent_name]
+                    # Уровни иерархии: университет - факультет - кафедра
+                    if parent_id is not None and dept_levels[parent_id][0] >= DEPARTMENT:
+                        fail("departments", index, f"Подразделение с ID {parent_id} является кафедрой, дочерние подразделения не допускаются")
+                        continue
+                    rows.append(Department(
+                        name=item.name, short_name=item.short_name, parent_id=parent_id
+                    ))
+                    indexes.append(index)
+                session.add_all(rows)
+                session.flush()
+                for index, row in zip(indexes, rows):
+                    ids["departments"][index] = row.id
+                    dept_by_name[row.name] = row.id
+                    dept_ids.add(row.id)
+                    level = dept_levels[row.parent_id][0] + 1 \
+                        if row.parent_id is not None else UNIVERSITY
+                    dept_levels[row.id] = (level, row.parent_id)
+                pending = [index for index in pending if index not in set(ready)]
+            for index in pending:
+                parent_name = data.departments[index].parent_name
+                fail("departments", index, f"Родительское подразделение '{parent_name}' не найдено")
+
+            # Специальности
+            rows, indexes = [], []
+            for index, item in enumerate(data.specialities):
+                try:
+                    if item.name in speciality_by_name:
+                        raise ValueError(f"Специальность '{item.name}' уже существует")
+                    department_id = self._resolve_reference(
+                        item.department_id, item.department_name,
+                        dept_ids, dept_by_name, "Кафедра"
+                    )
+                    if department_id is None:
+                        raise ValueError("Не указана кафедра")
+                    self._check_owner(dept_levels, department_id, DEPARTMENT)
+                except ValueError as exc:
+                    fail("specialities", index, str(exc))
+                    continue
+                speciality_by_name[item.name] = None
+                rows.append(Specialty(name=item.name, department_id=department_id))
+                indexes.append(index)
+            self._flush_rows(session, rows, indexes, ids["specialities"])
+            speciality_by_name.update((row.name, row.id) for row in rows)
+            speciality_ids.update(row.id for row in rows)
+
+            # Группы
+            rows, indexes = [], []
+            for index, item in enumerate(data.groups):
+                try:
+                    if item.name in group_by_name:
+                        raise ValueError(f"Группа '{item.name}' уже существует")
+                    speciality_id = self._resolve_reference(
+                        item.speciality_id, item.speciality_name,
+                        speciality_ids, speciality_by_name, "Специальность"
+                    )
+                    if speciality_id is None:
+                        raise ValueError("Не указана специальность")
+                except ValueError as exc:
+                    fail("groups", index, str(exc))
+                    continue
+                group_by_name[item.name] = None
+                rows.append(Group(
+                    name=item.name,
+                    course=item.course,
+                    specialty_id=speciality_id,
+                    student_count=item.student_count
+                ))
+                indexes.append(index)
+            self._flush_rows(session, rows, indexes, ids["groups"])
+            group_by_name.update((row.name, row.id) for row in rows)
+            group_ids.update(row.id for row in rows)
+
+            # Преподаватели
+            rows, indexes = [], []
+            for index, item in enumerate(data.teachers):
+                try:
+                    if item.full_name in teacher_by_name:
+                        raise ValueError(f"Преподаватель '{item.full_name}' уже существует")
+                    department_id = self._resolve_reference(
+                        item.department_id, item.department_name,
+                        dept_ids, dept_by_name, "Кафедра"
+                    )
+                    if department_id is None:
+                        raise ValueError("Не указана кафедра")
+                    self._check_owner(dept_levels, department_id, DEPARTMENT)
+                except ValueError as exc:
+                    fail("teachers", index, str(exc))
+                    continue
+                teacher_by_name[item.full_name] = None
+                rows.append(Teacher(full_name=item.full_name, department_id=department_id))
+                indexes.append(index)
+            self._flush_rows(session, rows, indexes, ids["teachers"])
+            teacher_by_name.update((row.full_name, row.id) for row in rows)
+            teacher_ids.update(row.id for row in rows)
+
+            # Аудитории
+            rows, indexes = [], []
+            for index, item in enumerate(data.classrooms):
+                try:
+                    if item.name in classroom_by_name:
+                        raise ValueError(f"Аудитория '{item.name}' уже существует")
+                    faculty_id = self._resolve_reference(
+                        item.faculty_id, item.faculty_name,
+                        dept_ids, dept_by_name, "Факультет"
+                    )
+                    if faculty_id is None:
+                        raise ValueError("Не указан факультет")
+                    department_id = self._resolve_reference(
+                        item.department_id, item.department_name,
+                        dept_ids, dept_by_name, "Кафедра"
+                    )
+                    self._check_classroom_owner(dept_levels, faculty_id, department_id)
+                except ValueError as exc:
+                    fail("classrooms", index, str(exc))
+                    continue
+                classroom_by_name[item.name] = None
+                rows.append(Classroom(
+                    name=item.name,
+                    capacity=item.capacity,
+                    faculty_id=faculty_id,
+                    department_id=department_id
+                ))
+                indexes.append(index)
+            self._flush_rows(session, rows, indexes, ids["classrooms"])
+
+            # Предметы
+            rows, indexes = [], []
+            for index, item in enumerate(data.subjects):
+                if item.name in subject_by_name:
+                    fail("subjects", index, f"Предмет '{item.name}' уже существует")
+                    continue
+                subject_by_name[item.name] = None
+                rows.append(Subject(name=item.name, short_name=item.short_name))
+                indexes.append(index)
+            self._flush_rows(session, rows, indexes, ids["subjects"])
+            subject_by_name.update((row.name, row.id) for row in rows)
+            subject_ids.update(row.id for row in rows)
+
+            # Потоки
+            flow_by_key = {}
+            flow_groups, indexes = [], []
+            for index, item in enumerate(data.flows):
+                missing_groups = [
+                    name for name in item.groups if group_by_name.get(name) is None
+                ]
+                if item.key in flow_by_key:
+                    fail("flows", index, f"Поток с ключом '{item.key}' уже есть в пакете")
+                elif missing_groups:
+                    fail("flows", index, f"Группы {', '.join(missing_groups)} не найдены")
+                else:
+                    flow_by_key[item.key] = None
+                    flow_groups.append({group_by_name[name] for name in item.groups})
+                    indexes.append(index)
+            rows = [Flow() for _ in indexes]
+            self._flush_rows(session, rows, indexes, ids["flows"])
+            session.add_all(
+                FlowGroupLink(flow_id=row.id, group_id=group_id)
+                for row, group_id_set in zip(rows, flow_groups)
+                for group_id in group_id_set
+            )
+            for index, row in zip(indexes, rows):
+                flow_by_key[data.flows[index].key] = row.id
+                flow_ids.add(row.id)
+
+            # Учебный план: сначала ссылки всех строк разрешаются в id,
+            # затем существующие занятия разрешённых предметов загружаются
+            # одним запросом (предметы могут быть указаны и по названию)
+            resolved = []
+            for index, item in enumerate(data.curriculum):
+                try:
+                    if item.hours not in (72, 108, 144):
+                        raise ValueError("Количество часов может быть 72, 108 либо 144")
+                    subject_id = self._resolve_reference(
+                        item.subject_id, item.subject_name,
+                        subject_ids, subject_by_name, "Предмет"
+                    )
+                    primary_teacher_id = self._resolve_reference(
+                        item.primary_teacher_id, item.primary_teacher_name,
+                        teacher_ids, teacher_by_name, "Преподаватель"
+                    )
+                    secondary_teacher_id = self._resolve_reference(
+                        item.secondary_teacher_id, item.secondary_teacher_name,
+                        teacher_ids, teacher_by_name, "Преподаватель"
+                    )
+                    group_id = self._resolve_reference(
+                        item.group_id, item.group_name,
+                        group_ids, group_by_name, "Группа"
+                    )
+                    flow_id = self._resolve_reference(
+                        item.flow_id, item.flow_key, flow_ids, flow_by_key, "Поток"
+                    )
+                    if subject_id is None or primary_teacher_id is None:
+                        raise ValueError("Не указан предмет или основной преподаватель")
+                    # Должна быть ЛИБО группа, ЛИБО поток
+                    if (group_id is None) == (flow_id is None):
+                        raise ValueError("Укажите ЛИБО группу, ЛИБО поток")
+                except ValueError as exc:
+                    fail("curriculum", index, str(exc))
+                    continue
+                resolved.append((index, Curriculum(
+                    subject_id=subject_id,
+                    hours=item.hours,
+                    primary_teacher_id=primary_teacher_id,
+                    secondary_teacher_id=secondary_teacher_id,
+                    group_id=group_id,
+                    flow_id=flow_id
+                )))
+
+            existing_curriculum = set()
+            resolved_subjects = {row.subject_id for _, row in resolved}
+            if resolved_subjects:
+                existing_curriculum = set(session.exec(
+                    select(Curriculum.subject_id, Curriculum.group_id, Curriculum.flow_id)
+                    .where(Curriculum.subject_id.in_(resolved_subjects))
+                ).all())
+            rows, indexes = [], []
+            for index, row in resolved:
+                key = (row.subject_id, row.group_id, row.flow_id)
+                if key in existing_curriculum:
+                    fail(
+                        "curriculum", index,
+                        "Этот предмет у группы/потока уже есть в учебном плане"
+                    )
+                    continue
+                existing_curriculum.add(key)
+                rows.append(row)
+                indexes.append(index)
+            self._flush_rows(session, rows, indexes, ids["curriculum"])
+
+            self._bump_schedule_version(session)
+            session.commit()
+        return BulkIngestResult(ids=ids, errors=errors)
+
     def get_university_data(self) -> list[UniversityData]:
         with Session(self.engine) as session:
             # Получение всех подразделений и построение иерархии ВУЗа
@@ -476,7 +1127,8 @@ class SQLDatabase(Database):
                 else:
                     classrooms_by_faculty[room.faculty_id].append(room)
         
-            # Создание структуры ВУЗа
+            # Создание структуры ВУЗа (модели создаются без проверки:
+            # данные взяты из БД)
             result = []
             for university in children_map[None]:  # Университеты (без родителя)
                 faculties = []
@@ -487,7 +1139,7 @@ class SQLDatabase(Database):
                         specs_data = []
                         for spec in specialties_by_dept.get(department.id, []):
                             groups_data = [
-                                GroupData(
+                                GroupData.construct(
                                     id=g.id,
                                     name=g.name,
                                     course=g.course,
@@ -495,7 +1147,7 @@ class SQLDatabase(Database):
                                 ) for g in groups_by_specialty.get(spec.id, [])
                             ]
                             specs_data.append(
-                                SpecialityData(
+                                SpecialityData.construct(
                                     id=spec.id,
                                     name=spec.name,
                                     groups=groups_data
@@ -503,36 +1155,36 @@ class SQLDatabase(Database):
                             )
                         
                         departments_data.append(
-                            DepartmentData(
+                            DepartmentData.construct(
                                 id=department.id,
                                 name=department.name,
                                 short_name=department.short_name,
                                 specialities=specs_data,
                                 lecturers=[
-                                    LecturerData(id=t.id, full_name=t.full_name)
+                                    LecturerData.construct(id=t.id, full_name=t.full_name)
                                     for t in teachers_by_dept.get(department.id, [])
                                 ],
                                 classrooms=[
-                                    ClassroomData(id=r.id, number=r.name, capacity=r.capacity)
+                                    ClassroomData.construct(id=r.id, number=r.name, capacity=r.capacity)
                                     for r in classrooms_by_dept.get(department.id, [])
                                 ]
                             )
                         )
                     
                     faculties.append(
-                        FacultyData(
+                        FacultyData.construct(
                             id=faculty.id,
                             name=faculty.name,
                             departments=departments_data,
                             classrooms=[
-                                ClassroomData(id=r.id, number=r.name, capacity=r.capacity)
+                                ClassroomData.construct(id=r.id, number=r.name, capacity=r.capacity)
                                 for r in classrooms_by_faculty.get(faculty.id, [])
                             ]
                         )
                     )
                 
                 result.append(
-                    UniversityData(
+                    UniversityData.construct(
                         id=university.id,
                         name=university.name,
                         faculties=faculties
@@ -541,6 +1193,111 @@ class SQLDatabase(Database):
             
             return result
 
+    def get_university_subtree(
+        self,
+        department_id: int,
+        depth: int = 1
+    ) -> UniversityNodeData:
+        if depth < 0:
+            raise ValueError("Глубина должна быть не меньше 0")
+        with Session(self.engine) as session:
+            # Подразделения поддерева до уровня depth (корень - уровень 0)
+            tree = self._subtree(department_id, depth)
+            departments = session.exec(
+                select(
+                    Department.id, Department.parent_id, Department.name,
+                    Department.short_name, tree.c.level
+                )
+                .join(tree, Department.id == tree.c.id)
+                .order_by(tree.c.level, Department.id)
+            ).all()
+            if not departments:
+                raise ValueError(f"Подразделение с ID {department_id} не найдено")
+            ids = [dept.id for dept in departments]
+            # Развёрнутые подразделения (с дочерними записями)
+            expanded = [dept.id for dept in departments if dept.level < depth]
+
+            # Аудитория принадлежит кафедре, а при её отсутствии - факультету
+            room_owner = func.coalesce(Classroom.department_id, Classroom.faculty_id)
+
+            def counts(column) -> dict[int, int]:
+                return dict(session.exec(
+                    select(column, func.count())
+                    .where(column.in_(ids))
+                    .group_by(column)
+                ).all())
+
+            children_counts = counts(Department.parent_id)
+            specialities_counts = counts(Specialty.department_id)
+            lecturers_counts = counts(Teacher.department_id)
+            classrooms_counts = counts(room_owner)
+
+            specialities = defaultdict(list)
+            lecturers = defaultdict(list)
+            classrooms = defaultdict(list)
+            if expanded:
+                specs = session.exec(
+                    select(Specialty)
+                    .where(Specialty.department_id.in_(expanded))
+                    .order_by(Specialty.id)
+                ).all()
+                groups_by_specialty = defaultdict(list)
+                for group in session.exec(
+                    select(Group)
+                    .where(Group.specialty_id.in_([spec.id for spec in specs]))
+                    .order_by(Group.id)
+                ).all():
+                    groups_by_specialty[group.specialty_id].append(GroupData(
+                        id=group.id,
+                        name=group.name,
+                        course=group.course,
+                        students_count=group.student_count
+                    ))
+                for spec in specs:
+                    specialities[spec.department_id].append(SpecialityData(
+                        id=spec.id,
+                        name=spec.name,
+                        groups=groups_by_specialty[spec.id]
+                    ))
+                for teacher in session.exec(
+                    select(Teacher)
+                    .where(Teacher.department_id.in_(expanded))
+                    .order_by(Teacher.id)
+                ).all():
+                    lecturers[teacher.department_id].append(
+                        LecturerData(id=teacher.id, full_name=teacher.full_name)
+                    )
+                for owner_id, room in session.exec(
+                    select(room_owner, Classroom)
+                    .where(room_owner.in_(expanded))
+                    .order_by(Classroom.id)
+                ).all():
+                    classrooms[owner_id].append(ClassroomData(
+                        id=room.id, number=room.name, capacity=room.capacity
+                    ))
+
+            # Сборка дерева от нижнего уровня к корню
+            nodes = {}
+            children = defaultdict(list)
+            for dept in reversed(departments):
+                is_expanded = dept.level < depth
+                node = UniversityNodeData(
+                    id=dept.id,
+                    name=dept.name,
+                    short_name=dept.short_name,
+                    children_count=children_counts.get(dept.id, 0),
+                    specialities_count=specialities_counts.get(dept.id, 0),
+                    lecturers_count=lecturers_counts.get(dept.id, 0),
+                    classrooms_count=classrooms_counts.get(dept.id, 0),
+                    children=children[dept.id][::-1] if is_expanded else None,
+                    specialities=specialities[dept.id] if is_expanded else None,
+                    lecturers=lecturers[dept.id] if is_expanded else None,
+                    classrooms=classrooms[dept.id] if is_expanded else None
+                )
+                nodes[dept.id] = node
+                children[dept.parent_id].append(node)
+            return nodes[department_id]
+
     def get_subjects(self) -> list[SubjectsData]:
         with Session(self.engine) as session:
             subjects = session.exec(select(Subject)).all()
@@ -567,11 +1324,14 @@ class SQLDatabase(Database):
                 flow_groups[flow.id].append(group.name)
             
             return [
-                FlowsData(id=flow_id, groups=groups)
+                FlowsData.construct(id=flow_id, groups=groups)
                 for flow_id, groups in flow_groups.items()
             ]
 
-    def get_curriculum(self) -> list[CurriculumData]:
+    def get_curriculum(
+        self,
+        department_id: Optional[int] = None
+    ) -> list[CurriculumData]:
         with Session(self.engine) as session:
             TeacherPrimary = aliased(Teacher)
             TeacherSecondary = aliased(Teacher)
@@ -592,6 +1352,16 @@ class SQLDatabase(Database):
                 .join(Group, Curriculum.group_id == Group.id, isouter=True)
                 .join(Flow, Curriculum.flow_id == Flow.id, isouter=True)
             )
+            # Занятия групп подразделения (в т.ч. занятия их потоков)
+            if department_id is not None:
+                subtree_groups = self._subtree_groups(department_id)
+                curriculum_query = curriculum_query.where(or_(
+                    Curriculum.group_id.in_(subtree_groups),
+                    Curriculum.flow_id.in_(
+                        select(FlowGroupLink.flow_id)
+                        .where(FlowGroupLink.group_id.in_(subtree_groups))
+                    )
+                ))
             results = session.exec(curriculum_query).all()
 
             # Сбор ID всех потоков
@@ -625,7 +1395,7 @@ class SQLDatabase(Database):
                 elif flow_id:
                     groups = flow_groups_map.get(flow_id, [])
 
-                curriculum_list.append(CurriculumData(
+                curriculum_list.append(CurriculumData.construct(
                     id=curriculum.id,
                     subject=subject_short,
                     groups=groups,
@@ -636,88 +1406,248 @@ class SQLDatabase(Database):
 
             return curriculum_list
 
-    def get_schedule(self) -> ScheduleData:
+    def get_classrooms(
+        self,
+        department_id: Optional[int] = None
+    ) -> list[ClassroomData]:
         with Session(self.engine) as session:
-            PrimaryTeacher = aliased(Teacher)
-            SecondaryTeacher = aliased(Teacher)
-            
-            schedule_query = (
-                select(
-                    Lesson,
-                    Curriculum,
-                    Subject,
-                    Classroom,
-                    PrimaryTeacher,
-                    SecondaryTeacher,
-                    Group
+            classroom_query = select(Classroom).order_by(Classroom.id)
+            if department_id is not None:
+                tree = self._subtree(department_id)
+                ancestors = self._ancestors(department_id)
+                # Аудитория принадлежит кафедре, а при её отсутствии - факультету
+                room_owner = func.coalesce(Classroom.department_id, Classroom.faculty_id)
+                classroom_query = classroom_query.where(or_(
+                    room_owner.in_(select(tree.c.id)),
+                    # Общие аудитории факультета, к которому относится кафедра
+                    Classroom.department_id.is_(None)
+                    & Classroom.faculty_id.in_(select(ancestors.c.id))
+                ))
+            return [
+                ClassroomData.construct(
+                    id=room.id, number=room.name, capacity=room.capacity
                 )
-                .join(Curriculum, Lesson.curriculum_id == Curriculum.id)
-                .join(Subject, Curriculum.subject_id == Subject.id)
-                .join(Classroom, Lesson.classroom_id == Classroom.id)
-                .join(PrimaryTeacher, Curriculum.primary_teacher_id == PrimaryTeacher.id)
-                .outerjoin(SecondaryTeacher, Curriculum.secondary_teacher_id == SecondaryTeacher.id)
-                .outerjoin(Group, Curriculum.group_id == Group.id)
-            )
-            results = session.exec(schedule_query).all()
+                for room in session.exec(classroom_query).all()
+            ]
 
-            flow_ids = set()
-            for row in results:
-                _, curriculum, *_, group = row
-                if curriculum.flow_id is not None:
-                    flow_ids.add(curriculum.flow_id)
+    def get_schedule(
+        self,
+        group_id: Optional[int] = None,
+        group_name: Optional[str] = None,
+        teacher_id: Optional[int] = None,
+        classroom_id: Optional[int] = None,
+        flow_id: Optional[int] = None,
+        week: Optional[int] = None,
+        day: Optional[int] = None,
+        department_id: Optional[int] = None
+    ) -> ScheduleData:
+        return self._cached_schedule(
+            None, group_id, group_name, teacher_id, classroom_id, flow_id, week, day,
+            department_id
+        )
 
-            flow_groups = defaultdict(list)
-            if flow_ids:
-                flow_group_stmt = select(FlowGroupLink, Group).join(Group).where(FlowGroupLink.flow_id.in_(flow_ids))
-                flow_group_results = session.exec(flow_group_stmt).all()
-                for link, group in flow_group_results:
-                    flow_groups[link.flow_id].append(group)
-
-            schedule_dict = {
-                week: {
-                    day: {pair: {} for pair in range(1,9)} for day in range(1,7)
-                } for week in range(1,3)
-            }
-            for row in results:
-                lesson, curriculum, subject, classroom, primary_teacher, secondary_teacher, group = row
-                
-                groups = []
-                if curriculum.group_id and group is not None:
-                    groups = [group]
-                elif curriculum.flow_id:
-                    groups = flow_groups.get(curriculum.flow_id, [])
+    def get_schedule_json(
+        self,
+        group_id: Optional[int] = None,
+        group_name: Optional[str] = None,
+        teacher_id: Optional[int] = None,
+        classroom_id: Optional[int] = None,
+        flow_id: Optional[int] = None,
+        week: Optional[int] = None,
+        day: Optional[int] = None,
+        department_id: Optional[int] = None
+    ) -> bytes:
+        return self._cached_schedule(
+            JSON, group_id, group_name, teacher_id, classroom_id, flow_id, week, day,
+            department_id
+        )
 
-                teachers = primary_teacher.full_name
-                if secondary_teacher:
-                    teachers += f", {secondary_teacher.full_name}"
+    def get_schedule_msgpack(
+        self,
+        group_id: Optional[int] = None,
+        group_name: Optional[str] = None,
+        teacher_id: Optional[int] = None,
+        classroom_id: Optional[int] = None,
+        flow_id: Optional[int] = None,
+        week: Optional[int] = None,
+        day: Optional[int] = None,
+        department_id: Optional[int] = None
+    ) -> bytes:
+        return self._cached_schedule(
+            MSGPACK, group_id, group_name, teacher_id, classroom_id, flow_id, week, day,
+            department_id
+        )
 
-                cell_data = ScheduleCellData(
-                    id=lesson.id,
-                    lesson_type=lesson.lesson_type,
-                    subject=subject.name,
-                    teachers=teachers,
-                    classroom=classroom.name
-                )
+    def _cached_schedule(self, media_type: Optional[str], *filters):
+        '''Возвращает из кэша текущей версии расписание (media_type=None)
+        или его сериализацию в формате media_type (JSON или MSGPACK).
+        filters - параметры фильтрации get_schedule (входят в ключ кэша)'''
+        version = self.schedule_version
 
-                week = int(lesson.week)
-                day = int(lesson.day)
-                pair = int(lesson.pair)
-                for group_obj in groups:
-                    group_name = group_obj.name
-                    
-                    schedule_dict[week][day][pair][group_name] = cell_data
+        def schedule() -> ScheduleData:
+            return self._cache.get(
+                ("schedule", None, *filters), version,
+                lambda: self._build_schedule(*filters)
+            )
+
+        if media_type is None:
+            return schedule()
+        return self._cache.get(
+            ("schedule", media_type, *filters), version,
+            lambda: encode(schedule(), media_type)
+        )
+
+    def _build_schedule(
+        self,
+        group_id: Optional[int],
+        group_name: Optional[str],
+        teacher_id: Optional[int],
+        classroom_id: Optional[int],
+        flow_id: Optional[int],
+        week: Optional[int],
+        day: Optional[int],
+        department_id: Optional[int]
+    ) -> ScheduleData:
+        '''Строит расписание по БД. Фильтры применяются в SQL-запросе'''
+        lesson_where, group_where = self._schedule_filters(
+            group_id, group_name, teacher_id, department_id
+        )
+        if week is not None:
+            lesson_where.append(Lesson.week == week)
+        if day is not None:
+            lesson_where.append(Lesson.day == day)
+        if classroom_id is not None:
+            lesson_where.append(Lesson.classroom_id == classroom_id)
+        if flow_id is not None:
+            lesson_where.append(Curriculum.flow_id == flow_id)
 
-            # Преобразование defaultdict в обычный dict
-            return ScheduleData(data=schedule_dict)
+        with Session(self.engine) as session:
+            cells = self._schedule_cells(session, lesson_where, group_where)
+
+        weeks = [week] if week is not None else range(1, 3)
+        days = [day] if day is not None else range(1, 7)
+        schedule_dict = {
+            w: {
+                d: {pair: {} for pair in range(1,9)} for d in days
+            } for w in weeks
+        }
+        for lesson, cell_data, groups in cells:
+            pair_cells = schedule_dict[lesson.week][lesson.day][lesson.pair]
+            for name in groups:
+                pair_cells[name] = cell_data
+
+        return ScheduleData.construct(data=schedule_dict)
+
+    @classmethod
+    def _schedule_filters(
+        cls,
+        group_id: Optional[int] = None,
+        group_name: Optional[str] = None,
+        teacher_id: Optional[int] = None,
+        department_id: Optional[int] = None
+    ) -> tuple[list, list]:
+        '''Возвращает условия на занятия (Lesson) и на группы ячеек (Group)
+        для фильтров расписания по группе, преподавателю и подразделению'''
+        lesson_where = []
+        group_where = []
+        # Занятия преподавателя, группы (её собственные и занятия
+        # её потоков) и групп подразделения - по таблице занятости
+        entity = LessonOccupancy.entity_id
+        occupied = []
+        if teacher_id is not None:
+            occupied.append((TEACHER, entity == teacher_id))
+        if group_id is not None:
+            occupied.append((GROUP, entity == group_id))
+            group_where.append(Group.id == group_id)
+        if group_name is not None:
+            occupied.append((GROUP, entity == (
+                select(Group.id).where(Group.name == group_name).scalar_subquery()
+            )))
+            group_where.append(Group.name == group_name)
+        if department_id is not None:
+            subtree_groups = cls._subtree_groups(department_id)
+            occupied.append((GROUP, entity.in_(subtree_groups)))
+            group_where.append(Group.id.in_(subtree_groups))
+        for kind, condition in occupied:
+            lesson_where.append(Lesson.id.in_(
+                select(LessonOccupancy.lesson_id)
+                .where(LessonOccupancy.kind == kind, condition)
+            ))
+        return lesson_where, group_where
+
+    @staticmethod
+    def _schedule_cells(
+        session: Session,
+        lesson_where: list,
+        group_where: list = ()
+    ) -> list[tuple[Lesson, ScheduleCellData, list[str]]]:
+        '''Возвращает (занятие, ячейка расписания, названия групп ячейки)
+        для занятий, удовлетворяющих условиям lesson_where на столбцы
+        Lesson и Curriculum. group_where - условия на группы ячеек'''
+        PrimaryTeacher = aliased(Teacher)
+        SecondaryTeacher = aliased(Teacher)
+
+        schedule_query = (
+            select(
+                Lesson,
+                Subject.name,
+                Classroom.name,
+                PrimaryTeacher.full_name,
+                SecondaryTeacher.full_name
+            )
+            .join(Curriculum, Lesson.curriculum_id == Curriculum.id)
+            .join(Subject, Curriculum.subject_id == Subject.id)
+            .join(Classroom, Lesson.classroom_id == Classroom.id)
+            .join(PrimaryTeacher, Curriculum.primary_teacher_id == PrimaryTeacher.id)
+            .outerjoin(SecondaryTeacher, Curriculum.secondary_teacher_id == SecondaryTeacher.id)
+            .where(*lesson_where)
+        )
+        results = session.exec(schedule_query).all()
+
+        # Группы занятий - по таблице занятости
+        lesson_groups = defaultdict(list)
+        if results:
+            group_query = (
+                select(LessonOccupancy.lesson_id, Group.name)
+                .join(Group, LessonOccupancy.entity_id == Group.id)
+                .where(
+                    LessonOccupancy.kind == GROUP,
+                    LessonOccupancy.lesson_id.in_(
+                        schedule_query.with_only_columns(Lesson.id)
+                    ),
+                    *group_where
+                )
+                .order_by(LessonOccupancy.lesson_id, Group.id)
+            )
+            for lesson_id, name in session.exec(group_query).all():
+                lesson_groups[lesson_id].append(name)
+
+        cells = []
+        for lesson, subject, classroom, primary_teacher, secondary_teacher in results:
+            teachers = primary_teacher
+            if secondary_teacher:
+                teachers += f", {secondary_teacher}"
+            # Данные взяты из БД, поэтому модели создаются без проверки
+            cell_data = ScheduleCellData.construct(
+                id=lesson.id,
+                lesson_type=lesson.lesson_type,
+                subject=subject,
+                teachers=teachers,
+                classroom=classroom
+            )
+            cells.append((lesson, cell_data, lesson_groups[lesson.id]))
+        return cells
 
     def edit_schedule_cell(
         self,
         id: int,
         classroom_id: int,
         curriculum_id: int,
-        lesson_type: LessonType
+        lesson_type: LessonType,
+        strict: bool = False
     ) -> None:
-        with Session(self.engine) as session:
+        with self._schedule_lock, Session(self.engine) as session:
+            index, lesson_version = self._begin_schedule_write(session)
             # Получение занятия
             lesson = session.get(Lesson, id)
             if not lesson:
@@ -730,21 +1660,170 @@ class SQLDatabase(Database):
             lesson_in_curriculum = session.get(Curriculum, curriculum_id)
             if not lesson_in_curriculum:
                 raise ValueError(f"Занятия с ID {curriculum_id} нет в учебном плане")
+            # Проверка занятости групп, преподавателей и аудитории
+            group_ids, teacher_ids = self._participants(session, lesson_in_curriculum)
+            week, day, pair = lesson.week, lesson.day, lesson.pair
+            if strict:
+                conflicts = index.conflicts(
+                    week, day, pair, group_ids, teacher_ids, classroom_id,
+                    ignore_lesson_id=id
+                )
+                if conflicts:
+                    raise ValueError(self._conflicts_message(conflicts))
 
             lesson.classroom_id = classroom_id
             lesson.curriculum_id = curriculum_id
             lesson.lesson_type = lesson_type
 
             session.add(lesson)
+            session.flush()
+            self._refresh_occupancy(session, Lesson.id == id)
+            self._log_changes(
+                session, lesson_version, ChangeAction.UPDATED, Lesson.id == id
+            )
             session.commit()
+            index.remove(id)
+            index.add(id, week, day, pair, group_ids, teacher_ids, classroom_id)
+            self._end_schedule_write(lesson_version)
 
     def remove_schedule_cell(self, id: int) -> None:
-        with Session(self.engine) as session:
+        with self._schedule_lock, Session(self.engine) as session:
+            index, lesson_version = self._begin_schedule_write(session)
             lesson = session.get(Lesson, id)
             if not lesson:
                 raise ValueError(f"Ячейка расписания с ID {id} не найдена")
+            self._log_changes(
+                session, lesson_version, ChangeAction.DELETED, Lesson.id == id
+            )
+            session.exec(
+                delete(LessonOccupancy).where(LessonOccupancy.lesson_id == id)
+            )
             session.delete(lesson)
             session.commit()
+            index.remove(id)
+            self._end_schedule_write(lesson_version)
+
+    def get_schedule_changes(
+        self,
+        since: int = 0,
+        group_id: Optional[int] = None,
+        teacher_id: Optional[int] = None
+    ) -> ScheduleChangesData:
+        with Session(self.engine) as session:
+            version = session.exec(
+                select(ScheduleRevision.lesson_version)
+                .where(ScheduleRevision.id == 1)
+            ).one()
+            if since == version:
+                return ScheduleChangesData.construct(
+                    version=version, full=False, changes=[], schedule=None
+                )
+            # Журнал покрывает версии начиная с first (без пропусков:
+            # каждая версия занятий - хотя бы одно изменение). Версия 0 -
+            # пустое расписание, поэтому since=0 - такая же версия, как
+            # остальные: всё расписание возвращается, только если
+            # изменений после since в журнале уже нет
+            first = session.exec(select(func.min(ScheduleChange.version))).one()
+            if since < 0 or since > version or first is None or since < first - 1:
+                return ScheduleChangesData.construct(
+                    version=version, full=True, changes=[],
+                    schedule=self.get_schedule(
+                        group_id=group_id, teacher_id=teacher_id
+                    )
+                )
+
+            # Изменения занятия после since: первое и последнее
+            in_range = (ScheduleChange.version > since) & (ScheduleChange.version <= version)
+            actions = {}
+            for lesson_id, action, week, day, pair in session.exec(
+                select(
+                    ScheduleChange.lesson_id, ScheduleChange.action,
+                    ScheduleChange.week, ScheduleChange.day, ScheduleChange.pair
+                )
+                .where(in_range)
+                .order_by(ScheduleChange.id)
+            ).all():
+                first_action = actions.get(lesson_id, (action,))[0]
+                actions[lesson_id] = (first_action, action, week, day, pair)
+            changed = Lesson.id.in_(
+                select(ScheduleChange.lesson_id).where(in_range)
+            )
+            lesson_where, group_where = self._schedule_filters(
+                group_id=group_id, teacher_id=teacher_id
+            )
+            cells = {
+                lesson.id: (cell, groups)
+                for lesson, cell, groups in self._schedule_cells(
+                    session, [changed, *lesson_where], group_where
+                )
+            }
+            # Группы и преподаватели занятий (для фильтрации на клиенте)
+            group_ids = defaultdict(list)
+            teacher_ids = defaultdict(list)
+            for lesson_id, kind, entity_id in session.exec(
+                select(
+                    LessonOccupancy.lesson_id, LessonOccupancy.kind,
+                    LessonOccupancy.entity_id
+                )
+                .where(
+                    LessonOccupancy.lesson_id.in_(
+                        select(ScheduleChange.lesson_id).where(in_range)
+                    ),
+                    LessonOccupancy.kind != CLASSROOM
+                )
+                .order_by(LessonOccupancy.lesson_id, LessonOccupancy.entity_id)
+            ).all():
+                ids = teacher_ids if kind == TEACHER else group_ids
+                ids[lesson_id].append(entity_id)
+
+        changes = []
+        for lesson_id, (first_action, action, week, day, pair) in actions.items():
+            if action != ChangeAction.DELETED and lesson_id in cells:
+                cell, groups = cells[lesson_id]
+                changes.append(ScheduleChangeData.construct(
+                    lesson_id=lesson_id,
+                    action=ChangeAction.INSERTED
+                    if first_action == ChangeAction.INSERTED
+                    else ChangeAction.UPDATED,
+                    week=week, day=day, pair=pair, groups=groups, cell=cell,
+                    group_ids=group_ids[lesson_id],
+                    teacher_ids=teacher_ids[lesson_id]
+                ))
+            elif action == ChangeAction.DELETED or first_action != ChangeAction.INSERTED:
+                # Удалённое занятие, а также изменённое занятие, которое
+                # больше не проходит фильтр (клиент мог его видеть)
+                changes.append(ScheduleChangeData.construct(
+                    lesson_id=lesson_id, action=ChangeAction.DELETED,
+                    week=week, day=day, pair=pair, groups=None, cell=None,
+                    group_ids=None, teacher_ids=None
+                ))
+        return ScheduleChangesData.construct(
+            version=version, full=False, changes=changes, schedule=None
+        )
+
+    def generate_university(self, params: GeneratorParams) -> dict[str, int]:
+        '''Генерирует синтетический университет (см. db.generator) и
+        записывает его пакетными INSERT в одной транзакции.
+        Возвращает число добавленных записей по таблицам'''
+        with Session(self.engine) as session:
+            first_ids = {
+                table: (session.exec(select(func.max(table.id))).one() or 0) + 1
+                for table in GENERATED_TABLES if table is not FlowGroupLink
+            }
+            rows = build_university(params, first_ids)
+            try:
+                for table in GENERATED_TABLES:
+                    if rows[table]:
+                        session.exec(insert(table), params=rows[table])
+                self._bump_schedule_version(session)
+                session.commit()
+            except IntegrityError as e:
+                session.rollback()
+                raise ValueError(
+                    "Записи с такими названиями уже есть в БД "
+                    "(укажите другое сокращение университета)"
+                ) from e
+        return {table.__tablename__: len(rows[table]) for table in GENERATED_TABLES}
 
     def create_test_data(self) -> None:
         '''Создание тестовых данных'''
@@ -940,342 +2019,515 @@ class SQLDatabase(Database):
                 )
             ]
             session.add_all(existing_lessons)
+            session.flush()
+            self._refresh_occupancy(session)
             
+            lesson_version = self._bump_schedule_version(session, lessons=True)
+            self._log_changes(session, lesson_version, ChangeAction.INSERTED)
             session.commit()
 
-    def auto_schedule(self) -> None:
-        '''Автоматическое составление расписания с учётом семестровой нагрузки'''
-        with Session(self.engine) as session:
-            # Сбор существующей занятости для недель 1 и 2
-            busy_rooms = set()
-            busy_teachers = set()
-            busy_groups = set()
-            
-            # Загрузка существующих занятий в неделях 1 и 2
-            existing_lessons = session.exec(
-                select(Lesson)
-                .where(Lesson.week.in_([1, 2]))
-            ).all()
-            
-            for lesson in existing_lessons:
-                curriculum = session.get(Curriculum, lesson.curriculum_id)
-                if not curriculum:
-                    continue
-                    
-                # Определение групп
-                group_ids = []
-                if curriculum.group_id:
-                    group_ids = [curriculum.group_id]
-                elif curriculum.flow_id:
-                    flow_groups = session.exec(
-                        select(FlowGroupLink.group_id)
-                        .where(FlowGroupLink.flow_id == curriculum.flow_id)
-                    ).all()
-                    group_ids = [g[0] for g in flow_groups]
-                
-                # Преподаватели
-                teacher_ids = [curriculum.primary_teacher_id]
-                if curriculum.secondary_teacher_id:
-                    teacher_ids.append(curriculum.secondary_teacher_id)
+    def auto_schedule(
+        self,
+        mode: ScheduleMode = ScheduleMode.GREEDY,
+        time_budget: float = 10.0,
+        seed: Optional[int] = None,
+        starts: Optional[int] = None,
+        progress: Optional[Callable[[ScheduleProgress], None]] = None,
+        dry_run: bool = False
+    ) -> ScheduleReport:
+        '''Автоматическое составление расписания с учётом семестровой нагрузки.
+        mode - режим составления, для режима ANNEALING: time_budget - время
+        улучшения в секундах; для режима MULTISTART: starts - число
+        запусков (по умолчанию - число ядер процессора); seed -
+        начальное значение генератора случайных чисел.
+        progress - вызывается по ходу составления; может прервать его,
+        выбросив ScheduleCancelled (расписание при этом не изменяется).
+        dry_run - только вычислить размещение, не изменяя расписание.
+        Возвращает добавленные и не размещённые занятия'''
+        self._check_schedule_params(mode, time_budget, starts)
+        # Расписание составляется по снимку БД вне транзакции записи
+        # и без _schedule_lock, чтобы во время составления другие потоки
+        # и процессы могли изменять расписание (в т.ч. сохранять ход
+        # задачи). Версия занятий читается до снимка: если к моменту
+        # записи её кто-то изменил, размещения перепроверяются
+        # (см. _recheck_placements)
+        with self._schedule_lock, Session(self.engine) as session:
+            snapshot_version = session.exec(
+                select(ScheduleRevision.lesson_version)
+                .where(ScheduleRevision.id == 1)
+            ).one()
+            snapshot = SchedulingSnapshot.load(session)
+
+        # Существующая занятость для недель 1 и 2
+        existing = snapshot.fixed_lessons()
+
+        # Подготовка учебных планов
+        curriculum_data = []
+        unplaced = []
+        classroom_index = ClassroomIndex(snapshot.classrooms)
+        lesson_counts = snapshot.lesson_counts()
+
+        # Шаблоны занятий на двухнедельный цикл
+        curriculum_templates = {
+            72: [LessonType.LECTURE],  # 1 лекция за 2 недели
+            108: [LessonType.LECTURE, LessonType.LAB],  # 1 лекция + 1 лаба
+            144: [LessonType.LECTURE, LessonType.LAB, LessonType.LAB]  # 1 лекция + 2 лабы
+        }
+        
+        for curr in snapshot.curricula.values():
+            # Проверка допустимости часов
+            if curr.hours not in curriculum_templates:
+                unplaced.append(UnplacedLessonData(
+                    curriculum_id=curr.id,
+                    reason=UnplacedReason.INVALID_HOURS
+                ))
+                continue
                 
-                # Обновление занятости
-                for gid in group_ids:
-                    busy_groups.add((lesson.week, lesson.day, lesson.pair, gid))
-                for tid in teacher_ids:
-                    busy_teachers.add((lesson.week, lesson.day, lesson.pair, tid))
-                busy_rooms.add((lesson.week, lesson.day, lesson.pair, lesson.classroom_id))
-
-            # Подготовка учебных планов
-            curriculum_data = []
-            all_curriculum = session.exec(select(Curriculum)).all()
+            # Получаем шаблон занятий для данного количества часов
+            template = curriculum_templates[curr.hours]
             
-            # Шаблоны занятий на двухнедельный цикл
-            curriculum_templates = {
-                72: [LessonType.LECTURE],  # 1 лекция за 2 недели
-                108: [LessonType.LECTURE, LessonType.LAB],  # 1 лекция + 1 лаба
-                144: [LessonType.LECTURE, LessonType.LAB, LessonType.LAB]  # 1 лекция + 2 лабы
-            }
+            # Определяем, сколько занятий каждого типа нужно добавить
+            needed_lessons = []
+            for lesson_type in dict.fromkeys(template):
+                # Сколько должно быть занятий этого типа
+                required_count = template.count(lesson_type)
+                # Сколько уже есть
+                current_count = lesson_counts[(curr.id, lesson_type)]
+                # Добавляем в список необходимых занятий
+                needed_lessons.extend(
+                    [lesson_type] * (required_count - current_count)
+                )
             
-            for curr in all_curriculum:
-                # Проверка допустимости часов
-                if curr.hours not in curriculum_templates:
-                    print(f"Недопустимое количество часов: {curr.hours} для curriculum_id={curr.id}")
-                    continue
-                    
-                # Получаем шаблон занятий для данного количества часов
-                template = curriculum_templates[curr.hours]
+            if not needed_lessons:
+                continue
                 
-                # Подсчёт уже запланированных занятий каждого типа в цикле (недели 1 и 2)
-                type_counter = {LessonType.LECTURE: 0, LessonType.LAB: 0}
-                for lesson_type in template:
-                    existing_count = session.scalar(
-                        select(func.count(Lesson.id))
-                        .where(Lesson.curriculum_id == curr.id)
-                        .where(Lesson.week.in_([1, 2]))
-                        .where(Lesson.lesson_type == lesson_type)
-                    ) or 0
-                    type_counter[lesson_type] = existing_count
-                
-                # Определяем, сколько занятий каждого типа нужно добавить
-                needed_lessons = []
-                for lesson_type in template:
-                    # Сколько должно быть занятий этого типа
-                    required_count = sum(1 for t in template if t == lesson_type)
-                    # Сколько уже есть
-                    current_count = type_counter[lesson_type]
-                    # Сколько нужно добавить
-                    to_add = required_count - current_count
-                    
-                    # Добавляем в список необходимых занятий
-                    needed_lessons.extend([lesson_type] * to_add)
-                
-                if not needed_lessons:
-                    continue
-                    
-                # Определение групп и вместимости
-                group_ids = []
-                capacity_required = 0
-                if curr.group_id:
-                    group = session.get(Group, curr.group_id)
-                    if group:
-                        group_ids = [group.id]
-                        capacity_required = group.student_count
-                elif curr.flow_id:
-                    flow_groups = session.exec(
-                        select(Group)
-                        .join(FlowGroupLink, Group.id == FlowGroupLink.group_id)
-                        .where(FlowGroupLink.flow_id == curr.flow_id)
-                    ).all()
-                    group_ids = [g.id for g in flow_groups]
-                    capacity_required = sum(g.student_count for g in flow_groups)
-                
-                if not group_ids:
-                    continue
-                    
-                # Подходящие аудитории
-                classrooms = session.exec(
-                    select(Classroom)
-                    .where(Classroom.capacity >= capacity_required)
-                ).all()
-                classroom_ids = [c.id for c in classrooms]
+            # Определение групп и вместимости
+            group_ids = snapshot.groups_of(curr)
+            if not group_ids:
+                unplaced.append(UnplacedLessonData(
+                    curriculum_id=curr.id, reason=UnplacedReason.NO_GROUPS
+                ))
+                continue
+            capacity_required = snapshot.students_of(curr)
                 
-                curriculum_data.append({
-                    'obj': curr,
-                    'needed_lessons': needed_lessons,
-                    'groups': group_ids,
-                    'teachers': [
-                        t for t in [curr.primary_teacher_id, curr.secondary_teacher_id] 
-                        if t is not None
-                    ],
-                    'classrooms': classroom_ids,
-                    'capacity_req': capacity_required
-                })
-            
-            # Сортировка по сложности (вместимость аудитории и количество групп)
-            curriculum_data.sort(key=lambda x: (-x['capacity_req'], -len(x['groups'])))
+            # Подходящие аудитории: от наименьшей, при равной вместимости -
+            # сначала аудитории кафедры и факультета занятия
+            classroom_ids = classroom_index.suitable(
+                capacity_required, *snapshot.owner_of(curr)
+            )
             
-            # Распределение занятий
-            for item in curriculum_data:
-                curr = item['obj']
-                for lesson_type in item['needed_lessons']:
-                    placed = False
-                    for week in [1, 2]:
-                        for day in range(1, 7):  # Пн-Сб
-                            for pair in range(1, 9):  # 1-8 пары
-                                # Проверка групп
-                                if any(
-                                    (week, day, pair, gid) in busy_groups 
-                                    for gid in item['groups']
-                                ):
-                                    continue
-                                    
-                                # Проверка преподавателей
-                                if any(
-                                    (week, day, pair, tid) in busy_teachers 
-                                    for tid in item['teachers']
-                                ):
-                                    continue
-                                
-                                # Поиск свободной аудитории
-                                for room_id in item['classrooms']:
-                                    if (week, day, pair, room_id) in busy_rooms:
-                                        continue
-                                    
-                                    # Создание занятия
-                                    new_lesson = Lesson(
-                                        week=week,
-                                        day=day,
-                                        pair=pair,
-                                        classroom_id=room_id,
-                                        curriculum_id=curr.id,
-                                        lesson_type=lesson_type
-                                    )
-                                    session.add(new_lesson)
-                                    
-                                    # Обновление занятости
-                                    busy_rooms.add((week, day, pair, room_id))
-                                    for gid in item['groups']:
-                                        busy_groups.add((week, day, pair, gid))
-                                    for tid in item['teachers']:
-                                        busy_teachers.add((week, day, pair, tid))
-                                    
-                                    placed = True
-                                    break
-                                if placed:
-                                    break
-                            if placed:
-                                break
-                        if placed:
-                            break
-                    if not placed:
-                        print(f"Не удалось разместить curriculum_id={curr.id} (тип: {lesson_type})")
-                        
+            curriculum_data.append({
+                'obj': curr,
+                'needed_lessons': needed_lessons,
+                'groups': group_ids,
+                'teachers': snapshot.teachers_of(curr),
+                'classrooms': classroom_ids,
+                'capacity_req': capacity_required
+            })
+        
+        # Сортировка по сложности (вместимость аудитории и количество групп)
+        curriculum_data.sort(key=lambda x: (-x['capacity_req'], -len(x['groups'])))
+
+        # Размещаемые занятия в порядке жадного размещения
+        placements = [
+            (item, lesson_type)
+            for item in curriculum_data
+            for lesson_type in item['needed_lessons']
+        ]
+        problem = SchedulingProblem(
+            [
+                ScheduleItem(
+                    item['groups'], item['teachers'],
+                    item['capacity_req'], item['classrooms']
+                )
+                for item, _ in placements
+            ],
+            {room.id: room.capacity for room in snapshot.classrooms},
+            existing,
+            list(snapshot.group_sizes),
+            snapshot.teacher_ids
+        )
+
+        # Ход составления. Занятие учебного плана считается обработанным
+        # после попытки разместить последнее из его занятий
+        curricula_total = len(curriculum_data)
+        last_lessons = {
+            end - 1 for end in accumulate(
+                len(item['needed_lessons']) for item in curriculum_data
+            )
+        }
+        done = {'curricula': 0, 'placed': 0}
+
+        def report(processed: int, placed: int, unplaced: int) -> None:
+            if progress is not None:
+                progress(ScheduleProgress(
+                    curricula_total, processed, placed, unplaced
+                ))
+
+        def on_slot(number: int, slot: Optional[tuple]) -> None:
+            done['placed'] += slot is not None
+            done['curricula'] += number in last_lessons
+            report(done['curricula'], done['placed'], number + 1 - done['placed'])
+
+        def on_start(started: int, total: int, best: list) -> None:
+            placed = len(best) - best.count(None)
+            report(curricula_total * started // total, placed, len(best) - placed)
+
+        def on_improve(placed: int) -> None:
+            report(curricula_total, placed, len(placements) - placed)
+
+        # Распределение занятий
+        if mode == ScheduleMode.MULTISTART:
+            # Лучшее из нескольких жадных размещений в пуле процессов
+            slots = multistart(problem, starts, seed, progress=on_start)
+        else:
+            # Первая свободная ячейка
+            slots = place_greedy(problem, progress=on_slot)
+        if mode == ScheduleMode.ANNEALING:
+            # Улучшение жадного решения: существующие занятия
+            # не перемещаются
+            optimizer = ScheduleOptimizer(problem.items, problem.classrooms)
+            for lesson in existing:
+                optimizer.occupy(*lesson)
+            slots = optimizer.run(slots, time_budget, seed, on_improve)
+        placed = len(slots) - slots.count(None)
+        report(curricula_total, placed, len(slots) - placed)
+
+        # Размещённые занятия: (занятие, id групп, id преподавателей)
+        placed = []
+        for (item, lesson_type), slot in zip(placements, slots):
+            if slot is None:
+                unplaced.append(UnplacedLessonData(
+                    curriculum_id=item['obj'].id,
+                    lesson_type=lesson_type,
+                    reason=UnplacedReason.NO_FREE_SLOT if item['classrooms']
+                    else UnplacedReason.NO_CLASSROOM
+                ))
+                continue
+            week, day, pair, room_id = slot
+            placed.append((PlacedLessonData(
+                week=week,
+                day=day,
+                pair=pair,
+                classroom_id=room_id,
+                curriculum_id=item['obj'].id,
+                lesson_type=lesson_type
+            ), item['groups'], item['teachers']))
+        if dry_run or not placed:
+            return ScheduleReport(
+                dry_run=dry_run, lessons=[lesson for lesson, *_ in placed],
+                unplaced=unplaced
+            )
+
+        with self._schedule_lock, Session(self.engine) as session:
+            index, lesson_version = self._begin_schedule_write(session)
+            if lesson_version != snapshot_version + 1:
+                # Расписание изменено во время составления: записываются
+                # только размещения, которые остались допустимыми
+                placed = self._recheck_placements(
+                    session, index, placed, lesson_counts, unplaced
+                )
+            if not placed:
+                # Версия не увеличивается (транзакция откатывается)
+                return ScheduleReport(dry_run=False, lessons=[], unplaced=unplaced)
+            lessons = [lesson for lesson, *_ in placed]
+
+            # Все занятия добавляются пакетными INSERT ... VALUES
+            # без создания ORM-объектов
+            ids = session.execute(
+                insert(Lesson).returning(
+                    Lesson.id, sort_by_parameter_order=True
+                ),
+                [lesson.dict(exclude={'id'}) for lesson in lessons]
+            ).scalars().all()
+            # Во время транзакции записи другие занятия не добавляются,
+            # поэтому в диапазон id попадают только новые
+            new_lessons = Lesson.id.between(min(ids), max(ids))
+            self._refresh_occupancy(session, new_lessons)
+            self._log_changes(
+                session, lesson_version, ChangeAction.INSERTED, new_lessons
+            )
             session.commit()
 
-    def find_collisions(self) -> dict:
-        '''Поиск коллизий и окон в расписании'''
+            for (lesson, group_ids, teacher_ids), id in zip(placed, ids):
+                lesson.id = id
+                index.add(
+                    id, lesson.week, lesson.day, lesson.pair,
+                    group_ids, teacher_ids, lesson.classroom_id
+                )
+            self._end_schedule_write(lesson_version)
+        return ScheduleReport(dry_run=False, lessons=lessons, unplaced=unplaced)
+
+    @staticmethod
+    def _recheck_placements(
+        session: Session,
+        index: CollisionIndex,
+        placed: list[tuple[PlacedLessonData, list[int], list[int]]],
+        lesson_counts: Counter,
+        unplaced: list[UnplacedLessonData]
+    ) -> list[tuple[PlacedLessonData, list[int], list[int]]]:
+        '''Проверяет размещения (занятие, id групп, id преподавателей),
+        вычисленные по снимку с числом занятий lesson_counts, по текущему
+        состоянию расписания (индексу занятости index). Размещения в занятых
+        ячейках добавляются в unplaced, размещения занятий, уже добавленных
+        в расписание другими пользователями, отбрасываются.
+        Возвращает оставшиеся размещения'''
+        # Сколько занятий каждого вида добавлено с момента снимка
+        added = {
+            (curriculum_id, lesson_type): count - lesson_counts[(curriculum_id, lesson_type)]
+            for curriculum_id, lesson_type, count in session.exec(
+                select(Lesson.curriculum_id, Lesson.lesson_type, func.count())
+                .where(Lesson.curriculum_id.in_(
+                    {lesson.curriculum_id for lesson, *_ in placed}
+                ))
+                .group_by(Lesson.curriculum_id, Lesson.lesson_type)
+            ).all()
+        }
+        result = []
+        for lesson, group_ids, teacher_ids in placed:
+            key = (lesson.curriculum_id, lesson.lesson_type)
+            if added.get(key, 0) > 0:
+                added[key] -= 1
+                continue
+            if index.conflicts(
+                lesson.week, lesson.day, lesson.pair,
+                group_ids, teacher_ids, lesson.classroom_id
+            ):
+                unplaced.append(UnplacedLessonData(
+                    curriculum_id=lesson.curriculum_id,
+                    lesson_type=lesson.lesson_type,
+                    reason=UnplacedReason.SLOT_TAKEN
+                ))
+                continue
+            result.append((lesson, group_ids, teacher_ids))
+        return result
+
+    @staticmethod
+    def _check_schedule_params(
+        mode: ScheduleMode,
+        time_budget: float,
+        starts: Optional[int]
+    ) -> None:
+        '''Проверяет параметры автоматического составления расписания'''
+        if mode == ScheduleMode.ANNEALING and time_budget <= 0:
+            raise ValueError("Время улучшения расписания должно быть больше нуля")
+        if mode == ScheduleMode.MULTISTART and starts is not None and starts < 1:
+            raise ValueError("Число запусков должно быть не меньше 1")
+
+    def create_schedule_job(
+        self,
+        mode: ScheduleMode = ScheduleMode.GREEDY,
+        time_budget: float = 10.0,
+        seed: Optional[int] = None,
+        starts: Optional[int] = None,
+        dry_run: bool = False
+    ) -> int:
+        self._check_schedule_params(mode, time_budget, starts)
+        now = time.time()
         with Session(self.engine) as session:
-            # Загрузка всех занятий
-            lessons = session.exec(select(Lesson)).all()
-            
-            # Структуры для анализа
-            group_schedule = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-            teacher_schedule = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-            room_schedule = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-            
-            # Заполнение структур
-            for lesson in lessons:
-                curriculum = session.get(Curriculum, lesson.curriculum_id)
-                if not curriculum:
-                    continue
-                    
-                # Определение групп
-                group_ids = []
-                if curriculum.group_id:
-                    group_ids = [curriculum.group_id]
-                elif curriculum.flow_id:
-                    # Исправление: получение простого списка ID групп
-                    flow_groups = session.exec(
-                        select(FlowGroupLink.group_id)
-                        .where(FlowGroupLink.flow_id == curriculum.flow_id)
-                    ).all()
-                    group_ids = [g for g, in flow_groups] if flow_groups and isinstance(flow_groups[0], tuple) else flow_groups
-                
-                # Преподаватели
-                teacher_ids = [curriculum.primary_teacher_id]
-                if curriculum.secondary_teacher_id:
-                    teacher_ids.append(curriculum.secondary_teacher_id)
-                
-                # Заполнение данных
-                for group_id in group_ids:
-                    group_schedule[group_id][lesson.week][lesson.day].append((lesson.pair, lesson.id))
-                
-                for teacher_id in teacher_ids:
-                    teacher_schedule[teacher_id][lesson.week][lesson.day].append((lesson.pair, lesson.id))
-                
-                room_schedule[lesson.classroom_id][lesson.week][lesson.day].append((lesson.pair, lesson.id))
-            
-            # Поиск ошибок (наложение занятий)
-            errors = []
-            
-            # Для групп
-            for group_id, weeks in group_schedule.items():
-                for week, days in weeks.items():
-                    for day, pairs in days.items():
-                        pairs.sort()
-                        for i in range(1, len(pairs)):
-                            if pairs[i][0] == pairs[i-1][0]:
-                                errors.append({
-                                    "type": "group",
-                                    "id": group_id,
-                                    "week": week,
-                                    "day": day,
-                                    "pair": pairs[i][0],
-                                    "lesson_ids": [pairs[i-1][1], pairs[i][1]]
-                                })
-            
-            # Для преподавателей
-            for teacher_id, weeks in teacher_schedule.items():
-                for week, days in weeks.items():
-                    for day, pairs in days.items():
-                        pairs.sort()
-                        for i in range(1, len(pairs)):
-                            if pairs[i][0] == pairs[i-1][0]:
-                                errors.append({
-                                    "type": "teacher",
-                                    "id": teacher_id,
-                                    "week": week,
-                                    "day": day,
-                                    "pair": pairs[i][0],
-                                    "lesson_ids": [pairs[i-1][1], pairs[i][1]]
-                                })
-            
-            # Для аудиторий
-            for room_id, weeks in room_schedule.items():
-                for week, days in weeks.items():
-                    for day, pairs in days.items():
-                        pairs.sort()
-                        for i in range(1, len(pairs)):
-                            if pairs[i][0] == pairs[i-1][0]:
-                                errors.append({
-                                    "type": "classroom",
-                                    "id": room_id,
-                                    "week": week,
-                                    "day": day,
-                                    "pair": pairs[i][0],
-                                    "lesson_ids": [pairs[i-1][1], pairs[i][1]]
-                                })
-            
-            # Поиск окон
-            group_windows = []
-            teacher_windows = []
-            
-            # Для групп
-            for group_id, weeks in group_schedule.items():
-                for week, days in weeks.items():
-                    for day, pairs in days.items():
-                        pairs.sort()
-                        for i in range(1, len(pairs)):
-                            gap = pairs[i][0] - pairs[i-1][0] - 1
-                            if gap > 0:
-                                group_windows.append({
-                                    "group_id": group_id,
-                                    "week": week,
-                                    "day": day,
-                                    "window_start_pair": pairs[i-1][0],
-                                    "window_end_pair": pairs[i][0],
-                                    "window_size": gap
-                                })
-            
-            # Для преподавателей
-            for teacher_id, weeks in teacher_schedule.items():
-                for week, days in weeks.items():
-                    for day, pairs in days.items():
-                        pairs.sort()
-                        for i in range(1, len(pairs)):
-                            gap = pairs[i][0] - pairs[i-1][0] - 1
-                            if gap > 0:
-                                teacher_windows.append({
-                                    "teacher_id": teacher_id,
-                                    "week": week,
-                                    "day": day,
-                                    "window_start_pair": pairs[i-1][0],
-                                    "window_end_pair": pairs[i][0],
-                                    "window_size": gap
-                                })
-            
-            return {
-                "errors": errors,
-                "group_windows": group_windows,
-                "teacher_windows": teacher_windows
-            }
+            # Задачи, прерванные вместе с выполнявшим их процессом
+            session.exec(
+                update(ScheduleJob)
+                .where(ScheduleJob.active == True)
+                .where(ScheduleJob.updated_at < now - STALE_JOB_TIMEOUT)
+                .values(
+                    status=JobStatus.FAILED, active=None, finished_at=now,
+                    error="Задача прервана"
+                )
+            )
+            job = ScheduleJob(
+                mode=mode, time_budget=time_budget, seed=seed, starts=starts,
+                dry_run=dry_run, created_at=now, updated_at=now
+            )
+            session.add(job)
+            try:
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                active_id = session.exec(
+                    select(ScheduleJob.id).where(ScheduleJob.active == True)
+                ).first()
+                raise ValueError(
+                    f"Расписание уже составляется (задача {active_id})"
+                )
+            return job.id
+
+    def run_schedule_job(self, id: int) -> None:
+        now = time.time()
+        with Session(self.engine) as session:
+            # Задача могла быть отменена до запуска
+            started = session.exec(
+                update(ScheduleJob)
+                .where(ScheduleJob.id == id)
+                .where(ScheduleJob.status == JobStatus.QUEUED)
+                .values(status=JobStatus.RUNNING, started_at=now, updated_at=now)
+            ).rowcount
+            session.commit()
+            if not started:
+                return
+            job = session.get(ScheduleJob, id)
+
+        last = {'progress': None, 'saved': time.monotonic()}
+
+        def save_progress(progress: ScheduleProgress) -> None:
+            last['progress'] = progress
+            if time.monotonic() - last['saved'] < JOB_PROGRESS_INTERVAL:
+                return
+            last['saved'] = time.monotonic()
+            with Session(self.engine) as session:
+                session.exec(
+                    update(ScheduleJob)
+                    .where(ScheduleJob.id == id)
+                    .values(**progress._asdict(), updated_at=time.time())
+                )
+                session.commit()
+                if session.exec(
+                    select(ScheduleJob.cancel_requested)
+                    .where(ScheduleJob.id == id)
+                ).one():
+                    raise ScheduleCancelled()
+
+        status, error, report = JobStatus.DONE, None, None
+        try:
+            report = self.auto_schedule(
+                job.mode, job.time_budget, job.seed, job.starts,
+                save_progress, job.dry_run
+            ).json(ensure_ascii=False)
+        except ScheduleCancelled:
+            status = JobStatus.CANCELLED
+        except Exception as exc:
+            logging.exception(f"Ошибка задачи составления расписания {id}")
+            status, error = JobStatus.FAILED, str(exc)
+
+        now = time.time()
+        values = last['progress']._asdict() if last['progress'] else {}
+        with Session(self.engine) as session:
+            session.exec(
+                update(ScheduleJob)
+                .where(ScheduleJob.id == id)
+                .values(
+                    **values, status=status, error=error, report=report,
+                    active=None, finished_at=now, updated_at=now
+                )
+            )
+            session.commit()
 
+    def get_schedule_job(self, id: int) -> ScheduleJobData:
+        with Session(self.engine) as session:
+            job = session.get(ScheduleJob, id)
+            if not job:
+                raise ValueError(f"Задача с ID {id} не найдена")
+            elapsed = 0.0
+            if job.started_at is not None:
+                elapsed = (job.finished_at or time.time()) - job.started_at
+            return ScheduleJobData(
+                id=job.id,
+                status=job.status,
+                mode=job.mode,
+                dry_run=job.dry_run,
+                curricula_total=job.curricula_total,
+                curricula_processed=job.curricula_processed,
+                lessons_placed=job.lessons_placed,
+                lessons_unplaced=job.lessons_unplaced,
+                elapsed=elapsed,
+                error=job.error,
+                report=ScheduleReport.parse_raw(job.report) if job.report else None
+            )
 
-def get_database(db_string: str) -> Database:
+    def cancel_schedule_job(self, id: int) -> None:
+        now = time.time()
+        with Session(self.engine) as session:
+            # Условные UPDATE: состояние задачи могло измениться после чтения
+            cancelled = session.exec(
+                update(ScheduleJob)
+                .where(ScheduleJob.id == id)
+                .where(ScheduleJob.status == JobStatus.QUEUED)
+                .values(
+                    status=JobStatus.CANCELLED, active=None,
+                    finished_at=now, updated_at=now
+                )
+            ).rowcount or session.exec(
+                update(ScheduleJob)
+                .where(ScheduleJob.id == id)
+                .where(ScheduleJob.status == JobStatus.RUNNING)
+                .values(cancel_requested=True)
+            ).rowcount
+            session.commit()
+            if cancelled:
+                return
+            if not session.get(ScheduleJob, id):
+                raise ValueError(f"Задача с ID {id} не найдена")
+            raise ValueError(f"Задача с ID {id} уже завершена")
+
+    def find_collisions(self) -> dict:
+        '''Поиск коллизий и окон в расписании. Отчёт берётся из индекса
+        занятости и пересчитывается только после изменений расписания'''
+        with self._schedule_lock, Session(self.engine) as session:
+            lesson_version = session.exec(
+                select(ScheduleRevision.lesson_version)
+                .where(ScheduleRevision.id == 1)
+            ).one()
+            return self._sync_collision_index(session, lesson_version).report()
+
+    def get_slow_queries(self) -> list[SlowQueryData]:
+        '''Возвращает последние медленные SQL-запросы (от новых к старым)'''
+        if self.slow_queries is None:
+            raise ValueError("Журнал медленных запросов не включён")
+        return self.slow_queries.entries()
+
+
+# Параметры подключения к SQLite:
+# - WAL - читатели не блокируются писателем и наоборот
+# - busy_timeout - ожидание блокировки записи вместо ошибки "database is locked"
+# - synchronous=NORMAL - в режиме WAL безопасно и быстрее FULL
+# - mmap_size, cache_size - отображение файла БД в память и размер кэша страниц
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 30000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 268435456,
+    'cache_size': -65536
+}
+
+
+def _set_sqlite_pragmas(engine: Engine, pragmas: dict) -> None:
+    '''Выполняет PRAGMA при каждом новом подключении к SQLite'''
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def get_database(
+    db_string: str,
+    pool_size: Optional[int] = None,
+    max_overflow: Optional[int] = None,
+    pool_timeout: Optional[float] = None,
+    sqlite_pragmas: Optional[dict] = None,
+    slow_query_threshold: Optional[float] = None
+) -> Database:
     '''Проверяет, корректно ли введён параметр базы данных,
-    возвращает объект БД'''
+    возвращает объект БД.
+    pool_size, max_overflow, pool_timeout - параметры пула подключений
+    (если не указаны - по умолчанию SQLAlchemy)
+    sqlite_pragmas - PRAGMA для SQLite (по умолчанию SQLITE_PRAGMAS)
+    slow_query_threshold - порог (в секундах) журнала медленных запросов
+    (None - журнал выключен)'''
+    pool_options = {
+        name: value for name, value in (
+            ('pool_size', pool_size),
+            ('max_overflow', max_overflow),
+            ('pool_timeout', pool_timeout)
+        ) if value is not None
+    }
+    if sqlite_pragmas is None:
+        sqlite_pragmas = SQLITE_PRAGMAS
     try:
-        return SQLDatabase(db_string)
+        return SQLDatabase(
+            db_string, pool_options, sqlite_pragmas, slow_query_threshold
+        )
     except Exception as e:
         raise TypeError(
             f'The database address is incorrect. Error: {e}'
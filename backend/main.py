@@ -1,13 +1,23 @@
 # Основной модуль приложения
 
+import argparse
 import logging
+import os
+
+from fastapi import FastAPI
 
 from web import WebApp
+from db.main_db import Database
 from db.sql_db import get_database
 
 
 LISTEN_HOST = '0.0.0.0'
 DEFAULT_LISTEN_PORT = 8000
+# Адрес БД можно переопределить переменной окружения SCHEDULE_DB_URL
+DB_URL = os.environ.get('SCHEDULE_DB_URL', 'sqlite:///test_schedule.sqlite')
+# Порог журнала медленных SQL-запросов в миллисекундах (GET /admin/slow_queries);
+# если переменная окружения SCHEDULE_SLOW_QUERY_MS не задана, журнал выключен
+SLOW_QUERY_MS = os.environ.get('SCHEDULE_SLOW_QUERY_MS')
 
 
 logging.basicConfig(
@@ -16,12 +26,43 @@ logging.basicConfig(
 )
 
 
+def open_database() -> Database:
+    '''Подключается к БД DB_URL'''
+    slow_query_threshold = float(SLOW_QUERY_MS) / 1000 if SLOW_QUERY_MS else None
+    return get_database(DB_URL, slow_query_threshold=slow_query_threshold)
+
+
+def create_app() -> FastAPI:
+    '''Создаёт приложение веб-API. Вызывается в каждом рабочем процессе
+    при запуске с несколькими процессами'''
+    db = open_database()
+    return WebApp(db, (LISTEN_HOST, DEFAULT_LISTEN_PORT)).app
+
+
 def main() -> int:
     '''Метод для запуска веб-API'''
-    db = get_database('sqlite:///test_schedule.sqlite')
+    parser = argparse.ArgumentParser(description='Веб-API расписания')
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='число рабочих процессов сервера'
+    )
+    parser.add_argument('--port', type=int, default=DEFAULT_LISTEN_PORT)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Схема БД создаётся один раз до запуска процессов, чтобы они
+        # не создавали таблицы одновременно
+        get_database(DB_URL)
+        WebApp.serve_workers(
+            'main:create_app', (LISTEN_HOST, args.port), args.workers
+        )
+        return 0
+
+    db = open_database()
     #db.create_test_data()
-    web_app = WebApp(db, (LISTEN_HOST, DEFAULT_LISTEN_PORT))
+    web_app = WebApp(db, (LISTEN_HOST, args.port))
     web_app.serve()
+    return 0
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,67 @@
+#
+#
+#
+
+'''Общие фикстуры тестов: синтетические университеты двух размеров
+(см. db.generator) с составленным расписанием'''
+
+import sys
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+# Тесты запускаются из каталога backend или из корня репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmark.runner import QueryCounter  # noqa: E402
+from db.generator import GeneratorParams  # noqa: E402
+from db.sql_db import SQLDatabase, get_database  # noqa: E402
+
+
+# Размеры университетов: число запросов методов не должно от них зависеть.
+# В большом университете каждой сущности в несколько раз больше,
+# чем в малом
+SIZES = {
+    'small': GeneratorParams(
+        faculties=2, departments=2, groups=24, teachers=12,
+        classrooms=10, subjects=30, curricula=72, seed=1
+    ),
+    'large': GeneratorParams(
+        faculties=4, departments=3, groups=96, teachers=48,
+        classrooms=30, subjects=60, curricula=288, seed=1
+    )
+}
+
+
+@pytest.fixture(scope='session')
+def databases(tmp_path_factory) -> dict[str, SQLDatabase]:
+    '''БД каждого размера во временном файле SQLite'''
+    result = {}
+    for name, params in SIZES.items():
+        path = tmp_path_factory.mktemp(name) / 'schedule.sqlite'
+        db = get_database(f'sqlite:///{path}')
+        db.generate_university(params)
+        db.auto_schedule()
+        result[name] = db
+    yield result
+    for db in result.values():
+        db.engine.dispose()
+
+
+def count_queries(db: SQLDatabase, operation: Callable[[], object]) -> int:
+    '''Число SQL-запросов, выполненных operation (кэши БД сбрасываются,
+    т.е. учитывается построение результата по БД)'''
+    db.drop_caches()
+    with QueryCounter(db.engine) as counter:
+        operation()
+    return counter.count
+
+
+def check_budget(name: str, counts: dict[str, int], budget: int) -> None:
+    '''Проверяет, что число запросов не зависит от размера данных
+    и не превышает бюджет'''
+    assert len(set(counts.values())) == 1, \
+        f'{name}: число SQL-запросов растёт с размером данных: {counts}'
+    assert max(counts.values()) <= budget, \
+        f'{name}: {max(counts.values())} SQL-запросов при бюджете {budget}'
@@ -0,0 +1,20 @@
+#
+#
+#
+
+'''Улучшение расписания имитацией отжига (utils.optimizer)'''
+
+from utils.optimizer import ScheduleItem, ScheduleOptimizer
+
+
+def test_rooms_of_sufficient_capacity():
+    '''Занятие размещается только в аудитории достаточной вместимости,
+    а без таких аудиторий остаётся неразмещённым'''
+    items = [
+        ScheduleItem([1], [1], 30, []),
+        ScheduleItem([2], [2], 30, [20])
+    ]
+    optimizer = ScheduleOptimizer(items, {10: 20, 20: 40})
+    slots = optimizer.run([None, None], 0.2, seed=1)
+    assert slots[0] is None
+    assert slots[1] is not None and slots[1][3] == 20
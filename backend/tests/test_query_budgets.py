@@ -0,0 +1,179 @@
+#
+#
+#
+
+'''Бюджеты SQL-запросов методов Database и маршрутов веб-API. Каждая
+операция выполняется на университетах двух размеров: число запросов
+должно совпадать (нет запросов на каждую строку) и не превышать бюджет'''
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from db.main_db import (
+    BulkIngestData, BulkGroupData, BulkCurriculumData, CourseEnum, LessonType,
+    ScheduleMode
+)
+from db.models import Curriculum, Lesson
+from web import WebApp
+
+from conftest import check_budget, count_queries
+
+
+# Записи, которые есть в университете любого размера (id назначаются
+# генератором по порядку): университет, факультет, кафедра, группа,
+# преподаватель, аудитория, поток
+UNIVERSITY_ID = 1
+FACULTY_ID = 2
+DEPARTMENT_ID = 3
+GROUP_ID = 1
+TEACHER_ID = 1
+CLASSROOM_ID = 1
+FLOW_ID = 1
+
+
+# (название, вызов, бюджет запросов)
+READ_CASES = [
+    ('get_university_data', lambda db: db.get_university_data(), 5),
+    ('get_university_subtree', lambda db: db.get_university_subtree(UNIVERSITY_ID, 3), 9),
+    ('get_subjects', lambda db: db.get_subjects(), 1),
+    ('get_flows', lambda db: db.get_flows(), 1),
+    ('get_curriculum', lambda db: db.get_curriculum(), 2),
+    ('get_curriculum[department]', lambda db: db.get_curriculum(FACULTY_ID), 2),
+    ('get_classrooms', lambda db: db.get_classrooms(), 1),
+    ('get_classrooms[department]', lambda db: db.get_classrooms(FACULTY_ID), 1),
+    ('get_schedule', lambda db: db.get_schedule(), 3),
+    ('get_schedule[group]', lambda db: db.get_schedule(group_id=GROUP_ID), 3),
+    ('get_schedule[teacher]', lambda db: db.get_schedule(teacher_id=TEACHER_ID), 3),
+    ('get_schedule[classroom]', lambda db: db.get_schedule(classroom_id=CLASSROOM_ID), 3),
+    ('get_schedule[flow]', lambda db: db.get_schedule(flow_id=FLOW_ID), 3),
+    ('get_schedule[department]', lambda db: db.get_schedule(department_id=FACULTY_ID), 3),
+    ('get_schedule_json', lambda db: db.get_schedule_json(), 3),
+    ('get_schedule_msgpack', lambda db: db.get_schedule_msgpack(), 3),
+    ('get_schedule_changes', lambda db: db.get_schedule_changes(0), 6),
+    ('find_collisions', lambda db: db.find_collisions(), 2),
+    ('auto_schedule[dry_run]', lambda db: db.auto_schedule(dry_run=True), 9),
+    (
+        'auto_schedule[annealing]',
+        lambda db: db.auto_schedule(
+            ScheduleMode.ANNEALING, time_budget=0.1, seed=1, dry_run=True
+        ),
+        9
+    )
+]
+
+
+@pytest.mark.parametrize(
+    'name, call, budget', READ_CASES, ids=[case[0] for case in READ_CASES]
+)
+def test_read_budget(databases, name, call, budget):
+    counts = {
+        size: count_queries(db, lambda: call(db))
+        for size, db in databases.items()
+    }
+    check_budget(name, counts, budget)
+
+
+def _first_ids(db) -> tuple[int, int]:
+    '''id первого занятия расписания и первого занятия учебного плана
+    у группы (у занятий потоков больше участников - другие запросы)'''
+    with Session(db.engine) as session:
+        lesson_id = session.exec(select(Lesson.id).order_by(Lesson.id)).first()
+        curriculum_id = session.exec(
+            select(Curriculum.id)
+            .where(Curriculum.group_id.is_not(None))
+            .order_by(Curriculum.id)
+        ).first()
+    return lesson_id, curriculum_id
+
+
+def test_write_budgets(databases):
+    '''Изменения расписания и справочников (каждое - на обеих БД)'''
+    counts = {}
+    for size, db in databases.items():
+        lesson_id, curriculum_id = _first_ids(db)
+        version = db.get_schedule_changes(0).version
+        added = {}
+        counts.setdefault('add_group', {})[size] = count_queries(
+            db, lambda: db.add_group(1, 'Новая группа', CourseEnum.BACHELOR_1, 20)
+        )
+        counts.setdefault('add_lesson_to_schedule', {})[size] = count_queries(
+            db, lambda: added.setdefault('id', db.add_lesson_to_schedule(
+                1, 1, 1, CLASSROOM_ID, curriculum_id, LessonType.LECTURE
+            ))
+        )
+        counts.setdefault('edit_schedule_cell', {})[size] = count_queries(
+            db, lambda: db.edit_schedule_cell(
+                lesson_id, CLASSROOM_ID, curriculum_id, LessonType.LAB
+            )
+        )
+        counts.setdefault('remove_schedule_cell', {})[size] = count_queries(
+            db, lambda: db.remove_schedule_cell(added['id'])
+        )
+        # Изменения после трёх записей выше (не всё расписание)
+        counts.setdefault('get_schedule_changes[since]', {})[size] = count_queries(
+            db, lambda: db.get_schedule_changes(version)
+        )
+        counts.setdefault('bulk_ingest', {})[size] = count_queries(
+            db, lambda: db.bulk_ingest(BulkIngestData(
+                groups=[BulkGroupData(
+                    name='Группа пакета', course=CourseEnum.BACHELOR_2,
+                    student_count=25, speciality_id=1
+                )],
+                curriculum=[BulkCurriculumData(
+                    hours=72, subject_id=1, primary_teacher_id=TEACHER_ID,
+                    group_name='Группа пакета'
+                )]
+            ))
+        )
+    budgets = {
+        'add_group': 6, 'add_lesson_to_schedule': 11, 'edit_schedule_cell': 11,
+        'remove_schedule_cell': 8, 'get_schedule_changes[since]': 6,
+        'bulk_ingest': 9
+    }
+    for name, budget in budgets.items():
+        check_budget(name, counts[name], budget)
+
+
+@pytest.fixture(scope='module')
+def clients(databases) -> dict[str, TestClient]:
+    '''Клиенты веб-API для БД каждого размера'''
+    return {
+        size: TestClient(WebApp(db, ('localhost', 8000)).app)
+        for size, db in databases.items()
+    }
+
+
+# (метод HTTP, путь, параметры, бюджет запросов)
+ROUTE_CASES = [
+    ('GET', '/university_data', {}, 5),
+    ('GET', f'/university_data/{UNIVERSITY_ID}', {'depth': 3}, 9),
+    ('GET', '/subject', {}, 1),
+    ('GET', '/flow', {}, 1),
+    ('GET', '/curriculum', {}, 2),
+    ('GET', '/curriculum', {'department_id': FACULTY_ID}, 2),
+    ('GET', '/classroom', {}, 1),
+    ('GET', '/schedule', {}, 3),
+    ('GET', '/schedule', {'group_id': GROUP_ID}, 3),
+    ('GET', '/schedule', {'teacher_id': TEACHER_ID, 'week': 1}, 3),
+    ('GET', '/schedule', {'department_id': DEPARTMENT_ID}, 3),
+    ('GET', '/schedule/changes', {'since': 0}, 6),
+    ('POST', '/find_collisions', {}, 2),
+    ('GET', '/metrics', {}, 0)
+]
+
+
+@pytest.mark.parametrize(
+    'method, path, params, budget', ROUTE_CASES,
+    ids=[f'{case[0]} {case[1]} {case[2]}' for case in ROUTE_CASES]
+)
+def test_route_budget(databases, clients, method, path, params, budget):
+    def call(client: TestClient) -> None:
+        response = client.request(method, path, params=params)
+        assert response.status_code == 200, response.text
+
+    counts = {
+        size: count_queries(databases[size], lambda: call(client))
+        for size, client in clients.items()
+    }
+    check_budget(f'{method} {path} {params}', counts, budget)
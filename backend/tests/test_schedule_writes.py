@@ -0,0 +1,168 @@
+#
+#
+#
+
+'''Изменения данных и расписания на отдельной (не общей для тестов) БД'''
+
+import threading
+import time
+
+import pytest
+
+from sqlmodel import Session, select
+
+from db.main_db import (
+    BulkIngestData, BulkCurriculumData, ChangeAction, LessonType, UnplacedReason
+)
+from db.models import Curriculum, Group, Subject
+from db.sql_db import SQLDatabase, get_database
+
+from conftest import SIZES
+
+
+# Записи университета любого размера: предмет без занятий учебного плана
+# (предметов больше, чем занятий у группы), группа, преподаватель, аудитория
+SUBJECT_ID = 30
+GROUP_ID = 1
+TEACHER_ID = 1
+CLASSROOM_ID = 1
+
+
+@pytest.fixture
+def db(tmp_path) -> SQLDatabase:
+    '''Малый университет без расписания'''
+    db = get_database(f'sqlite:///{tmp_path / "schedule.sqlite"}')
+    db.generate_university(SIZES['small'])
+    yield db
+    db.engine.dispose()
+
+
+def test_same_primary_and_secondary_teacher(db):
+    '''Преподаватель, указанный дважды, занят занятием один раз'''
+    curriculum_id = db.add_lesson_to_plan(
+        SUBJECT_ID, 72, TEACHER_ID, TEACHER_ID, GROUP_ID, None
+    )
+    lesson_id = db.add_lesson_to_schedule(
+        1, 1, 1, CLASSROOM_ID, curriculum_id, LessonType.LECTURE, strict=True
+    )
+    db.edit_schedule_cell(lesson_id, CLASSROOM_ID, curriculum_id, LessonType.LAB)
+    assert not db.find_collisions()['errors']
+
+    db.remove_schedule_cell(lesson_id)
+    report = db.auto_schedule()
+    assert any(lesson.curriculum_id == curriculum_id for lesson in report.lessons)
+
+
+def test_writes_during_auto_schedule(db):
+    '''Во время составления расписание можно читать и изменять;
+    размещения, ставшие недопустимыми, не записываются'''
+    curriculum_id = db.add_lesson_to_plan(
+        SUBJECT_ID, 72, TEACHER_ID, None, GROUP_ID, None
+    )
+    started = threading.Event()
+    resume = threading.Event()
+    reports = []
+
+    def progress(_) -> None:
+        # Составление приостанавливается на первом сообщении о ходе
+        if not started.is_set():
+            started.set()
+            resume.wait(timeout=5)
+
+    thread = threading.Thread(
+        target=lambda: reports.append(db.auto_schedule(progress=progress))
+    )
+    thread.start()
+    try:
+        assert started.wait(timeout=5)
+        began = time.perf_counter()
+        db.find_collisions()
+        # Занятие, которое составление тоже размещает
+        db.add_lesson_to_schedule(
+            1, 1, 1, CLASSROOM_ID, curriculum_id, LessonType.LECTURE
+        )
+        assert time.perf_counter() - began < 1
+    finally:
+        resume.set()
+        thread.join()
+
+    report, = reports
+    assert report.lessons
+    assert curriculum_id not in {lesson.curriculum_id for lesson in report.lessons}
+    assert not db.find_collisions()['errors']
+    assert len(db.get_schedule_changes(0).changes) == len(report.lessons) + 1
+
+
+def test_slot_taken_during_auto_schedule(db):
+    '''Занятие, ячейку которого заняли во время составления,
+    возвращается как неразмещённое'''
+    started = threading.Event()
+    resume = threading.Event()
+    reports = []
+
+    def progress(_) -> None:
+        if not started.is_set():
+            started.set()
+            resume.wait(timeout=5)
+
+    thread = threading.Thread(
+        target=lambda: reports.append(db.auto_schedule(progress=progress))
+    )
+    thread.start()
+    try:
+        assert started.wait(timeout=5)
+        # Снимок не изменился, поэтому пробное составление размещает
+        # занятия так же, как приостановленное
+        planned = db.auto_schedule(dry_run=True).lessons[0]
+        other_id = next(
+            c.id for c in db.get_curriculum() if c.id != planned.curriculum_id
+        )
+        # Другое занятие в той же аудитории в ту же пару
+        db.add_lesson_to_schedule(
+            planned.week, planned.day, planned.pair, planned.classroom_id,
+            other_id, LessonType.LAB
+        )
+    finally:
+        resume.set()
+        thread.join()
+
+    report, = reports
+    assert (planned.curriculum_id, UnplacedReason.SLOT_TAKEN) in {
+        (item.curriculum_id, item.reason) for item in report.unplaced
+    }
+    assert not db.find_collisions()['errors']
+
+
+def test_changes_since_empty_schedule(db):
+    '''Изменения после версии 0 (пустого расписания) - по журналу,
+    а не всё расписание'''
+    assert db.get_schedule_changes(0).version == 0
+    curriculum_id = db.add_lesson_to_plan(
+        SUBJECT_ID, 72, TEACHER_ID, None, GROUP_ID, None
+    )
+    lesson_id = db.add_lesson_to_schedule(
+        1, 1, 1, CLASSROOM_ID, curriculum_id, LessonType.LECTURE
+    )
+    changes = db.get_schedule_changes(0)
+    assert not changes.full
+    assert [(c.lesson_id, c.action) for c in changes.changes] == \
+        [(lesson_id, ChangeAction.INSERTED)]
+
+
+def test_bulk_ingest_duplicate_by_names(db):
+    '''Занятие учебного плана, предмет и группа которого указаны
+    по названиям, не добавляется повторно'''
+    with Session(db.engine) as session:
+        subject_name, group_name = session.exec(
+            select(Subject.name, Group.name)
+            .join(Curriculum, Curriculum.subject_id == Subject.id)
+            .join(Group, Curriculum.group_id == Group.id)
+            .order_by(Curriculum.id)
+        ).first()
+    count = len(db.get_curriculum())
+    result = db.bulk_ingest(BulkIngestData(curriculum=[BulkCurriculumData(
+        hours=72, subject_name=subject_name, group_name=group_name,
+        primary_teacher_id=TEACHER_ID
+    )]))
+    assert [(e.section, e.index) for e in result.errors] == [('curriculum', 0)]
+    assert len(db.get_curriculum()) == count
@@ -0,0 +1,194 @@
+#
+#
+#
+
+'''Модуль определяет рассылку изменений расписания подписчикам (клиентам
+WebSocket). Журнал изменений опрашивается одной задачей на процесс
+веб-сервера для всех его подписчиков: пока расписание не меняется, опрос -
+один лёгкий запрос к БД, а подписчики только ожидают сообщений.
+Изменения, сделанные другими процессами, попадают в журнал через БД,
+поэтому рассылаются так же'''
+
+import asyncio
+import contextlib
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from db.main_db import ChangeAction, ScheduleChangesData
+from utils.encoding import to_json
+
+
+# Как часто (в секундах) опрашивается журнал изменений
+POLL_INTERVAL = 0.5
+# Сколько сообщений может ожидать отправки подписчику. Отстающий подписчик
+# отключается и переподключается со своей версией расписания
+QUEUE_SIZE = 64
+
+# Получение изменений: (since, group_id, teacher_id) -> изменения
+FetchChanges = Callable[
+    [int, Optional[int], Optional[int]], Awaitable[ScheduleChangesData]
+]
+
+
+class Subscription:
+    '''Подписка на изменения расписания группы group_id
+    и/или преподавателя teacher_id (None - без фильтра)'''
+    def __init__(
+        self,
+        group_id: Optional[int],
+        teacher_id: Optional[int]
+    ) -> None:
+        self.group_id = group_id
+        self.teacher_id = teacher_id
+        # Версия расписания, изменения до которой подписчик уже получил
+        # (None - первое сообщение ещё не получено)
+        self.version: Optional[int] = None
+        # Подписчик отстал, сообщения ему больше не отправляются
+        self.lagging = False
+        # (версия, сообщение); None - подписчик отстал
+        self._queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+
+    @property
+    def key(self) -> tuple[Optional[int], Optional[int]]:
+        '''Фильтр подписки (одинаковый у подписчиков с общими сообщениями)'''
+        return self.group_id, self.teacher_id
+
+    def put(self, version: int, message: str) -> None:
+        '''Ставит сообщение с изменениями до версии version в очередь'''
+        if self.lagging:
+            return
+        try:
+            self._queue.put_nowait((version, message))
+        except asyncio.QueueFull:
+            self.drop()
+
+    def drop(self) -> None:
+        '''Отключает подписчика: очередь заменяется признаком отставания'''
+        self.lagging = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def get(self) -> Optional[str]:
+        '''Ожидает следующее сообщение. Возвращает None, если подписчик
+        отстал и должен переподключиться'''
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return None
+            version, message = item
+            # Изменения, уже вошедшие в первое сообщение, пропускаются
+            if self.version is None or version > self.version:
+                self.version = version
+                return message
+
+
+def _filtered(
+    changes: ScheduleChangesData,
+    group_id: Optional[int],
+    teacher_id: Optional[int]
+) -> ScheduleChangesData:
+    '''Изменения для подписчика с фильтром (как в get_schedule_changes):
+    изменённое занятие, которое больше не проходит фильтр, передаётся
+    как удалённое, не проходящие фильтр новые занятия не передаются'''
+    if group_id is None and teacher_id is None:
+        return changes
+    result = []
+    for change in changes.changes:
+        if change.action == ChangeAction.DELETED or (
+            (group_id is None or group_id in change.group_ids)
+            and (teacher_id is None or teacher_id in change.teacher_ids)
+        ):
+            result.append(change)
+        elif change.action == ChangeAction.UPDATED:
+            result.append(change.copy(update={
+                "action": ChangeAction.DELETED, "groups": None, "cell": None,
+                "group_ids": None, "teacher_ids": None
+            }))
+    return ScheduleChangesData.construct(
+        version=changes.version, full=False, changes=result, schedule=None
+    )
+
+
+class ScheduleBroadcaster:
+    '''Рассылка изменений расписания подписчикам процесса.
+    fetch - получение изменений (Database.get_schedule_changes)'''
+    def __init__(
+        self,
+        fetch: FetchChanges,
+        interval: float = POLL_INTERVAL
+    ) -> None:
+        self.fetch = fetch
+        self.interval = interval
+        self._subscriptions: set[Subscription] = set()
+        # Версия, до которой изменения разосланы (None - ещё не известна)
+        self._version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @contextlib.asynccontextmanager
+    async def subscribe(
+        self,
+        since: int = 0,
+        group_id: Optional[int] = None,
+        teacher_id: Optional[int] = None
+    ) -> AsyncIterator[tuple[Subscription, str]]:
+        '''Подписывает на изменения. Возвращает подписку и первое сообщение -
+        изменения после версии since (или всё расписание, см.
+        get_schedule_changes). Опрос журнала выполняется, пока есть
+        подписчики'''
+        subscription = Subscription(group_id, teacher_id)
+        # Подписка регистрируется до получения первого сообщения, поэтому
+        # изменения между ними не теряются
+        self._subscriptions.add(subscription)
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll())
+        try:
+            initial = await self.fetch(since, group_id, teacher_id)
+            subscription.version = initial.version
+            yield subscription, to_json(initial).decode()
+        finally:
+            self._subscriptions.discard(subscription)
+            if not self._subscriptions and self._task is not None:
+                self._task.cancel()
+                self._task = None
+                self._version = None
+
+    async def _poll(self) -> None:
+        '''Опрашивает журнал изменений и рассылает новые изменения'''
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._version is None:
+                # Рассылка начинается с наименьшей версии подписчиков,
+                # получивших первое сообщение
+                versions = [
+                    s.version for s in self._subscriptions if s.version is not None
+                ]
+                if not versions:
+                    continue
+                self._version = min(versions)
+            try:
+                changes = await self.fetch(self._version, None, None)
+            except Exception:
+                logging.exception("Ошибка получения изменений расписания")
+                continue
+            if changes.version != self._version:
+                self._publish(changes)
+                self._version = changes.version
+
+    def _publish(self, changes: ScheduleChangesData) -> None:
+        '''Рассылает изменения; сообщение строится один раз для каждого
+        фильтра подписок'''
+        messages = {}
+        for subscription in list(self._subscriptions):
+            if changes.full:
+                # Изменения уже удалены из журнала: подписчик
+                # переподключается и получает расписание заново
+                subscription.drop()
+                continue
+            key = subscription.key
+            if key not in messages:
+                filtered = _filtered(changes, *key)
+                messages[key] = to_json(filtered).decode() \
+                    if filtered.changes else None
+            if messages[key] is not None:
+                subscription.put(changes.version, messages[key])
@@ -0,0 +1,62 @@
+#
+#
+#
+
+'''Модуль определяет кэш результатов, привязанный к версии данных'''
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class VersionedCache:
+    '''Кэш значений по ключу. Значение действительно, пока не изменилась
+    версия данных, из которых оно построено. Если несколько потоков
+    одновременно запрашивают устаревшее значение, его строит только один
+    из них, остальные ждут и получают готовый результат.
+    Хранится не более max_entries значений (давно не запрашиваемые
+    удаляются первыми)'''
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[int, Any]] = OrderedDict()
+        self._key_locks: dict[Hashable, threading.Lock] = {}
+
+    def _lookup(self, key: Hashable, version: int) -> tuple[bool, Any]:
+        '''Возвращает (найдено ли значение для версии, значение)'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return True, entry[1]
+        return False, None
+
+    def get(self, key: Hashable, version: int, build: Callable[[], Any]) -> Any:
+        '''Возвращает значение для версии version, при необходимости строит
+        его вызовом build'''
+        found, value = self._lookup(key, version)
+        if found:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Пока ожидали блокировку, значение мог построить другой поток
+            found, value = self._lookup(key, version)
+            if found:
+                return value
+            value = build()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None or entry[0] <= version:
+                    self._entries[key] = (version, value)
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    if evicted != key:
+                        self._key_locks.pop(evicted, None)
+            return value
+
+    def clear(self) -> None:
+        '''Удаляет все значения'''
+        with self._lock:
+            self._entries.clear()
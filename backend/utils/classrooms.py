@@ -0,0 +1,38 @@
+#
+#
+#
+
+'''Модуль определяет индекс аудиторий по вместимости для выбора
+наименьшей подходящей аудитории'''
+
+from bisect import bisect_left
+from typing import Iterable, Optional
+
+
+class ClassroomIndex:
+    '''Аудитории, упорядоченные по вместимости. Принимает строки
+    с полями id, capacity, faculty_id, department_id (см. ClassroomRow)'''
+    def __init__(self, classrooms: Iterable) -> None:
+        self._rooms = sorted(classrooms, key=lambda room: (room.capacity, room.id))
+        self._capacities = [room.capacity for room in self._rooms]
+
+    def suitable(
+        self,
+        students: int,
+        department_id: Optional[int] = None,
+        faculty_id: Optional[int] = None
+    ) -> list[int]:
+        '''Возвращает id аудиторий вместимостью не меньше students
+        от наименьшей к наибольшей. Среди аудиторий равной вместимости
+        первыми идут аудитории кафедры department_id, затем факультета
+        faculty_id'''
+        rooms = self._rooms[bisect_left(self._capacities, students):]
+        if department_id is not None or faculty_id is not None:
+            # Сортировка устойчива: при равном приоритете порядок по id
+            rooms = sorted(rooms, key=lambda room: (
+                room.capacity,
+                0 if department_id is not None and room.department_id == department_id
+                else 1 if faculty_id is not None and room.faculty_id == faculty_id
+                else 2
+            ))
+        return [room.id for room in rooms]
@@ -0,0 +1,204 @@
+#
+#
+#
+
+'''Модуль определяет поиск коллизий (наложений занятий) и окон в расписании.
+Занятия разворачиваются в плоский массив строк
+(вид сущности, id сущности, неделя, день, пара, id занятия), который
+сортируется один раз, после чего наложения и окна находятся сравнением
+соседних строк'''
+
+from collections import defaultdict
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+# Виды сущностей
+GROUP = 0
+TEACHER = 1
+CLASSROOM = 2
+
+KIND_NAMES = {GROUP: "group", TEACHER: "teacher", CLASSROOM: "classroom"}
+
+# Строка занятости: вид сущности, id сущности, неделя, день, пара, id занятия
+OccupancyRow = tuple[int, int, int, int, int, int]
+
+
+def lesson_rows(
+    lesson_id: int,
+    week: int,
+    day: int,
+    pair: int,
+    group_ids: list[int],
+    teacher_ids: list[int],
+    classroom_id: int
+) -> list[OccupancyRow]:
+    '''Разворачивает занятие в строки занятости: по строке на каждую
+    группу, преподавателя и аудиторию'''
+    slot = (week, day, pair, lesson_id)
+    return [
+        *((GROUP, group_id, *slot) for group_id in group_ids),
+        *((TEACHER, teacher_id, *slot) for teacher_id in teacher_ids),
+        (CLASSROOM, classroom_id, *slot)
+    ]
+
+
+def find_collisions(rows: Iterable[OccupancyRow]) -> dict:
+    '''Возвращает наложения занятий (errors) и окна групп и преподавателей
+    (group_windows, teacher_windows). Результат упорядочен по виду
+    сущности, id сущности, неделе, дню и паре'''
+    data = np.array(list(rows), dtype=np.int64).reshape(-1, 6)
+    kind, entity, week, day, pair, lesson = data.T
+    order = np.lexsort((lesson, pair, day, week, entity, kind))
+    kind, entity, week, day, pair, lesson = (
+        kind[order], entity[order], week[order],
+        day[order], pair[order], lesson[order]
+    )
+
+    # Соседние строки одной сущности в один и тот же день
+    same_day = (
+        (kind[1:] == kind[:-1]) & (entity[1:] == entity[:-1])
+        & (week[1:] == week[:-1]) & (day[1:] == day[:-1])
+    )
+    gap = pair[1:] - pair[:-1] - 1
+
+    errors = [
+        {
+            "type": KIND_NAMES[k],
+            "id": e,
+            "week": w,
+            "day": d,
+            "pair": p,
+            "lesson_ids": [prev_lesson, next_lesson]
+        }
+        for k, e, w, d, p, prev_lesson, next_lesson in _pick(
+            np.flatnonzero(same_day & (gap == -1)),
+            kind, entity, week, day, pair, lesson
+        )
+    ]
+
+    windows = {GROUP: [], TEACHER: []}
+    id_keys = {GROUP: "group_id", TEACHER: "teacher_id"}
+    for k, e, w, d, p, prev_pair, _ in _pick(
+        np.flatnonzero(same_day & (gap > 0) & (kind[1:] != CLASSROOM)),
+        kind, entity, week, day, pair, pair
+    ):
+        windows[k].append({
+            id_keys[k]: e,
+            "week": w,
+            "day": d,
+            "window_start_pair": prev_pair,
+            "window_end_pair": p,
+            "window_size": p - prev_pair - 1
+        })
+
+    return {
+        "errors": errors,
+        "group_windows": windows[GROUP],
+        "teacher_windows": windows[TEACHER]
+    }
+
+
+def _pick(
+    positions: np.ndarray,
+    kind: np.ndarray,
+    entity: np.ndarray,
+    week: np.ndarray,
+    day: np.ndarray,
+    pair: np.ndarray,
+    previous: np.ndarray
+) -> zip:
+    '''Для пар соседних строк (positions, positions + 1) возвращает кортежи
+    (вид, id, неделя, день, пара второй строки, previous первой строки,
+    previous второй строки) из чисел Python'''
+    following = positions + 1
+    return zip(
+        kind[following].tolist(),
+        entity[following].tolist(),
+        week[following].tolist(),
+        day[following].tolist(),
+        pair[following].tolist(),
+        previous[positions].tolist(),
+        previous[following].tolist()
+    )
+
+
+class CollisionIndex:
+    '''Инкрементально поддерживаемый индекс занятости ячеек расписания.
+    Отвечает, свободна ли пара для групп, преподавателей и аудитории,
+    за O(1) и хранит отчёт find_collisions до следующего изменения'''
+    def __init__(self, rows: Iterable[OccupancyRow] = ()) -> None:
+        # (вид, id сущности, неделя, день, пара) -> id занятий
+        self._slots = defaultdict(set)
+        # id занятия -> строки занятости
+        self._rows = defaultdict(list)
+        self._report = None
+        for row in rows:
+            self._insert(row)
+
+    def _insert(self, row: OccupancyRow) -> None:
+        '''Добавляет строку занятости'''
+        self._slots[row[:5]].add(row[5])
+        self._rows[row[5]].append(row)
+
+    def add(
+        self,
+        lesson_id: int,
+        week: int,
+        day: int,
+        pair: int,
+        group_ids: list[int],
+        teacher_ids: list[int],
+        classroom_id: int
+    ) -> None:
+        '''Добавляет занятие в индекс'''
+        for row in lesson_rows(
+            lesson_id, week, day, pair, group_ids, teacher_ids, classroom_id
+        ):
+            self._insert(row)
+        self._report = None
+
+    def remove(self, lesson_id: int) -> None:
+        '''Удаляет занятие из индекса'''
+        for row in self._rows.pop(lesson_id, []):
+            lessons = self._slots[row[:5]]
+            lessons.discard(lesson_id)
+            if not lessons:
+                del self._slots[row[:5]]
+        self._report = None
+
+    def conflicts(
+        self,
+        week: int,
+        day: int,
+        pair: int,
+        group_ids: list[int],
+        teacher_ids: list[int],
+        classroom_id: int,
+        ignore_lesson_id: Optional[int] = None
+    ) -> list[dict]:
+        '''Возвращает занятые в заданную пару сущности в виде
+        {"type", "id", "lesson_ids"}. Занятие ignore_lesson_id не учитывается
+        (используется при изменении ячейки)'''
+        result = []
+        for kind, entity_id, *_ in lesson_rows(
+            ignore_lesson_id, week, day, pair, group_ids, teacher_ids, classroom_id
+        ):
+            lessons = self._slots.get((kind, entity_id, week, day, pair), set())
+            lessons = lessons - {ignore_lesson_id}
+            if lessons:
+                result.append({
+                    "type": KIND_NAMES[kind],
+                    "id": entity_id,
+                    "lesson_ids": sorted(lessons)
+                })
+        return result
+
+    def report(self) -> dict:
+        '''Возвращает результат find_collisions для текущего состояния'''
+        if self._report is None:
+            self._report = find_collisions(
+                row for rows in self._rows.values() for row in rows
+            )
+        return self._report
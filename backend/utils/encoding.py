@@ -0,0 +1,51 @@
+#
+#
+#
+
+'''Модуль определяет быструю сериализацию ответов веб-API в JSON (orjson)
+и MessagePack. Модели pydantic сериализуются по их полям без повторной
+проверки данных'''
+
+from typing import Any, Optional
+
+import msgpack
+import orjson
+from pydantic import BaseModel
+
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+# Типы MessagePack, которые могут указывать клиенты в заголовке Accept
+_MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+
+
+def _fields(obj: Any) -> dict:
+    '''Поля модели pydantic (для вложенных моделей)'''
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError(f'Тип {type(obj).__name__} не сериализуется')
+
+
+def to_json(data: Any) -> bytes:
+    '''Сериализует данные в JSON. Ключи-числа становятся строками,
+    как и при сериализации pydantic'''
+    return orjson.dumps(data, default=_fields, option=orjson.OPT_NON_STR_KEYS)
+
+
+def to_msgpack(data: Any) -> bytes:
+    '''Сериализует данные в MessagePack'''
+    return msgpack.packb(data, default=_fields)
+
+
+def media_type_for(accept: Optional[str]) -> str:
+    '''Выбирает формат ответа по заголовку Accept: MessagePack, если клиент
+    его запросил, иначе JSON'''
+    if accept and any(media_type in accept for media_type in _MSGPACK_TYPES):
+        return MSGPACK
+    return JSON
+
+
+def encode(data: Any, media_type: str) -> bytes:
+    '''Сериализует данные в формат media_type (JSON или MSGPACK)'''
+    return to_msgpack(data) if media_type == MSGPACK else to_json(data)
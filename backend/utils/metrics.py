@@ -0,0 +1,337 @@
+#
+#
+#
+
+'''Модуль определяет метрики веб-API в текстовом формате Prometheus:
+- время выполнения, размер ответа и число запросов по маршрутам,
+число выполняющихся запросов
+- SQL-запросы, время в БД и число полученных строк на каждый запрос
+к API (события SQLAlchemy engine)
+Метрики хранятся в памяти процесса: при запуске с несколькими
+процессами каждый процесс отдаёт свои значения'''
+
+import bisect
+import contextvars
+import math
+import threading
+import time
+from typing import Optional, Sequence
+
+from sqlalchemy import Engine, event
+
+
+# Границы гистограмм
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+# Метка маршрута для запросов, не попавших ни в один маршрут
+UNMATCHED_ROUTE = 'unmatched'
+
+
+def _escape(value: str) -> str:
+    '''Экранирует значение метки'''
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    '''Метки в формате {name="value",...}'''
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    '''Значение в формате Prometheus'''
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    '''Метрика с метками labelnames. Значения хранятся по кортежам
+    значений меток'''
+    kind = 'untyped'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def samples(self) -> list[str]:
+        '''Строки со значениями метрики'''
+        raise NotImplementedError
+
+    def render(self) -> str:
+        '''Метрика в текстовом формате Prometheus'''
+        return '\n'.join([
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.kind}',
+            *self.samples()
+        ])
+
+
+class Counter(Metric):
+    '''Возрастающий счётчик'''
+    kind = 'counter'
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+            for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    '''Значение, которое может уменьшаться'''
+    kind = 'gauge'
+
+    def dec(self, labels: tuple = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    '''Гистограмма: число наблюдений не больше каждой из границ buckets,
+    сумма и число наблюдений'''
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels: tuple, value: float) -> None:
+        # Наблюдение учитывается в первом подходящем интервале,
+        # накопленные значения считаются при выводе
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # [число по интервалам (последний - +Inf), сумма]
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            counts[0][position] += 1
+            counts[1] += value
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._values.items()
+            )
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(
+                    f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+                )
+            lines.append(
+                f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}'
+            )
+            lines.append(
+                f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+            )
+        return lines
+
+
+class RequestStats:
+    '''Работа с БД в рамках одного запроса к API'''
+    __slots__ = ('queries', 'db_time', 'rows')
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+
+# Статистика текущего запроса к API. Методы БД выполняются в потоках
+# (AsyncDatabase), которые получают копию контекста запроса, а с ней -
+# тот же объект RequestStats
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = \
+    contextvars.ContextVar('request_stats', default=None)
+
+
+class _CountingCursor:
+    '''Курсор DBAPI, учитывающий полученные строки в статистике запроса.
+    Строки считаются при каждом вызове fetch*, а не для каждой строки'''
+    __slots__ = ('_cursor', '_stats')
+
+    def __init__(self, cursor, stats: RequestStats) -> None:
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+
+class AppMetrics:
+    '''Метрики веб-API'''
+    def __init__(self) -> None:
+        route = ('method', 'route')
+        self.requests = Counter(
+            'http_requests_total', 'Число запросов', (*route, 'status')
+        )
+        self.in_flight = Gauge(
+            'http_requests_in_flight', 'Число выполняющихся запросов', ('method',)
+        )
+        self.latency = Histogram(
+            'http_request_duration_seconds', 'Время выполнения запроса', route
+        )
+        self.response_size = Histogram(
+            'http_response_size_bytes', 'Размер тела ответа', route, SIZE_BUCKETS
+        )
+        self.request_queries = Histogram(
+            'http_request_db_queries', 'Число SQL-запросов на запрос',
+            route, QUERY_BUCKETS
+        )
+        self.request_db_time = Histogram(
+            'http_request_db_seconds', 'Время выполнения SQL-запросов на запрос',
+            route
+        )
+        self.request_rows = Histogram(
+            'http_request_db_rows', 'Число строк, полученных из БД, на запрос',
+            route, ROW_BUCKETS
+        )
+        self.queries = Counter(
+            'db_queries_total', 'Число SQL-запросов (в т.ч. вне запросов к API)'
+        )
+        self.db_time = Counter(
+            'db_query_seconds_total', 'Время выполнения SQL-запросов'
+        )
+        self.metrics: list[Metric] = [
+            self.requests, self.in_flight, self.latency, self.response_size,
+            self.request_queries, self.request_db_time, self.request_rows,
+            self.queries, self.db_time
+        ]
+
+    def render(self) -> str:
+        '''Все метрики в текстовом формате Prometheus'''
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+    def instrument_engine(self, engine: Engine) -> None:
+        '''Подключает учёт SQL-запросов engine. В запросах к API курсор
+        результата заменяется на _CountingCursor, считающий полученные
+        строки (драйвер SQLite не сообщает их число заранее)'''
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['query_started'].pop()
+            self.queries.inc()
+            self.db_time.inc(amount=elapsed)
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.queries += 1
+                stats.db_time += elapsed
+                # Результат (CursorResult) получает строки через
+                # context.cursor
+                if context is not None and not executemany \
+                        and cursor.description is not None:
+                    context.cursor = _CountingCursor(cursor, stats)
+
+    def observe_request(
+        self,
+        scope: dict,
+        status: int,
+        started: float,
+        size: int,
+        stats: RequestStats
+    ) -> None:
+        '''Учитывает завершённый запрос'''
+        route = scope.get('route')
+        labels = (scope['method'], getattr(route, 'path', UNMATCHED_ROUTE))
+        self.requests.inc((*labels, str(status)))
+        self.latency.observe(labels, time.perf_counter() - started)
+        self.response_size.observe(labels, size)
+        self.request_queries.observe(labels, stats.queries)
+        self.request_db_time.observe(labels, stats.db_time)
+        self.request_rows.observe(labels, stats.rows)
+
+
+class MetricsMiddleware:
+    '''ASGI-промежуточный слой, учитывающий HTTP-запросы в metrics.
+    Запрос считается завершённым после отправки тела ответа (фоновые
+    задачи, выполняемые после ответа, в его время не входят)'''
+    def __init__(self, app, metrics: AppMetrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        method = (scope['method'],)
+        metrics.in_flight.inc(method)
+        response = {'status': 500, 'size': 0, 'done': False}
+
+        def finish() -> None:
+            if not response['done']:
+                response['done'] = True
+                metrics.in_flight.dec(method)
+                metrics.observe_request(
+                    scope, response['status'], started, response['size'], stats
+                )
+
+        async def send_wrapper(message) -> None:
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+                if not message.get('more_body', False):
+                    await send(message)
+                    finish()
+                    return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            _request_stats.reset(token)
@@ -0,0 +1,184 @@
+#
+#
+#
+
+'''Модуль определяет жадное размещение занятий и его многократный запуск
+с разными порядками занятий и пар в пуле процессов. Задача передаётся
+процессам один раз - при их запуске - в виде SchedulingProblem'''
+
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+from utils.occupancy import ScheduleOccupancy, Slot, WEEKS, DAYS, PAIRS
+from utils.optimizer import ScheduleOptimizer, ScheduleItem
+
+
+# Существующее занятие: неделя, день, пара, id групп, id преподавателей,
+# id аудитории
+FixedLesson = tuple[int, int, int, list[int], list[int], int]
+
+
+class SchedulingProblem(NamedTuple):
+    '''Задача составления расписания (без обращений к БД):
+    - items - размещаемые занятия в порядке жадного размещения
+    - classrooms - {id аудитории: вместимость}
+    - existing - существующие занятия, они не перемещаются
+    - group_ids, teacher_ids - id всех групп и преподавателей'''
+    items: list[ScheduleItem]
+    classrooms: dict[int, int]
+    existing: list[FixedLesson]
+    group_ids: list[int]
+    teacher_ids: list[int]
+
+
+def place_greedy(
+    problem: SchedulingProblem,
+    order: Optional[list[int]] = None,
+    slot_order: Optional[np.ndarray] = None,
+    progress: Optional[Callable[[int, Optional[Slot]], None]] = None
+) -> list[Optional[Slot]]:
+    '''Размещает занятия по очереди в первую свободную ячейку.
+    order - порядок размещения (номера занятий problem.items),
+    slot_order - порядок просмотра пар (см. ScheduleOccupancy.find_slot),
+    progress - вызывается после каждого занятия с его номером и ячейкой.
+    Возвращает ячейку для каждого занятия (None - не размещено)'''
+    occupancy = ScheduleOccupancy(
+        problem.group_ids, problem.teacher_ids, problem.classrooms
+    )
+    for lesson in problem.existing:
+        occupancy.occupy(*lesson)
+    slots = [None] * len(problem.items)
+    for number in order if order is not None else range(len(problem.items)):
+        item = problem.items[number]
+        slot = occupancy.find_slot(
+            item.group_ids, item.teacher_ids, item.classroom_ids, slot_order
+        )
+        slots[number] = slot
+        if slot is not None:
+            occupancy.occupy(
+                *slot[:3], item.group_ids, item.teacher_ids, slot[3]
+            )
+        if progress is not None:
+            progress(number, slot)
+    return slots
+
+
+def score(problem: SchedulingProblem, slots: list[Optional[Slot]]) -> int:
+    '''Штраф решения (см. utils.optimizer): наложения, неразмещённые
+    занятия, окна и превышение вместимости аудиторий'''
+    optimizer = ScheduleOptimizer(problem.items, problem.classrooms)
+    for lesson in problem.existing:
+        optimizer.occupy(*lesson)
+    return optimizer.load(slots)
+
+
+def randomized_start(
+    problem: SchedulingProblem,
+    seed: int
+) -> list[Optional[Slot]]:
+    '''Жадное размещение со случайными возмущениями: занятия упорядочены
+    по сложности (число студентов и групп) с шумом, дни двухнедельного
+    цикла просматриваются в случайном порядке, пары внутри дня -
+    по возрастанию'''
+    rng = random.Random(seed)
+    order = sorted(
+        range(len(problem.items)),
+        key=lambda number: (
+            -problem.items[number].students * rng.uniform(0.7, 1.3),
+            -len(problem.items[number].group_ids),
+            rng.random()
+        )
+    )
+    days = list(range(WEEKS * DAYS))
+    rng.shuffle(days)
+    slot_order = np.array(
+        [day * PAIRS + pair for day in days for pair in range(PAIRS)],
+        dtype=np.intp
+    )
+    return place_greedy(problem, order, slot_order)
+
+
+# Задача рабочего процесса пула (задаётся при запуске процесса)
+_worker_problem: Optional[SchedulingProblem] = None
+
+
+def _init_worker(problem: SchedulingProblem) -> None:
+    '''Сохраняет задачу в рабочем процессе'''
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _run_start(seed: Optional[int]) -> tuple[int, list[Optional[Slot]]]:
+    '''Один запуск в рабочем процессе: seed=None - жадное размещение
+    без возмущений. Возвращает (штраф, решение)'''
+    if seed is None:
+        slots = place_greedy(_worker_problem)
+    else:
+        slots = randomized_start(_worker_problem, seed)
+    return score(_worker_problem, slots), slots
+
+
+def multistart(
+    problem: SchedulingProblem,
+    starts: Optional[int] = None,
+    seed: Optional[int] = None,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[int, int, list[Optional[Slot]]], None]] = None
+) -> list[Optional[Slot]]:
+    '''Выполняет starts жадных размещений (первое - без возмущений,
+    остальные - randomized_start) в пуле из workers процессов и
+    возвращает решение с наименьшим штрафом.
+    По умолчанию starts и workers - число ядер процессора.
+    progress - вызывается после каждого запуска с числом завершённых
+    запусков, общим числом запусков и лучшим решением на данный момент'''
+    cores = os.cpu_count() or 1
+    starts = max(starts or cores, 1)
+    workers = min(workers or cores, starts)
+    rng = random.Random(seed)
+    seeds = [None] + [rng.getrandbits(64) for _ in range(starts - 1)]
+
+    best = None
+    if workers == 1:
+        _init_worker(problem)
+        try:
+            for done, start_seed in enumerate(seeds, 1):
+                best = _better(best, _run_start(start_seed))
+                if progress is not None:
+                    progress(done, starts, best[1])
+        finally:
+            _init_worker(None)
+        return best[1]
+
+    # spawn: процесс вызывается из потока веб-сервера, а fork
+    # многопоточного процесса небезопасен
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(problem,)
+    )
+    try:
+        for done, result in enumerate(executor.map(_run_start, seeds), 1):
+            best = _better(best, result)
+            if progress is not None:
+                progress(done, starts, best[1])
+    finally:
+        # При прерывании (в т.ч. из progress) оставшиеся запуски отменяются
+        executor.shutdown(cancel_futures=True)
+    return best[1]
+
+
+def _better(
+    best: Optional[tuple[int, list[Optional[Slot]]]],
+    result: tuple[int, list[Optional[Slot]]]
+) -> tuple[int, list[Optional[Slot]]]:
+    '''Лучший из двух результатов (штраф, решение); при равном штрафе -
+    более ранний'''
+    if best is None or result[0] < best[0]:
+        return result
+    return best
@@ -0,0 +1,117 @@
+#
+#
+#
+
+'''Модуль определяет занятость групп, преподавателей и аудиторий в виде
+плотных булевых массивов с индексами [неделя, день, пара, сущность]'''
+
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+WEEKS = 2   # Недели 1 и 2
+DAYS = 6    # Понедельник-суббота
+PAIRS = 8   # Пары 1-8
+
+# Ячейка расписания: неделя, день, пара, id аудитории (всё с единицы)
+Slot = tuple[int, int, int, int]
+
+
+class OccupancyGrid:
+    '''Занятость сущностей одного вида (групп, преподавателей или аудиторий).
+    busy[week - 1, day - 1, pair - 1, column] - занята ли сущность,
+    column - номер столбца сущности (см. index)'''
+    def __init__(self, ids: Iterable[int]) -> None:
+        self.index = {entity_id: column for column, entity_id in enumerate(ids)}
+        self.busy = np.zeros((WEEKS, DAYS, PAIRS, len(self.index)), dtype=bool)
+
+    def columns(self, ids: Iterable[int]) -> np.ndarray:
+        '''Возвращает номера столбцов сущностей. Неизвестные сущности
+        (добавленные после построения сетки) получают новые столбцы'''
+        missing = [entity_id for entity_id in ids if entity_id not in self.index]
+        if missing:
+            for entity_id in dict.fromkeys(missing):
+                self.index[entity_id] = len(self.index)
+            extra = len(self.index) - self.busy.shape[3]
+            self.busy = np.concatenate(
+                (self.busy, np.zeros((WEEKS, DAYS, PAIRS, extra), dtype=bool)),
+                axis=3
+            )
+        return np.fromiter(
+            (self.index[entity_id] for entity_id in ids), dtype=np.intp
+        )
+
+    def busy_slots(self, ids: list[int]) -> np.ndarray:
+        '''Маска [неделя, день, пара], в которые занята хотя бы одна
+        из сущностей ids'''
+        if not ids:
+            return np.zeros((WEEKS, DAYS, PAIRS), dtype=bool)
+        return self.busy[..., self.columns(ids)].any(axis=3)
+
+    def occupy(self, week: int, day: int, pair: int, ids: list[int]) -> None:
+        '''Отмечает сущности ids занятыми в заданную пару'''
+        if ids:
+            self.busy[week - 1, day - 1, pair - 1, self.columns(ids)] = True
+
+
+class ScheduleOccupancy:
+    '''Занятость групп, преподавателей и аудиторий для составления
+    расписания. Поиск свободной ячейки выполняется векторно по всем
+    96 парам двухнедельного цикла сразу'''
+    def __init__(
+        self,
+        group_ids: Iterable[int],
+        teacher_ids: Iterable[int],
+        classroom_ids: Iterable[int]
+    ) -> None:
+        self.groups = OccupancyGrid(group_ids)
+        self.teachers = OccupancyGrid(teacher_ids)
+        self.classrooms = OccupancyGrid(classroom_ids)
+
+    def occupy(
+        self,
+        week: int,
+        day: int,
+        pair: int,
+        group_ids: list[int],
+        teacher_ids: list[int],
+        classroom_id: int
+    ) -> None:
+        '''Отмечает занятие в расписании'''
+        self.groups.occupy(week, day, pair, group_ids)
+        self.teachers.occupy(week, day, pair, teacher_ids)
+        self.classrooms.occupy(week, day, pair, [classroom_id])
+
+    def find_slot(
+        self,
+        group_ids: list[int],
+        teacher_ids: list[int],
+        classroom_ids: list[int],
+        slot_order: Optional[np.ndarray] = None
+    ) -> Optional[Slot]:
+        '''Возвращает первую (в порядке неделя, день, пара) ячейку, в которой
+        свободны все группы, все преподаватели и хотя бы одна из аудиторий
+        classroom_ids. Из свободных аудиторий выбирается первая по порядку
+        classroom_ids. Если ячейки нет - None.
+        slot_order - иной порядок просмотра пар: перестановка номеров пар
+        двухнедельного цикла (с нуля)'''
+        if not classroom_ids:
+            return None
+        free = ~(
+            self.groups.busy_slots(group_ids)
+            | self.teachers.busy_slots(teacher_ids)
+        )
+        rooms_free = ~self.classrooms.busy[..., self.classrooms.columns(classroom_ids)]
+        feasible = (free[..., None] & rooms_free).reshape(-1, len(classroom_ids))
+        if slot_order is not None:
+            feasible = feasible[slot_order]
+        slot_ok = feasible.any(axis=1)
+        slot = int(slot_ok.argmax())
+        if not slot_ok[slot]:
+            return None
+        room = int(feasible[slot].argmax())
+        if slot_order is not None:
+            slot = int(slot_order[slot])
+        week, day, pair = np.unravel_index(slot, (WEEKS, DAYS, PAIRS))
+        return int(week) + 1, int(day) + 1, int(pair) + 1, classroom_ids[room]
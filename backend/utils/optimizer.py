@@ -0,0 +1,324 @@
+#
+#
+#
+
+'''Модуль определяет улучшение расписания имитацией отжига.
+Решение - ячейка (неделя, день, пара, аудитория) для каждого размещаемого
+занятия или None, если занятие не размещено. Штраф решения складывается из:
+- наложений (одна группа, преподаватель или аудитория на двух занятиях)
+- неразмещённых занятий
+- окон групп и преподавателей (число пустых пар между занятиями дня)
+Занятия размещаются только в аудиториях достаточной вместимости;
+занятия, для которых таких аудиторий нет, не размещаются.
+Занятость хранится счётчиками по (сущность, пара), поэтому изменение
+штрафа при перемещении занятия считается за время, не зависящее от размера
+расписания'''
+
+import math
+import random
+import time
+from typing import Callable, NamedTuple, Optional
+
+from utils.collisions import GROUP, TEACHER, CLASSROOM
+from utils.occupancy import WEEKS, DAYS, PAIRS, Slot
+
+
+# Число пар двухнедельного цикла
+SLOTS = WEEKS * DAYS * PAIRS
+
+# Температура в начале и в конце отжига (в единицах штрафа)
+START_TEMPERATURE = 5.0
+END_TEMPERATURE = 0.05
+
+# Через сколько итераций проверяется время и пересчитывается температура
+CHECK_EVERY = 256
+
+
+class Weights(NamedTuple):
+    '''Веса составляющих штрафа'''
+    conflict: int = 1000
+    unplaced: int = 100
+    window: int = 1
+
+
+class ScheduleItem(NamedTuple):
+    '''Размещаемое занятие'''
+    group_ids: list[int]
+    teacher_ids: list[int]
+    students: int
+    # Аудитории достаточной вместимости
+    classroom_ids: list[int]
+
+
+def _window_cost(mask: int) -> int:
+    '''Число пустых пар между первой и последней занятой парой дня.
+    mask - битовая маска занятых пар'''
+    if not mask:
+        return 0
+    first = (mask & -mask).bit_length()
+    last = mask.bit_length()
+    return last - first + 1 - bin(mask).count('1')
+
+
+WINDOW_COSTS = [_window_cost(mask) for mask in range(1 << PAIRS)]
+
+
+def slot_index(week: int, day: int, pair: int) -> int:
+    '''Номер пары в двухнедельном цикле (с нуля)'''
+    return ((week - 1) * DAYS + (day - 1)) * PAIRS + (pair - 1)
+
+
+class ScheduleOptimizer:
+    '''Улучшение расписания имитацией отжига. Уже существующие занятия
+    отмечаются методом occupy и не перемещаются, занятия items
+    размещаются методом run'''
+    def __init__(
+        self,
+        items: list[ScheduleItem],
+        classrooms: dict[int, int],
+        weights: Weights = Weights()
+    ) -> None:
+        '''classrooms - {id аудитории: вместимость}'''
+        self.items = items
+        self.weights = weights
+        self.room_ids = list(classrooms)
+        # Занятия, для которых есть аудитории достаточной вместимости
+        self._placeable = [
+            item for item, data in enumerate(items) if data.classroom_ids
+        ]
+
+        # Столбец каждой сущности (вид, id) в счётчиках занятости
+        self._columns: dict[tuple[int, int], int] = {}
+        # Учитываются ли окна для столбца (для аудиторий - нет)
+        self._windowed: list[bool] = []
+        # counts[column * SLOTS + slot] - число занятий сущности в паре
+        self._counts: list[int] = []
+        # masks[column * WEEKS * DAYS + день цикла] - занятые пары дня
+        self._masks: list[int] = []
+
+        self._people = [
+            [self._column(GROUP, group_id) for group_id in item.group_ids]
+            + [self._column(TEACHER, teacher_id) for teacher_id in item.teacher_ids]
+            for item in items
+        ]
+        self._rooms = {
+            room_id: self._column(CLASSROOM, room_id) for room_id in self.room_ids
+        }
+        # Текущее решение: (номер пары, id аудитории) или None
+        self._solution: list[Optional[tuple[int, int]]] = [None] * len(items)
+        self.cost = weights.unplaced * len(items)
+        # Число размещённых занятий
+        self.placed = 0
+
+    def _column(self, kind: int, entity_id: int) -> int:
+        '''Возвращает столбец сущности, при необходимости добавляет его'''
+        column = self._columns.get((kind, entity_id))
+        if column is None:
+            column = self._columns[(kind, entity_id)] = len(self._windowed)
+            self._windowed.append(kind != CLASSROOM)
+            self._counts.extend([0] * SLOTS)
+            self._masks.extend([0] * (WEEKS * DAYS))
+        return column
+
+    def _add(self, column: int, slot: int) -> int:
+        '''Отмечает сущность занятой в паре, возвращает изменение штрафа'''
+        position = column * SLOTS + slot
+        count = self._counts[position]
+        self._counts[position] = count + 1
+        if count:
+            return self.weights.conflict
+        if not self._windowed[column]:
+            return 0
+        day, pair = divmod(slot, PAIRS)
+        position = column * WEEKS * DAYS + day
+        old = self._masks[position]
+        new = self._masks[position] = old | (1 << pair)
+        return self.weights.window * (WINDOW_COSTS[new] - WINDOW_COSTS[old])
+
+    def _remove(self, column: int, slot: int) -> int:
+        '''Освобождает сущность в паре, возвращает изменение штрафа'''
+        position = column * SLOTS + slot
+        count = self._counts[position] - 1
+        self._counts[position] = count
+        if count:
+            return -self.weights.conflict
+        if not self._windowed[column]:
+            return 0
+        day, pair = divmod(slot, PAIRS)
+        position = column * WEEKS * DAYS + day
+        old = self._masks[position]
+        new = self._masks[position] = old & ~(1 << pair)
+        return self.weights.window * (WINDOW_COSTS[new] - WINDOW_COSTS[old])
+
+    def _place(self, item: int, slot: int, room_id: int) -> int:
+        '''Размещает неразмещённое занятие, возвращает изменение штрафа'''
+        delta = self._add(self._rooms[room_id], slot)
+        for column in self._people[item]:
+            delta += self._add(column, slot)
+        delta -= self.weights.unplaced
+        self._solution[item] = (slot, room_id)
+        self.placed += 1
+        self.cost += delta
+        return delta
+
+    def _unplace(self, item: int) -> int:
+        '''Снимает занятие с расписания, возвращает изменение штрафа'''
+        placement = self._solution[item]
+        if placement is None:
+            return 0
+        slot, room_id = placement
+        delta = self._remove(self._rooms[room_id], slot)
+        for column in self._people[item]:
+            delta += self._remove(column, slot)
+        delta += self.weights.unplaced
+        self._solution[item] = None
+        self.placed -= 1
+        self.cost += delta
+        return delta
+
+    def _assign(self, item: int, placement: Optional[tuple[int, int]]) -> int:
+        '''Переносит занятие в placement (None - снять с расписания),
+        возвращает изменение штрафа'''
+        delta = self._unplace(item)
+        if placement is not None:
+            delta += self._place(item, *placement)
+        return delta
+
+    def occupy(
+        self,
+        week: int,
+        day: int,
+        pair: int,
+        group_ids: list[int],
+        teacher_ids: list[int],
+        classroom_id: int
+    ) -> None:
+        '''Отмечает существующее (неперемещаемое) занятие'''
+        slot = slot_index(week, day, pair)
+        columns = [self._column(GROUP, group_id) for group_id in group_ids]
+        columns += [self._column(TEACHER, teacher_id) for teacher_id in teacher_ids]
+        columns.append(self._column(CLASSROOM, classroom_id))
+        for column in columns:
+            self.cost += self._add(column, slot)
+
+    def load(self, slots: list[Optional[Slot]]) -> int:
+        '''Делает текущим решение slots, возвращает его штраф'''
+        for item, slot in enumerate(slots):
+            placement = None
+            if slot is not None:
+                week, day, pair, room_id = slot
+                placement = (slot_index(week, day, pair), room_id)
+            if placement != self._solution[item]:
+                self._assign(item, placement)
+        return self.cost
+
+    def _random_room(self, rng: random.Random, item: int) -> int:
+        '''Аудитория достаточной вместимости для занятия'''
+        return rng.choice(self.items[item].classroom_ids)
+
+    def _random_move(
+        self,
+        rng: random.Random
+    ) -> list[tuple[int, Optional[tuple[int, int]]]]:
+        '''Случайный ход: список (занятие, новое размещение)'''
+        item = rng.choice(self._placeable)
+        placement = self._solution[item]
+        choice = rng.random()
+        if choice < 0.15 and len(self._placeable) > 1:
+            # Обмен парами двух занятий (аудитории сохраняются)
+            other = rng.choice(self._placeable)
+            other_placement = self._solution[other]
+            if other != item and placement and other_placement:
+                return [
+                    (item, (other_placement[0], placement[1])),
+                    (other, (placement[0], other_placement[1]))
+                ]
+        elif choice < 0.3 and placement is not None:
+            # Смена аудитории
+            return [(item, (placement[0], self._random_room(rng, item)))]
+        elif choice < 0.32 and placement is not None:
+            return [(item, None)]
+        return [(item, (rng.randrange(SLOTS), self._random_room(rng, item)))]
+
+    def run(
+        self,
+        start: list[Optional[Slot]],
+        time_budget: float,
+        seed: Optional[int] = None,
+        progress: Optional[Callable[[int], None]] = None
+    ) -> list[Optional[Slot]]:
+        '''Улучшает начальное решение start в течение time_budget секунд.
+        seed - начальное значение генератора случайных чисел,
+        progress - периодически вызывается с числом размещённых занятий.
+        Возвращает лучшее найденное решение. Занятия, оставшиеся
+        в наложении, в нём не размещаются'''
+        self.load(start)
+        if self._placeable:
+            self._anneal(time_budget, random.Random(seed), progress)
+
+        # Занятия в наложении снимаются по одному, пока наложения не исчезнут
+        for item, placement in enumerate(self._solution):
+            if placement is None:
+                continue
+            slot, room_id = placement
+            columns = [self._rooms[room_id], *self._people[item]]
+            if any(self._counts[column * SLOTS + slot] > 1 for column in columns):
+                self._unplace(item)
+
+        result = []
+        for placement in self._solution:
+            if placement is None:
+                result.append(None)
+                continue
+            slot, room_id = placement
+            day, pair = divmod(slot, PAIRS)
+            week, day = divmod(day, DAYS)
+            result.append((week + 1, day + 1, pair + 1, room_id))
+        return result
+
+    def _anneal(
+        self,
+        time_budget: float,
+        rng: random.Random,
+        progress: Optional[Callable[[int], None]]
+    ) -> None:
+        '''Имитация отжига. По окончании текущим становится лучшее
+        найденное решение'''
+        started = time.monotonic()
+        temperature = START_TEMPERATURE
+        best_cost = self.cost
+        # Лучшее решение копируется, только когда поиск от него уходит
+        best_solution = None
+        iteration = 0
+        while True:
+            iteration += 1
+            if iteration % CHECK_EVERY == 0:
+                done = (time.monotonic() - started) / time_budget \
+                    if time_budget > 0 else 1.0
+                if done >= 1:
+                    break
+                temperature = START_TEMPERATURE * \
+                    (END_TEMPERATURE / START_TEMPERATURE) ** done
+                if progress is not None:
+                    progress(self.placed)
+
+            move = self._random_move(rng)
+            previous = [(item, self._solution[item]) for item, _ in move]
+            delta = sum(self._assign(item, placement) for item, placement in move)
+            if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+                if self.cost < best_cost:
+                    best_cost = self.cost
+                    best_solution = None
+                elif delta > 0 and best_solution is None:
+                    # Уход от лучшего решения: сохраняем его
+                    best_solution = [*self._solution]
+                    for item, placement in previous:
+                        best_solution[item] = placement
+                continue
+            for item, placement in reversed(previous):
+                self._assign(item, placement)
+
+        if best_solution is not None:
+            for item, placement in enumerate(best_solution):
+                if placement != self._solution[item]:
+                    self._assign(item, placement)
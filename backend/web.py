@@ -4,14 +4,27 @@
 
 '''Модуль отвечает за определение методов веб-API'''
 
-from typing import Tuple, Optional
+from typing import Any, Tuple, Optional
 
+import anyio
 import uvicorn
 
-from fastapi import FastAPI, HTTPException
+from fastapi import (
+    BackgroundTasks, FastAPI, HTTPException, Request, Response, WebSocket,
+    WebSocketDisconnect
+)
 from fastapi.middleware.cors import CORSMiddleware
 
-from db.main_db import Database, CourseEnum, LessonType
+from db.main_db import (
+    Database, CourseEnum, LessonType, ScheduleMode, BulkIngestData,
+    BulkIngestResult, ScheduleData, UniversityData, UniversityNodeData,
+    SubjectsData, FlowsData, CurriculumData, ClassroomData, ScheduleJobData,
+    ScheduleChangesData, SlowQueryData
+)
+from db.async_db import AsyncDatabase
+from utils.broadcast import ScheduleBroadcaster
+from utils.encoding import MSGPACK, media_type_for, encode
+from utils.metrics import AppMetrics, MetricsMiddleware
 
 
 ListenParams = Tuple[str, int]
@@ -21,6 +34,11 @@ class WebApp:
     '''Класс для настройки веб-API'''
     def __init__(self, db: Database, listen_params: ListenParams) -> None:
         self.db = db
+        # Обработчики асинхронные: методы БД выполняются в потоках через
+        # AsyncDatabase и не блокируют цикл событий
+        self.async_db = AsyncDatabase(db)
+        # Рассылка изменений расписания клиентам WebSocket этого процесса
+        self.broadcaster = ScheduleBroadcaster(self.async_db.get_schedule_changes)
         self.listen_params = listen_params
         self.app = FastAPI()
 
@@ -36,6 +54,14 @@ class WebApp:
             allow_methods=['*'],
             allow_headers=['*']
         )
+        # Метрики запросов и работы с БД (GET /metrics). Добавляется
+        # последним, т.е. оборачивает остальные промежуточные слои
+        self.metrics = AppMetrics()
+        engine = getattr(db, 'engine', None)
+        if engine is not None:
+            self.metrics.instrument_engine(engine)
+        self.app.add_middleware(MetricsMiddleware, metrics=self.metrics)
+        self.app.add_api_route('/metrics', self.get_metrics, methods=["GET"])
 
         self.app.add_api_route(
             '/structural_divizion',
@@ -50,23 +76,33 @@ class WebApp:
         self.app.add_api_route(
             '/classroom', self.add_classroom, methods=["POST"]
         )
+        self.app.add_api_route(
+            '/classroom', self.get_classrooms, methods=["GET"]
+        )
         self.app.add_api_route('/subject', self.add_subject, methods=["POST"])
         self.app.add_api_route(
-            '/subject', self.db.get_subjects, methods=["GET"]
+            '/subject', self.get_subjects, methods=["GET"]
         )
         self.app.add_api_route('/flow', self.add_flow, methods=["POST"])
-        self.app.add_api_route('/flow', self.db.get_flows, methods=["GET"])
+        self.app.add_api_route('/flow', self.get_flows, methods=["GET"])
         self.app.add_api_route(
             '/curriculum', self.add_lesson_to_plan, methods=["POST"]
         )
         self.app.add_api_route(
-            '/curriculum', self.db.get_curriculum, methods=["GET"]
+            '/curriculum', self.get_curriculum, methods=["GET"]
         )
         self.app.add_api_route(
             '/schedule', self.add_lesson_to_schedule, methods=["POST"]
         )
         self.app.add_api_route(
-            '/schedule', self.db.get_schedule, methods=["GET"]
+            '/schedule', self.get_schedule, methods=["GET"],
+            response_model=ScheduleData
+        )
+        self.app.add_api_route(
+            '/schedule/changes', self.get_schedule_changes, methods=["GET"]
+        )
+        self.app.add_api_websocket_route(
+            '/schedule/updates', self.schedule_updates
         )
         self.app.add_api_route(
             '/schedule', self.edit_schedule_cell, methods=["PUT"]
@@ -74,42 +110,66 @@ class WebApp:
         self.app.add_api_route(
             '/schedule', self.remove_schedule_cell, methods=["DELETE"]
         )
-        self.app.add_api_route('/university_data', self.db.get_university_data)
         self.app.add_api_route(
-            '/auto_create_schedule', self.db.auto_schedule, methods=["POST"]
+            '/bulk_ingest', self.bulk_ingest, methods=["POST"]
+        )
+        self.app.add_api_route('/university_data', self.get_university_data)
+        self.app.add_api_route(
+            '/university_data/{department_id}', self.get_university_subtree,
+            response_model_exclude_none=True
+        )
+        self.app.add_api_route(
+            '/auto_create_schedule', self.auto_schedule, methods=["POST"]
+        )
+        self.app.add_api_route(
+            '/jobs/{id}', self.get_schedule_job, methods=["GET"]
+        )
+        self.app.add_api_route(
+            '/jobs/{id}', self.cancel_schedule_job, methods=["DELETE"]
+        )
+        self.app.add_api_route(
+            '/find_collisions', self.find_collisions, methods=["POST"]
         )
         self.app.add_api_route(
-            '/find_collisions', self.db.find_collisions, methods=["POST"]
+            '/admin/slow_queries', self.get_slow_queries, methods=["GET"]
         )
 
-    def add_structural_divizion(
+    async def get_metrics(self) -> Response:
+        '''Возвращает метрики в текстовом формате Prometheus'''
+        return Response(
+            self.metrics.render(),
+            media_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+    async def add_structural_divizion(
         self,
         name: str,
         short_name: Optional[str] = None,
         parent_id: Optional[int] = None
     ) -> int:
-        '''Добавляет структурное подразделение. Если родительского подразделения
-        не существует или подразделеие с таким названием уже есть -
-        возвращает ошибку 404'''
+        '''Добавляет структурное подразделение: без родителя - университет,
+        в университете - факультет, в факультете - кафедру. Если
+        родительского подразделения не существует, оно является кафедрой
+        или подразделеие с таким названием уже есть - возвращает ошибку 404'''
         try:
-            return self.db.add_structural_divizion(parent_id, name, short_name)
+            return await self.async_db.add_structural_divizion(parent_id, name, short_name)
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def add_speciality(
+    async def add_speciality(
         self,
         department_id: int,
         name: str
     ) -> int:
         '''Добавляет специальность. Если родительского подразделения
-        не существует или специальность с таким названием уже есть -
-        возвращает ошибку 404'''
+        не существует, оно не является кафедрой или специальность с таким
+        названием уже есть - возвращает ошибку 404'''
         try:
-            return self.db.add_speciality(department_id, name)
+            return await self.async_db.add_speciality(department_id, name)
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def add_group(
+    async def add_group(
         self,
         speciality_id: int,
         name: str,
@@ -119,23 +179,24 @@ class WebApp:
         '''Добавляет группу. Если специальности не существует или группа с таким
         именем уже есть - возвращает ошибку 404'''
         try:
-            return self.db.add_group(speciality_id, name, course, student_count)
+            return await self.async_db.add_group(speciality_id, name, course, student_count)
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def add_teacher(
+    async def add_teacher(
         self,
         department_id: int,
         name: str
     ) -> int:
-        '''Добавляет преподавателя. Если родительской кафедры не существует или
-        преподаватель с таким ФИО уже есть - возвращает ошибку 404'''
+        '''Добавляет преподавателя. Если родительской кафедры не существует
+        (или подразделение не является кафедрой) или преподаватель с таким
+        ФИО уже есть - возвращает ошибку 404'''
         try:
-            return self.db.add_teacher(department_id, name)
+            return await self.async_db.add_teacher(department_id, name)
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def add_classroom(
+    async def add_classroom(
         self,
         faculty_id: int,
         name: str,
@@ -143,16 +204,16 @@ class WebApp:
         department_id: Optional[int] = None
     ) -> int:
         '''Добавляет аудиторию. Если родительского факультета, кафедры не
-        существует или аудитория с таким номером уже есть -
-        возвращает ошибку 404'''
+        существует, кафедра не относится к факультету или аудитория с таким
+        номером уже есть - возвращает ошибку 404'''
         try:
-            return self.db.add_classroom(
+            return await self.async_db.add_classroom(
                 faculty_id, department_id, name, capacity
             )
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def add_subject(
+    async def add_subject(
         self,
         name: str,
         short_name: str
@@ -160,19 +221,19 @@ class WebApp:
         '''Добавляет предмет. Если предмет с таким названием уже есть -
         возвращает ошибку 404. Сокращённое название может быть неуникально'''
         try:
-            return self.db.add_subject(name, short_name)
+            return await self.async_db.add_subject(name, short_name)
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def add_flow(self, groups: list[str]) -> int:
+    async def add_flow(self, groups: list[str]) -> int:
         '''Добавляет поток (список групп). Если в потоке есть несуществующие
         группы - возвращает ошибку 404'''
         try:
-            return self.db.add_flow(groups)
+            return await self.async_db.add_flow(groups)
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def add_lesson_to_plan(
+    async def add_lesson_to_plan(
         self,
         subject_id: int,
         hours: int,
@@ -190,24 +251,27 @@ class WebApp:
         
         - У группы/потока уже есть такой предмет'''
         try:
-            return self.db.add_lesson_to_plan(
+            return await self.async_db.add_lesson_to_plan(
                 subject_id, hours, primary_teacher_id,
                 secondary_teacher_id, group_id, flow_id
             )
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def add_lesson_to_schedule(
+    async def add_lesson_to_schedule(
         self,
         week: int,
         day: int,
         pair: int,
         classroom_id: int,
         curriculum_id: int,
-        lesson_type: LessonType
+        lesson_type: LessonType,
+        strict: bool = False
     ) -> int:
         '''Добавляет ячейку расписания. Если аудитории или занятия из учебного
         плана не существует либо параметр не корректен - возвращает ошибку 404.
+        В строгом режиме (strict) ошибка 404 возвращается также, если группа,
+        преподаватель или аудитория в эту пару уже заняты.
 
         Параметры:
         
@@ -217,35 +281,275 @@ class WebApp:
 
         - pair (номер пары) - от 1 до 8'''
         try:
-            return self.db.add_lesson_to_schedule(
-                week, day, pair, classroom_id, curriculum_id, lesson_type
+            return await self.async_db.add_lesson_to_schedule(
+                week, day, pair, classroom_id, curriculum_id, lesson_type, strict
             )
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def edit_schedule_cell(
+    async def get_schedule(
+        self,
+        request: Request,
+        group_id: Optional[int] = None,
+        group_name: Optional[str] = None,
+        teacher_id: Optional[int] = None,
+        classroom_id: Optional[int] = None,
+        flow_id: Optional[int] = None,
+        week: Optional[int] = None,
+        day: Optional[int] = None,
+        department_id: Optional[int] = None
+    ) -> Response:
+        '''Возвращает расписание занятий. Готовый ответ берётся из кэша БД,
+        поэтому повторные запросы без изменений расписания не перестраивают
+        и не сериализуют его заново. С заголовком
+        Accept: application/msgpack ответ возвращается в MessagePack.
+
+        Необязательные фильтры:
+
+        - group_id/group_name - расписание одной группы (с занятиями потоков)
+
+        - teacher_id - расписание преподавателя
+
+        - classroom_id - занятия в аудитории
+
+        - flow_id - занятия потока
+
+        - week, day - неделя (1 либо 2) и день (от 1 до 6)
+
+        - department_id - расписание групп подразделения (факультета,
+        кафедры) и его дочерних подразделений'''
+        filters = (
+            group_id, group_name, teacher_id, classroom_id, flow_id, week, day,
+            department_id
+        )
+        media_type = media_type_for(request.headers.get('accept'))
+        if media_type == MSGPACK:
+            content = await self.async_db.get_schedule_msgpack(*filters)
+        else:
+            content = await self.async_db.get_schedule_json(*filters)
+        return Response(content=content, media_type=media_type)
+
+    async def get_schedule_changes(
+        self,
+        request: Request,
+        since: int = 0,
+        group_id: Optional[int] = None,
+        teacher_id: Optional[int] = None
+    ) -> ScheduleChangesData:
+        '''Возвращает изменения расписания после версии since: добавленные,
+        изменённые и удалённые занятия и текущую версию (since следующего
+        запроса; версия 0 - пустое расписание). Если изменения после since
+        уже удалены из журнала, возвращается всё расписание (full = true).
+
+        Необязательные фильтры: group_id, teacher_id - изменения расписания
+        группы или преподавателя'''
+        return self._encoded(
+            request, await self.async_db.get_schedule_changes(
+                since, group_id, teacher_id
+            )
+        )
+
+    async def schedule_updates(
+        self,
+        websocket: WebSocket,
+        since: int = 0,
+        group_id: Optional[int] = None,
+        teacher_id: Optional[int] = None
+    ) -> None:
+        '''WebSocket с изменениями расписания. Первое сообщение - то же,
+        что ответ /schedule/changes с теми же параметрами, затем по мере
+        изменения расписания приходят сообщения с изменениями (в том же
+        формате). Если клиент не успевает получать сообщения, соединение
+        закрывается с кодом 1013; клиент переподключается с последней
+        полученной версией в since'''
+        await websocket.accept()
+        async with self.broadcaster.subscribe(
+            since, group_id, teacher_id
+        ) as (subscription, initial):
+            await websocket.send_text(initial)
+            async with anyio.create_task_group() as tasks:
+                async def wait_disconnect() -> None:
+                    # Сообщения клиента не используются
+                    try:
+                        while True:
+                            await websocket.receive_text()
+                    except WebSocketDisconnect:
+                        tasks.cancel_scope.cancel()
+
+                tasks.start_soon(wait_disconnect)
+                while True:
+                    message = await subscription.get()
+                    if message is None:
+                        await websocket.close(code=1013)
+                        tasks.cancel_scope.cancel()
+                        return
+                    await websocket.send_text(message)
+
+    @staticmethod
+    def _encoded(request: Request, data: Any) -> Response:
+        '''Ответ с данными, сериализованными без повторной проверки моделей,
+        в JSON либо (по заголовку Accept) в MessagePack'''
+        media_type = media_type_for(request.headers.get('accept'))
+        return Response(content=encode(data, media_type), media_type=media_type)
+
+    async def get_subjects(self) -> list[SubjectsData]:
+        '''Возвращает данные о предметах'''
+        return await self.async_db.get_subjects()
+
+    async def get_flows(self, request: Request) -> list[FlowsData]:
+        '''Возвращает данные о потоках (списках групп)'''
+        return self._encoded(request, await self.async_db.get_flows())
+
+    async def get_curriculum(
+        self,
+        request: Request,
+        department_id: Optional[int] = None
+    ) -> list[CurriculumData]:
+        '''Возвращает учебный план. department_id - только занятия групп
+        подразделения (факультета, кафедры) и его дочерних подразделений'''
+        return self._encoded(
+            request, await self.async_db.get_curriculum(department_id)
+        )
+
+    async def get_classrooms(
+        self,
+        request: Request,
+        department_id: Optional[int] = None
+    ) -> list[ClassroomData]:
+        '''Возвращает аудитории. department_id - только аудитории, доступные
+        занятиям подразделения: его собственные, его дочерних подразделений
+        и общие аудитории его факультета'''
+        return self._encoded(
+            request, await self.async_db.get_classrooms(department_id)
+        )
+
+    async def get_university_data(self, request: Request) -> list[UniversityData]:
+        '''Возвращает данные о структуре университета'''
+        return self._encoded(request, await self.async_db.get_university_data())
+
+    async def get_university_subtree(
+        self,
+        department_id: int,
+        depth: int = 1
+    ) -> UniversityNodeData:
+        '''Возвращает часть структуры университета: подразделение
+        department_id, развёрнутое на depth уровней. Для свёрнутых
+        подразделений возвращается только число дочерних записей'''
+        try:
+            return await self.async_db.get_university_subtree(department_id, depth)
+        except ValueError as exc:
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
+
+    async def auto_schedule(
+        self,
+        background_tasks: BackgroundTasks,
+        mode: ScheduleMode = ScheduleMode.GREEDY,
+        time_budget: float = 10.0,
+        seed: Optional[int] = None,
+        starts: Optional[int] = None,
+        dry_run: bool = False
+    ) -> int:
+        '''Запускает автоматическое составление расписания с учётом
+        семестровой нагрузки и сразу возвращает id задачи. Ход составления -
+        GET /jobs/{id}, отмена - DELETE /jobs/{id}. Для БД одновременно
+        выполняется только одна задача.
+        mode=annealing - жадное решение улучшается имитацией отжига
+        в течение time_budget секунд (окна, вместимость аудиторий,
+        неразмещённые занятия); mode=multistart - выбирается лучшее
+        из starts жадных размещений со случайными порядками занятий и дней,
+        выполняемых параллельно в отдельных процессах;
+        seed - для воспроизводимости результата;
+        dry_run - только вычислить размещение, не изменяя расписание.
+        Добавленные и не размещённые (с причинами) занятия возвращаются
+        в report задачи'''
+        try:
+            job_id = await self.async_db.create_schedule_job(
+                mode, time_budget, seed, starts, dry_run
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
+        # Задача выполняется после отправки ответа
+        background_tasks.add_task(self.async_db.run_schedule_job, job_id)
+        return job_id
+
+    async def get_schedule_job(self, id: int) -> ScheduleJobData:
+        '''Возвращает состояние задачи составления расписания: обработано
+        занятий учебного плана, размещено и не размещено занятий, время
+        выполнения'''
+        try:
+            return await self.async_db.get_schedule_job(id)
+        except ValueError as exc:
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
+
+    async def cancel_schedule_job(self, id: int) -> None:
+        '''Отменяет задачу составления расписания. Выполняемая задача
+        прерывается при следующем сохранении её хода, расписание
+        при этом не изменяется'''
+        try:
+            return await self.async_db.cancel_schedule_job(id)
+        except ValueError as exc:
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
+
+    async def find_collisions(self) -> dict:
+        '''Поиск коллизий и окон в расписании'''
+        return await self.async_db.find_collisions()
+
+    async def get_slow_queries(self) -> list[SlowQueryData]:
+        '''Возвращает последние медленные SQL-запросы с параметрами,
+        вызвавшим их методом и планом выполнения. Если журнал медленных
+        запросов не включён - возвращает ошибку 404'''
+        try:
+            return await self.async_db.get_slow_queries()
+        except ValueError as exc:
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
+
+    async def edit_schedule_cell(
         self,
         id: int,
         classroom_id: int,
         curriculum_id: int,
-        lesson_type: LessonType
+        lesson_type: LessonType,
+        strict: bool = False
     ) -> None:
-        '''Изменяет ячейку расписания с заданным id'''
+        '''Изменяет ячейку расписания с заданным id. В строгом режиме (strict)
+        изменение, создающее наложение занятий, отклоняется с ошибкой 404'''
         try:
-            return self.db.edit_schedule_cell(
-                id, classroom_id, curriculum_id, lesson_type
+            return await self.async_db.edit_schedule_cell(
+                id, classroom_id, curriculum_id, lesson_type, strict
             )
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
 
-    def remove_schedule_cell(self, id: int) -> None:
+    async def remove_schedule_cell(self, id: int) -> None:
         '''Удаляет ячейку расписания с заданным id'''
         try:
-            return self.db.remove_schedule_cell(id)
+            return await self.async_db.remove_schedule_cell(id)
         except ValueError as exc:
-            raise HTTPException(status_code=404, detail=exc.message) from exc
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
+
+    async def bulk_ingest(self, data: BulkIngestData) -> BulkIngestResult:
+        '''Пакетно добавляет структуру университета и учебный план в одной
+        транзакции. Строки с ошибками (несуществующие ссылки, дубликаты)
+        пропускаются и возвращаются в errors, остальные - добавляются.
+        Ссылки на записи из того же пакета указываются по названию
+        (для потоков - по ключу)'''
+        return await self.async_db.bulk_ingest(data)
 
     def serve(self) -> None:
         '''Начинает обслуживание сервера-API'''
         host, port = self.listen_params
         uvicorn.run(self.app, host=host, port=port)
+
+    @staticmethod
+    def serve_workers(
+        app_factory: str,
+        listen_params: ListenParams,
+        workers: int
+    ) -> None:
+        '''Начинает обслуживание сервера-API в workers процессах.
+        app_factory - путь к функции, создающей приложение в каждом
+        процессе (например, "main:create_app")'''
+        host, port = listen_params
+        uvicorn.run(
+            app_factory, factory=True, host=host, port=port, workers=workers
+        )
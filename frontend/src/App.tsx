@@ -5,7 +5,8 @@ import {
   ScheduleData, ClassroomType
 } from './types';
 import {
-  fetchUniversityData, fetchSubjects, fetchFlows, fetchCurriculum, fetchSchedule
+  fetchUniversityData, fetchSubjects, fetchFlows, fetchCurriculum,
+  subscribeScheduleUpdates, applyScheduleChanges
 } from './api';
 
 import { ScheduleComponent } from './components/ScheduleComponent.tsx';
@@ -52,13 +53,20 @@ function App() {
       setFlows(flowsData);
       const curriculumData = await fetchCurriculum();
       setCurriculum(curriculumData);
-      const scheduleData = await fetchSchedule();
-      setSchedule(scheduleData);
     };
 
     loadData();
   }, []);
 
+  // Расписание и его изменения, сделанные другими пользователями
+  useEffect(() => subscribeScheduleUpdates(changes => {
+    if (changes.full) {
+      setSchedule(changes.schedule || {data: {}});
+    } else {
+      setSchedule(prev => applyScheduleChanges(prev, changes.changes));
+    }
+  }), []);
+
   const handleTabClick = (tab: string) => {
     setActiveTab(tab);
   };
@@ -1,7 +1,8 @@
 // Модуль определяет взаимодействие с методами API
 
 import {
-  UniversityType, SubjectType, FlowType, CurriculumType, ScheduleData
+  UniversityType, SubjectType, FlowType, CurriculumType, ScheduleData,
+  ScheduleChangeData, ScheduleChangesData
 } from './types';
 
 
@@ -75,6 +76,63 @@ export const fetchSchedule = async (): Promise<ScheduleData> => {
   }
 };
 
+// Подписка на изменения расписания. Первое сообщение - всё расписание
+// (или все его занятия как добавленные), далее - изменения, сделанные
+// любыми пользователями. При разрыве соединения
+// подписка возобновляется с последней полученной версии.
+// Возвращает функцию отмены подписки
+export const subscribeScheduleUpdates = (
+  onChanges: (changes: ScheduleChangesData) => void
+): (() => void) => {
+  let version = 0;
+  let socket: WebSocket | null = null;
+  let stopped = false;
+
+  const connect = () => {
+    socket = new WebSocket(`ws://localhost:8000/schedule/updates?since=${version}`);
+    socket.onmessage = (event: MessageEvent) => {
+      const changes: ScheduleChangesData = JSON.parse(event.data);
+      version = changes.version;
+      onChanges(changes);
+    };
+    socket.onclose = () => {
+      if (!stopped) {
+        setTimeout(connect, 1000);
+      }
+    };
+  };
+
+  connect();
+  return () => {
+    stopped = true;
+    socket?.close();
+  };
+};
+
+// Применение изменений к расписанию (возвращает новое расписание)
+export const applyScheduleChanges = (
+  schedule: ScheduleData,
+  changes: ScheduleChangeData[]
+): ScheduleData => {
+  const data: ScheduleData['data'] = JSON.parse(JSON.stringify(schedule.data));
+  for (const change of changes) {
+    const days = data[change.week] = data[change.week] || {};
+    const pairs = days[change.day] = days[change.day] || {};
+    const cells = pairs[change.pair] = pairs[change.pair] || {};
+    for (const group of Object.keys(cells)) {
+      if (cells[group].id === change.lesson_id) {
+        delete cells[group];
+      }
+    }
+    if (change.cell && change.groups) {
+      for (const group of change.groups) {
+        cells[group] = change.cell;
+      }
+    }
+  }
+  return { data };
+};
+
 // Удаление ячейки расписания
 export const fetchRemoveSchedule = async (id: number): Promise<null> => {
   try {
@@ -100,4 +100,27 @@ export interface ScheduleData {
         }
       }
     }
-  }
\ No newline at end of file
+  }
+
+// Изменения расписания (получение через WebSocket)
+
+export type ChangeAction = "inserted" | "updated" | "deleted";
+
+// Изменение занятия расписания
+export interface ScheduleChangeData {
+  lesson_id: number;
+  action: ChangeAction;
+  week: WeekNumber;
+  day: DayNumber;
+  pair: PairNumber;
+  groups?: string[] | null;          // Группы занятия (кроме удалённых)
+  cell?: ScheduleCellData | null;    // Ячейка занятия (кроме удалённых)
+}
+
+// Изменения расписания после версии, известной клиенту
+export interface ScheduleChangesData {
+  version: number;
+  full: boolean;                     // Передано всё расписание
+  changes: ScheduleChangeData[];
+  schedule?: ScheduleData | null;
+}